@@ -0,0 +1,427 @@
+"""asyncio download engine.
+
+Keeps many requests in flight on a single event loop using plain
+asyncio streams. Bodies are streamed to disk in fixed size chunks so memory
+use per transfer stays bounded regardless of file size. URLs with a scheme
+other than http/https are handed to the urllib based downloader in a thread.
+"""
+
+import asyncio
+from functools import partial
+from http.client import BadStatusLine, HTTPException, parse_headers
+from io import BytesIO
+from urllib.parse import urljoin, urlparse
+
+from geturls.connection_pool import MAX_REDIRECTS, REDIRECT_CODES, USER_AGENT, default_ssl_context, request_path
+from geturls.dir_tools import load_partial_dir, load_temp_dir
+from geturls.download import (CHUNK_SIZE, LOOKAHEAD, collect_results, content_range, drop_segment_marker,
+                              host_key, load_range_validator, partial_size, place_completed, record_digest,
+                              save_range_validator, silent_download, status_label, temp_tasks, timestamp,
+                              with_transfer)
+from geturls.progressbar import Dashboard
+from geturls.ratelimit import HostLimiter
+from geturls.transfer_log import TransferStats, transfer_result
+from geturls.validators import NOT_MODIFIED
+# ------------------------------------------------------------------------------
+DEFAULT_JOBS = 256
+CONNECT_TIMEOUT = 30
+READ_TIMEOUT = 60
+
+
+class HTTPStatusError(Exception):
+    pass
+
+
+class MaxSizeExceeded(Exception):
+    pass
+
+
+# ------------------------------------------------------------------------------
+def parse_status_line(line):
+    """Returns: int - status code of an HTTP response status line
+
+    Raises:
+        - http.client.BadStatusLine for an empty or malformed line
+    """
+
+    parts = line.split(None, 2)
+    if len(parts) < 2 or not parts[0].startswith(b'HTTP/') or not parts[1].isdigit():
+        raise BadStatusLine(repr(line))
+    return int(parts[1])
+
+
+async def timed_read(read, timeout=READ_TIMEOUT):
+    """Awaits a stream read, raising asyncio.TimeoutError if the server
+    sends nothing for timeout seconds.
+    """
+
+    return await asyncio.wait_for(read, timeout)
+
+
+async def open_response(url, extra_headers=None):
+    """Sends GET request and reads status line and headers.
+
+    Args:
+        - url: str
+        - extra_headers: dict - additional request headers
+
+    Returns:
+        - status: int - http status code
+        - headers: http.client.HTTPMessage
+        - reader: asyncio.StreamReader - positioned at start of body
+        - writer: asyncio.StreamWriter
+    """
+
+    parts = urlparse(url)
+    https = parts.scheme == 'https'
+    port = parts.port or (443 if https else 80)
+    ssl_context = default_ssl_context() if https else None
+    path = request_path(url)
+    host = '[{}]'.format(parts.hostname) if ':' in parts.hostname else parts.hostname
+    if parts.port:
+        host = '{}:{}'.format(host, parts.port)
+
+    header_text = ''.join('{}: {}\r\n'.format(k, v) for k, v in (extra_headers or {}).items())
+    request_text = ('GET {} HTTP/1.1\r\n'
+                    'Host: {}\r\n'
+                    'User-Agent: {}\r\n'
+                    'Accept-Encoding: identity\r\n'
+                    '{}'
+                    'Connection: close\r\n\r\n').format(path, host, USER_AGENT, header_text)
+
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(parts.hostname, port, ssl=ssl_context),
+                                            CONNECT_TIMEOUT)
+    try:
+        writer.write(request_text.encode('ascii'))
+        status = parse_status_line(await timed_read(reader.readline()))
+
+        header_lines = []
+        line = await timed_read(reader.readline())
+        while line not in (b'\r\n', b'\n', b''):
+            header_lines.append(line)
+            line = await timed_read(reader.readline())
+        headers = parse_headers(BytesIO(b''.join(header_lines) + b'\r\n'))
+    except Exception:
+        writer.close()
+        raise
+
+    return status, headers, reader, writer
+
+
+async def iter_body(reader, headers, chunk_size=CHUNK_SIZE):
+    """Async generator of body chunks handling chunked and sized responses."""
+
+    if headers.get('Transfer-Encoding', '').lower() == 'chunked':
+        while True:
+            size_line = await timed_read(reader.readline())
+            size = int(size_line.split(b';', 1)[0].strip(), 16)
+            if size == 0:
+                while (await timed_read(reader.readline())) not in (b'\r\n', b'\n', b''):
+                    pass
+                return
+            while size > 0:
+                data = await timed_read(reader.readexactly(min(size, chunk_size)))
+                size -= len(data)
+                yield data
+            await timed_read(reader.readline())
+
+    elif headers.get('Content-Length', '').isdigit():
+        remaining = int(headers['Content-Length'])
+        while remaining > 0:
+            data = await timed_read(reader.read(min(remaining, chunk_size)))
+            if not data:
+                raise asyncio.IncompleteReadError(b'', remaining)
+            remaining -= len(data)
+            yield data
+
+    else:
+        while True:
+            data = await timed_read(reader.read(chunk_size))
+            if not data:
+                return
+            yield data
+
+
+async def async_download(url, filepath, chunk_size=CHUNK_SIZE, max_size=0, resume=False, validators=None,
+                         dedup=None, transfer=None, progressbar=None):
+    """Downloads url to filepath, following redirects.
+
+    Args:
+        - url: str
+        - filepath: str
+        - chunk_size: int - max bytes of body held in memory at once
+        - max_size: int - abort once file exceeds max_size bytes, 0 for no limit
+        - resume: bool - continue a partial filepath with a Range request
+        - validators: ValidatorStore instance for conditional requests
+        - dedup: DedupIndex instance to hash the body as it is written
+        - transfer: TransferStats instance recording responses
+        - progressbar: Dashboard instance showing bytes received
+
+    Returns: bool or NOT_MODIFIED - download status
+
+    Raises:
+        - MaxSizeExceeded
+    """
+
+    requested_url = url
+    offset = partial_size(filepath) if resume else 0
+    if_range = load_range_validator(filepath) if offset else None
+    if not if_range:
+        # without a validator the partial may belong to another version
+        offset = 0
+    conditional = validators.request_headers(url) if validators and not offset else {}
+
+    for _ in range(MAX_REDIRECTS + 1):
+        if offset:
+            request_headers = {'Range': 'bytes={}-'.format(offset), 'If-Range': if_range}
+        else:
+            request_headers = conditional
+        status, headers, reader, writer = await open_response(url, request_headers)
+        try:
+            if status in REDIRECT_CODES and headers.get('Location'):
+                url = urljoin(url, headers['Location'])
+                continue
+            if transfer:
+                transfer.response(status)
+                transfer.start_bytes = offset
+
+            if status == 304 and conditional:
+                validators.not_modified(requested_url)
+                return NOT_MODIFIED
+
+            if offset:
+                byte_range = content_range(headers.get('Content-Range'))
+                if status == 416 and byte_range and byte_range[1] == offset:
+                    return record_digest(dedup, filepath, True)
+                if not 200 <= status < 300 or (status == 206 and not (byte_range and byte_range[0] == offset)):
+                    # stale partial or unusable range, request the whole file instead
+                    offset = 0
+                    continue
+                if status != 206:
+                    offset = 0
+
+            if not 200 <= status < 300:
+                raise HTTPStatusError(status)
+            if validators:
+                validators.remember(requested_url, headers)
+            if not offset:
+                drop_segment_marker(filepath)
+                if resume:
+                    save_range_validator(filepath, headers)
+
+            length = headers.get('Content-Length', '')
+            if max_size and length.isdigit() and offset + int(length) > max_size:
+                raise MaxSizeExceeded(url)
+
+            if transfer:
+                transfer.start_bytes = offset
+            if progressbar:
+                total_bytes = offset + int(length) if length.isdigit() else None
+                callback = progressbar.track(requested_url, total_bytes, offset)
+            else:
+                callback = None
+            read_bytes = offset
+            digest = dedup.hasher(filepath, offset) if dedup else None
+            with open(filepath, 'ab' if offset else 'wb') as f:
+                async for data in iter_body(reader, headers, chunk_size):
+                    read_bytes += len(data)
+                    if max_size and read_bytes > max_size:
+                        raise MaxSizeExceeded(url)
+                    f.write(data)
+                    if digest:
+                        digest.update(data)
+                    if callback:
+                        callback(len(data))
+            return record_digest(dedup, filepath, True, digest)
+        finally:
+            writer.close()
+
+    return False
+
+
+# ------------------------------------------------------------------------------
+class _Scheduler(object):
+    """Gates tasks by global concurrency and per-host rate and concurrency limits."""
+
+    def __init__(self, jobs, limiter, wait, progressbar, chunk_size, max_size, resume, validators, dedup, journal,
+                 transfer_log=None):
+        self._jobs = asyncio.Semaphore(jobs)
+        self._journal = journal
+        self._transfer_log = transfer_log
+        self._validators = validators
+        self._dedup = dedup
+        self._chunk_size = chunk_size
+        self._max_size = max_size
+        self._resume = resume
+        self._limiter = limiter
+        self._host_slots = {}
+        self._wait = wait
+        self._progressbar = progressbar
+
+    def _host_slot(self, url):
+        host = host_key(url)
+        if host not in self._host_slots:
+            self._host_slots[host] = asyncio.Semaphore(self._limiter.max_jobs(url))
+        return self._host_slots[host]
+
+    async def _download(self, url, temp_path):
+        scheme = urlparse(url).scheme
+        stats = TransferStats(url) if self._transfer_log else None
+        if self._journal:
+            self._journal.started(url)
+        try:
+            if scheme in ('http', 'https'):
+                status = await async_download(url, temp_path, self._chunk_size, self._max_size, self._resume,
+                                              self._validators, self._dedup, stats, self._progressbar)
+            else:
+                loop = asyncio.get_event_loop()
+                fallback = partial(silent_download, url, temp_path, self._progressbar, chunk_size=self._chunk_size,
+                                   max_size=self._max_size, resume=self._resume, validators=self._validators,
+                                   dedup=self._dedup)
+                if stats:
+                    fallback = partial(with_transfer, stats, fallback)
+                status = await loop.run_in_executor(None, fallback)
+        except (OSError, ValueError, HTTPException, HTTPStatusError, MaxSizeExceeded, asyncio.TimeoutError,
+                asyncio.IncompleteReadError, asyncio.LimitOverrunError) as e:
+            if stats and isinstance(e, (OSError, ValueError, HTTPException, asyncio.TimeoutError)):
+                stats.failed(e)
+            status = False
+
+        if stats:
+            stats.finish(temp_path)
+            self._transfer_log.finished(stats, transfer_result(status))
+        dl_timestamp = timestamp()
+        if self._journal:
+            self._journal.finished(url, status, dl_timestamp)
+        if self._progressbar:
+            self._progressbar.completed_notice(url, status, label=status_label(status))
+        await asyncio.sleep(self._wait)
+        return status, dl_timestamp
+
+    async def _limited(self, url, temp_path):
+        # rate delay is taken before a global slot so other hosts keep going
+        await asyncio.sleep(self._limiter.delay(url))
+        async with self._jobs:
+            return await self._download(url, temp_path)
+
+    async def fetch(self, url, temp_path):
+        if self._limiter.max_jobs(url):
+            async with self._host_slot(url):
+                return await self._limited(url, temp_path)
+        else:
+            return await self._limited(url, temp_path)
+
+
+async def _fetch_and_place(scheduler, task, placer):
+    temp_path, url = task[:2]
+    result = await scheduler.fetch(url, temp_path)
+    place_completed(placer, task, result)
+    return result
+
+
+async def _run_tasks(tasks, progressbar, wait, jobs, limiter, chunk_size, max_size, resume, validators, dedup,
+                     journal, placer=None, transfer_log=None):
+    """Schedules tasks as they are read, keeping at most jobs + LOOKAHEAD
+    scheduled but unfinished. Finished files are placed on the event loop as
+    their downloads complete.
+
+    Returns:
+        - tasks: list of (temp_path, url, net_subdir, filename) read
+        - results: list of (status, timestamp) in task order
+    """
+
+    scheduler = _Scheduler(jobs, limiter, wait, progressbar, chunk_size, max_size, resume, validators, dedup,
+                           journal, transfer_log)
+    window = asyncio.Semaphore(jobs + LOOKAHEAD)
+    loop = asyncio.get_event_loop()
+    task_iter = iter(tasks)
+    read_tasks = []
+    fetches = []
+
+    while True:
+        await window.acquire()
+        # reading may block on slow input, keep it off the event loop
+        task = await loop.run_in_executor(None, next, task_iter, None)
+        if task is None:
+            break
+        fetch = asyncio.ensure_future(_fetch_and_place(scheduler, task, placer))
+        fetch.add_done_callback(lambda _: window.release())
+        read_tasks.append(task)
+        fetches.append(fetch)
+
+    if progressbar:
+        progressbar.set_total(len(read_tasks))
+    return read_tasks, await asyncio.gather(*fetches)
+
+
+def to_tmp(urlist, wait, quiet, silent, jobs=DEFAULT_JOBS, host_jobs=0, chunk_size=CHUNK_SIZE, max_size=0,
+           resume=False, limiter=None, validators=None, dedup=None, journal=None, placer=None, transfer_log=None):
+    """Downloads all valid URLs to tmp subdirectory on a single event loop.
+
+    Accepts the same arguments and returns the same values as download.to_tmp.
+
+    Args:
+        - urlist: list or iterable of urls, read as tasks are scheduled
+        - wait: float - time in seconds each request slot is held after a request
+        - quiet: bool - enables optional progressbar display
+        - silent: bool - disables progressbar / any printing to stdout
+        - jobs: int - max number of requests in flight
+        - host_jobs: int - max requests in flight per host, 0 for no limit
+        - chunk_size: int - max bytes of a response body held in memory
+        - max_size: int - abort downloads larger than max_size bytes, 0 for no limit
+        - resume: bool - download into a persistent partial directory within
+            cwd and continue partial files left by earlier runs
+        - limiter: ratelimit.HostLimiter instance with per-host rate and
+            concurrency limits, replaces host_jobs
+        - validators: ValidatorStore instance to send conditional requests
+            and skip unchanged urls, which are neither completed nor failed
+        - dedup: dedup.DedupIndex instance to hash each download as it is written
+        - journal: journal.JobJournal instance recording the state of each url
+        - placer: write_files.FilePlacer instance, each completed download is
+            placed right after it finishes
+        - transfer_log: transfer_log.TransferLog instance recording the
+            metrics of each transfer
+
+    Returns:
+        - completed: list of (temp_path, url, net_subdir, filename, timestamp)
+        - failed: list (str) - failed urls
+        - tmp_dir: tempfile.TemporaryDirectory or dir_tools.PartialDir instance
+    """
+
+    if resume or journal:
+        tmp_dir = load_partial_dir()
+    else:
+        tmp_dir = load_temp_dir()
+
+    if silent:
+        progressbar = None
+    else:
+        progressbar = Dashboard(quiet=quiet, nfiles=len(urlist) if hasattr(urlist, '__len__') else None)
+
+    if limiter is None:
+        limiter = HostLimiter(concurrency=host_jobs)
+
+    tasks = temp_tasks(urlist, tmp_dir)
+    if journal:
+        tasks = list(tasks)
+        journal.add_tasks(tasks)
+
+    loop = asyncio.new_event_loop()
+    try:
+        tasks, results = loop.run_until_complete(_run_tasks(tasks, progressbar, wait, jobs, limiter,
+                                                              chunk_size, max_size, resume, validators, dedup,
+                                                              journal, placer, transfer_log))
+    finally:
+        loop.close()
+
+    completed, failed = collect_results(tasks, results)
+
+    if progressbar:
+        if quiet:
+            progressbar.cleanup()
+        progressbar.close()
+
+    return completed, failed, tmp_dir
+
+
+# ------------------------------------------------------------------------------
@@ -0,0 +1,375 @@
+"""Throughput benchmarks for the url parsing pipeline.
+"""
+
+import argparse
+import random
+import re
+import string
+import time
+
+from geturls import parser
+from geturls.parser import iter_urls, normalize_cache_stats, normalize_urls, scan_url
+from geturls.tokens import find_longest_shared_token, split_to_tokens
+# ------------------------------------------------------------------------------
+# Former parser.is_url pattern, kept as the reference the scanner must agree with.
+# Nested quantifiers make it backtrack exponentially on long non matching words.
+LEGACY_IS_URL = re.compile(r"((((http)s?|ftp)://)?(w{3}\.)?([\w\-\.]+)(:\d)?\.([a-z]+)/((\.?(.+[^\/])+(/|\.)?)+)[^\/])$", re.IGNORECASE)
+
+WORDS = ('the', 'download', 'mirror', 'see', 'archive', 'notes', 'file', 'from', 'release', 'page')
+HOSTS = ('example.com', 'www.test-site.org', 'files.example.net:8', 'cdn.host.io', 'sub.domain.co.uk')
+
+
+# Former pathname tokenizer, kept as the reference the tokens module must agree
+# with. Run starts are found by list membership tests and every token of every
+# name is tested against the whole group. Splitting a token without letters
+# raises IndexError, so generated names never have runs of digits alone.
+LEGACY_ALNUM_MAP = str.maketrans(dict.fromkeys(string.ascii_letters + string.digits, 'a'))
+LEGACY_ALPHA_MAP = str.maketrans(dict.fromkeys(string.ascii_letters, 'a'))
+
+
+def legacy_split_to_tokens(filename, minchars=3, split_digits=False):
+    fn_enc = filename.translate(LEGACY_ALPHA_MAP if split_digits else LEGACY_ALNUM_MAP)
+    alnum_chars = [ix for ix, char in enumerate(fn_enc) if char == 'a']
+    start = [ix for ix in alnum_chars if ix - 1 not in alnum_chars]
+    stop = [ix + 1 for ix in alnum_chars if ix + 1 not in alnum_chars]
+
+    str_len = len(fn_enc)
+    if split_digits:
+        if start[0] != 0:
+            start.insert(0, 0)
+        if stop[-1] != str_len:
+            stop.append(str_len + 1)
+
+    tokens = []
+    for start_ix in start:
+        for stop_ix in stop:
+            if minchars <= stop_ix - start_ix <= str_len:
+                tokens.append(filename[start_ix:stop_ix])
+
+    if not split_digits:
+        for word in [t for t in tokens if (t.isalnum() and not t.isalpha())]:
+            tokens.extend(legacy_split_to_tokens(word, split_digits=True))
+
+    return sorted(tokens, key=lambda s: len(s), reverse=True)
+
+
+def legacy_find_longest_shared_token(group):
+    all_tokens = set()
+    for word in group:
+        all_tokens.update(legacy_split_to_tokens(word))
+    tracker = [token for token in all_tokens if all((token in word for word in group))]
+    return max(tracker, key=len) if tracker else ''
+
+
+def legacy_scan(word):
+    match = LEGACY_IS_URL.search(word)
+    return match.group() if match else None
+
+
+def random_url(rng):
+    scheme = rng.choice(('http://', 'https://', 'ftp://', ''))
+    depth = rng.randint(1, 4)
+    path = '/'.join(''.join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(3, 10)))
+                    for _ in range(depth))
+    ext = rng.choice(('.txt', '.pdf', '.tar.gz', '.html', '.jpg'))
+    return '{}{}/{}{}'.format(scheme, rng.choice(HOSTS), path, ext)
+
+
+def ordinary_corpus(size, seed=0):
+    """Text lines with a few urls among ordinary words.
+
+    Returns: list (str) - lines totalling about size characters
+    """
+
+    rng = random.Random(seed)
+    lines = []
+    total = 0
+    while total < size:
+        words = [rng.choice(WORDS) for _ in range(rng.randint(4, 14))]
+        for _ in range(rng.randint(0, 2)):
+            words.insert(rng.randint(0, len(words)), random_url(rng))
+        line = ' '.join(words)
+        lines.append(line)
+        total += len(line) + 1
+    return lines
+
+
+def adversarial_token(rng, length):
+    """Long token without a valid url, e.g. base64 with slashes, that makes a
+    backtracking pattern explore every split.
+    """
+
+    kind = rng.randrange(3)
+    if kind == 0:
+        body = ''.join(rng.choice('ab') for _ in range(length))
+        return 'a.com/{}//'.format(body)
+    elif kind == 1:
+        alphabet = string.ascii_letters + string.digits + '+/'
+        return 'x.js' + ''.join(rng.choice(alphabet) for _ in range(length)) + '=='
+    else:
+        return 'b.io/' + '/'.join('a.b' for _ in range(length // 4)) + '//'
+
+
+def adversarial_corpus(size, token_length=2000, seed=0):
+    """Lines of long tokens that never end in a valid url.
+
+    Returns: list (str) - lines totalling about size characters
+    """
+
+    rng = random.Random(seed)
+    lines = []
+    total = 0
+    while total < size:
+        line = adversarial_token(rng, token_length)
+        lines.append(line)
+        total += len(line) + 1
+    return lines
+
+
+def repetitive_urls(count, unique, seed=0):
+    """URLs as found in crawled text, drawn with a skewed distribution from
+    unique distinct URLs, half without a scheme.
+
+    Returns: list (str)
+    """
+
+    rng = random.Random(seed)
+    pool = [random_url(rng) for _ in range(unique)]
+    pool = [url.split('://', 1)[-1] if rng.random() < 0.5 else url for url in pool]
+    return [pool[min(int(rng.paretovariate(1.2)) - 1, unique - 1)] if rng.random() < 0.8
+            else rng.choice(pool) for _ in range(count)]
+
+
+def long_filename(rng, length):
+    """Filename of about length characters of words, versions and counters
+    joined by separators. Every run of letters and digits has a letter.
+    """
+
+    parts = []
+    total = 0
+    while total < length:
+        word = ''.join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(2, 8)))
+        kind = rng.randrange(4)
+        if kind == 0:
+            word = 'v{}{}'.format(rng.randint(0, 99), word)
+        elif kind == 1:
+            word = '{}{}'.format(word, rng.randint(0, 9999))
+        parts.append(word)
+        parts.append(rng.choice('_-. '))
+        total += len(word) + 1
+    return ''.join(parts[:-1]) + rng.choice(('.pdf', '.tar.gz', '.jpg', ''))
+
+
+def filename_group(rng, length, size):
+    """size variants of one long filename, each with a few words replaced."""
+
+    base = long_filename(rng, length).split('_')
+    group = set()
+    while len(group) < size:
+        words = list(base)
+        for _ in range(rng.randint(1, 3)):
+            words[rng.randrange(len(words))] = 'r{}'.format(rng.randint(0, 10**6))
+        group.add('_'.join(words))
+    return group
+
+
+# ------------------------------------------------------------------------------
+def scan_words(lines, scan):
+    for line in lines:
+        for word in line.split(' '):
+            if not word.isalnum():
+                scan(word.lstrip(string.punctuation))
+
+
+def parse_lines(lines):
+    for _ in iter_urls(lines):
+        pass
+
+
+def throughput(lines, func, *args, repeat=3):
+    """Best of repeat runs of func(lines, *args).
+
+    Returns: float - MB of text processed per second
+    """
+
+    nbytes = sum(len(line) + 1 for line in lines)
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(lines, *args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return nbytes / 10**6 / max(best, 1e-9)
+
+
+def legacy_scaling(max_seconds=1.0):
+    """Times the legacy pattern on one adversarial word of growing length,
+    stopping once a single word takes longer than max_seconds.
+
+    Returns: list of (length, seconds legacy, seconds scanner)
+    """
+
+    timings = []
+    n = 4
+    while True:
+        word = 'a.com/{}//'.format('ab' * n)
+        start = time.perf_counter()
+        LEGACY_IS_URL.search(word)
+        legacy = time.perf_counter() - start
+
+        start = time.perf_counter()
+        scan_url(word)
+        scanner = time.perf_counter() - start
+
+        timings.append((len(word), legacy, scanner))
+        if legacy > max_seconds:
+            return timings
+        n += 2
+
+
+def compare_with_legacy(lines):
+    """Checks scanner against the legacy pattern on every word of lines.
+
+    Returns: list of (word, legacy result, scanner result) that differ
+    """
+
+    mismatches = []
+    for line in lines:
+        for word in line.split(' '):
+            word = word.lstrip(string.punctuation)
+            expected = legacy_scan(word)
+            found = scan_url(word)
+            if expected != found:
+                mismatches.append((word, expected, found))
+    return mismatches
+
+
+def normalize_uncached(urls):
+    for url in urls:
+        parser._normalize_url(url, 'http')
+
+
+def normalize_cached(urls):
+    parser.clear_normalize_caches()
+    normalize_urls(urls)
+
+
+def best_time(func, *args, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return max(best, 1e-9)
+
+
+# ------------------------------------------------------------------------------
+def benchmark_normalize(size):
+    count = max(1, size // 50)
+    print('Normalizing {} URLs drawn from a pool of distinct URLs, seconds'.format(count))
+    print('    {:>10} {:>10} {:>10} {:>8} {:>10} {:>10}'.format('pool size', 'uncached', 'cached', 'speedup',
+                                                               'url hits', 'host hits'))
+    for share in (0.001, 0.01, 0.1, 1.0):
+        urls = repetitive_urls(count, max(1, int(count * share)))
+        uncached = best_time(normalize_uncached, urls)
+        cached = best_time(normalize_cached, urls)
+        if normalize_urls(urls) != [parser._normalize_url(url, 'http') for url in urls]:
+            print('    cached and uncached results differ')
+        stats = normalize_cache_stats()
+        print('    {:>9.1%} {:>10.3f} {:>10.3f} {:>7.1f}x {:>9.1%} {:>9.1%}'.format(
+              share, uncached, cached, uncached / cached, stats['url']['hit_rate'], stats['host']['hit_rate']))
+    print()
+
+
+def benchmark_tokens(size):
+    count = max(1, size // 10**5)
+    rng = random.Random(0)
+
+    print('Splitting {} filenames into tokens, seconds'.format(count))
+    print('    {:>8} {:>8} {:>10} {:>10} {:>8}'.format('chars', 'tokens', 'legacy', 'tokens', 'speedup'))
+    for length in (32, 64, 128, 256, 512):
+        names = [long_filename(rng, length) for _ in range(count)]
+        legacy = best_time(lambda: [legacy_split_to_tokens(name) for name in names])
+        current = best_time(lambda: [split_to_tokens(name) for name in names])
+        if any(legacy_split_to_tokens(name) != split_to_tokens(name) for name in names):
+            print('    legacy and current tokens differ')
+        ntokens = sum(len(split_to_tokens(name)) for name in names) // count
+        print('    {:>8} {:>8} {:>10.3f} {:>10.3f} {:>7.1f}x'.format(length, ntokens, legacy, current,
+                                                                  legacy / current))
+    print()
+
+    print('Longest token shared by groups of filenames, seconds')
+    print('    {:>8} {:>8} {:>10} {:>10} {:>8}'.format('chars', 'names', 'legacy', 'tokens', 'speedup'))
+    for length, group_size in ((32, 20), (128, 20), (256, 20), (512, 20), (64, 200), (64, 1000)):
+        groups = [filename_group(rng, length, group_size) for _ in range(max(1, count // group_size))]
+        legacy = best_time(lambda: [legacy_find_longest_shared_token(group) for group in groups], repeat=1)
+        current = best_time(lambda: [find_longest_shared_token(group) for group in groups])
+        # equally long shared tokens were picked in set order
+        if any(len(legacy_find_longest_shared_token(group)) != len(find_longest_shared_token(group))
+               for group in groups):
+            print('    legacy and current shared tokens differ')
+        print('    {:>8} {:>8} {:>10.3f} {:>10.3f} {:>7.1f}x'.format(length, group_size, legacy, current,
+                                                                  legacy / current))
+    print()
+
+
+def benchmark_scanner(size):
+    ordinary = ordinary_corpus(size)
+    adversarial = adversarial_corpus(size)
+
+    mismatches = compare_with_legacy(ordinary)
+    print('Scanner vs legacy pattern on ordinary corpus: {} mismatches'.format(len(mismatches)))
+    for word, expected, found in mismatches[:10]:
+        print('    {!r}: legacy {!r} scanner {!r}'.format(word, expected, found))
+    print()
+
+    print('Throughput (MB/s)')
+    print('    {:<20} {:>10} {:>10} {:>16}'.format('', 'legacy', 'scanner', 'parse pipeline'))
+    print('    {:<20} {:>10.2f} {:>10.2f} {:>16.2f}'.format('ordinary text',
+                                                            throughput(ordinary, scan_words, legacy_scan),
+                                                            throughput(ordinary, scan_words, scan_url),
+                                                            throughput(ordinary, parse_lines)))
+    print('    {:<20} {:>10} {:>10.2f} {:>16.2f}'.format('adversarial text', 'n/a',
+                                                          throughput(adversarial, scan_words, scan_url),
+                                                          throughput(adversarial, parse_lines)))
+    print()
+
+    print('Single adversarial word, seconds')
+    print('    {:>8} {:>12} {:>12}'.format('chars', 'legacy', 'scanner'))
+    for length, legacy, scanner in legacy_scaling():
+        print('    {:>8} {:>12.6f} {:>12.6f}'.format(length, legacy, scanner))
+    print()
+
+
+# ------------------------------------------------------------------------------
+def parse_arguments():
+    parser = argparse.ArgumentParser(prog='geturls_benchmark',
+                                     description='>>> Benchmark url parsing throughput')
+
+    parser.add_argument('benchmark', choices=('scanner', 'normalize', 'tokens'),
+                         help='Benchmark to run')
+
+    parser.add_argument('--size', '-n', type=float, default=2,
+                         help='Approximate size of each generated corpus in MB - default: 2')
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    size = int(args.size * 10**6)
+    print()
+    print('geturls {} benchmark'.format(args.benchmark))
+    print()
+    if args.benchmark == 'scanner':
+        benchmark_scanner(size)
+    elif args.benchmark == 'normalize':
+        benchmark_normalize(size)
+    elif args.benchmark == 'tokens':
+        benchmark_tokens(size)
+
+
+# ------------------------------------------------------------------------------
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,216 @@
+"""Keep-alive HTTP connections shared between requests to the same origin.
+"""
+
+from collections import deque
+from functools import lru_cache
+from http.client import HTTPConnection, HTTPException, HTTPSConnection
+import ssl
+import sys
+import threading
+import time
+from urllib import request
+from urllib.error import HTTPError
+from urllib.parse import urljoin, urlparse
+# ------------------------------------------------------------------------------
+MAX_REDIRECTS = 10
+DRAIN_LIMIT = 64 * 1024
+REDIRECT_CODES = (301, 302, 303, 307, 308)
+USER_AGENT = 'Python-urllib/{}.{}'.format(*sys.version_info[:2])
+
+
+@lru_cache(maxsize=None)
+def default_ssl_context():
+    return ssl.create_default_context()
+
+
+def origin(url):
+    """Pool key for url.
+
+    Returns: tuple (scheme, host, port)
+    """
+
+    parts = urlparse(url)
+    https = parts.scheme == 'https'
+    port = parts.port or (443 if https else 80)
+    return (parts.scheme, (parts.hostname or '').lower(), port)
+
+
+def request_path(url):
+    parts = urlparse(url)
+    path = parts.path or '/'
+    if parts.query:
+        path = '{}?{}'.format(path, parts.query)
+    return path
+
+
+# ------------------------------------------------------------------------------
+class ConnectionPool(object):
+    """Reuses keep-alive connections keyed by scheme, host and port.
+
+    Responses returned by urlopen must be passed back to release once their
+    body has been read. Connections are only returned to the pool when the
+    body was read to the end and the server did not ask to close.
+
+    Attributes:
+        - max_idle: int
+            - max idle connections kept per origin, 0 disables reuse
+        - max_age: float
+            - seconds after which a connection is no longer reused
+        - opened: int
+            - total connections opened
+        - reused: int
+            - total requests sent over a previously used connection
+
+    Methods:
+        - urlopen
+            Sends GET request, following redirects
+        - release
+            Returns connection of a finished response to the pool
+        - close
+            Closes all idle connections
+    """
+
+    def __init__(self, max_idle=4, max_age=60.0):
+        self.max_idle = max_idle
+        self.max_age = max_age
+        self.opened = 0
+        self.reused = 0
+        self._idle = {}
+        self._checked_out = {}
+        self._lock = threading.Lock()
+
+
+    def _connect(self, key):
+        scheme, host, port = key
+        if scheme == 'https':
+            conn = HTTPSConnection(host, port, context=default_ssl_context())
+        else:
+            conn = HTTPConnection(host, port)
+
+        with self._lock:
+            self.opened += 1
+        return conn, time.monotonic()
+
+
+    def _checkout(self, key):
+        """Gets idle connection for origin, or opens a new one.
+
+        Returns:
+            - conn: http.client.HTTPConnection
+            - created: float - monotonic time connection was opened
+            - reused: bool
+        """
+
+        now = time.monotonic()
+        with self._lock:
+            idle = self._idle.get(key)
+            while idle:
+                conn, created = idle.pop()
+                if now - created < self.max_age:
+                    self.reused += 1
+                    return conn, created, True
+                conn.close()
+
+        conn, created = self._connect(key)
+        return conn, created, False
+
+
+    def _request(self, url, extra_headers=None):
+        key = origin(url)
+        path = request_path(url)
+        headers = {'User-Agent': USER_AGENT}
+        if extra_headers:
+            headers.update(extra_headers)
+
+        conn, created, reused = self._checkout(key)
+        try:
+            conn.request('GET', path, headers=headers)
+            response = conn.getresponse()
+        except (OSError, HTTPException):
+            conn.close()
+            if not reused:
+                raise
+            # server closed the idle connection, retry once on a new one
+            conn, created = self._connect(key)
+            conn.request('GET', path, headers=headers)
+            response = conn.getresponse()
+
+        with self._lock:
+            self._checked_out[response] = (key, conn, created)
+        return response
+
+
+    def urlopen(self, url, headers=None):
+        """Sends GET request over a pooled connection.
+
+        Non http/https urls are passed on to urllib.request.urlopen.
+
+        Args:
+            - url: str
+            - headers: dict - additional request headers
+
+        Returns:
+            - response: http.client.HTTPResponse
+
+        Raises:
+            - urllib.error.HTTPError for non 2xx final responses
+        """
+
+        for _ in range(MAX_REDIRECTS + 1):
+            if urlparse(url).scheme not in ('http', 'https'):
+                return request.urlopen(request.Request(url, headers=headers or {}))
+
+            response = self._request(url, headers)
+            location = response.getheader('Location')
+
+            if response.status in REDIRECT_CODES and location:
+                response.read()
+                self.release(response)
+                url = urljoin(url, location)
+                continue
+
+            if not 200 <= response.status < 300:
+                # small bodies are read so the connection can be reused, e.g. 304 Not Modified
+                if response.length is not None and response.length <= DRAIN_LIMIT:
+                    response.read()
+                self.release(response)
+                raise HTTPError(url, response.status, response.reason, response.headers, None)
+
+            return response
+
+        self.release(response)
+        raise HTTPError(url, response.status, 'Too many redirects', response.headers, None)
+
+
+    def release(self, response):
+        with self._lock:
+            checked_out = self._checked_out.pop(response, None)
+
+        if checked_out is None:
+            response.close()
+            return
+
+        key, conn, created = checked_out
+        reusable = (response.isclosed() and not response.will_close
+                    and time.monotonic() - created < self.max_age)
+
+        if reusable:
+            with self._lock:
+                idle = self._idle.setdefault(key, deque())
+                if len(idle) < self.max_idle:
+                    idle.append((conn, created))
+                    return
+
+        response.close()
+        conn.close()
+
+
+    def close(self):
+        with self._lock:
+            for idle in self._idle.values():
+                for conn, _ in idle:
+                    conn.close()
+            self._idle.clear()
+
+
+# ------------------------------------------------------------------------------
@@ -0,0 +1,221 @@
+"""Content addressed deduplication of downloaded files.
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+# ------------------------------------------------------------------------------
+DEDUP_DBNAME = '.geturls_dedup.sqlite'
+FICLONE = 0x40049409
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def file_hasher(filepath, nbytes=None):
+    """Hashes the first nbytes of filepath, or the whole file.
+
+    Returns: hashlib sha256 instance
+    """
+
+    hasher = hashlib.sha256()
+    remaining = nbytes
+    with open(filepath, 'rb') as f:
+        while remaining is None or remaining > 0:
+            size = HASH_CHUNK_SIZE if remaining is None else min(HASH_CHUNK_SIZE, remaining)
+            data = f.read(size)
+            if not data:
+                break
+            hasher.update(data)
+            if remaining is not None:
+                remaining -= len(data)
+    return hasher
+
+
+def reflink(src, dst):
+    """Copy on write clone of src at dst (Linux FICLONE).
+
+    Raises: OSError if the filesystem does not support reflinks
+    """
+
+    if fcntl is None:
+        raise OSError('reflinks are not supported on this platform')
+
+    with open(src, 'rb') as s, open(dst, 'wb') as d:
+        try:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+        except OSError:
+            d.close()
+            os.remove(dst)
+            raise
+
+
+# ------------------------------------------------------------------------------
+class DedupIndex(object):
+    """Digest index of placed files used to link duplicate downloads.
+
+    Downloads are hashed while they stream to their temporary path. When a
+    file is placed and an identical file was already placed, in this run or
+    a previous one when a database path is given, the duplicate is replaced
+    by a hardlink or reflink to the existing file.
+
+    Size and modification time are stored with each placed path. A file
+    changed since, e.g. overwritten by a later run, is hashed again before
+    linking and its entry dropped if the content no longer matches. Entries
+    are committed as they change, so a persistent index keeps the files
+    placed before a crash.
+
+    Attributes:
+        - link: str
+            - 'hard' or 'reflink'
+        - linked: int
+            - number of placed files that were linked
+        - saved_bytes: int
+            - total size of linked files
+
+    Methods:
+        - hasher
+            New digest for a download, seeded with any resumed prefix
+        - add
+            Records digest of a finished temporary file
+        - add_file
+            Hashes a finished temporary file from disk
+        - place
+            Moves or links a temporary file into its final path
+        - close
+    """
+
+    def __init__(self, filepath=None, link='hard'):
+        self.link = link
+        self.linked = 0
+        self.saved_bytes = 0
+        self._temp_digests = {}
+        self._placed = {}
+        self._lock = threading.Lock()
+
+        if filepath:
+            self._db = sqlite3.connect(os.path.abspath(filepath), check_same_thread=False)
+            self._db.execute('CREATE TABLE IF NOT EXISTS digests '
+                             '(digest TEXT PRIMARY KEY, path TEXT, size INTEGER, mtime_ns INTEGER)')
+            self._db.commit()
+        else:
+            self._db = None
+
+
+    def hasher(self, filepath, offset=0):
+        if offset:
+            return file_hasher(filepath, offset)
+        return hashlib.sha256()
+
+
+    def add(self, filepath, hasher):
+        with self._lock:
+            self._temp_digests[filepath] = hasher.hexdigest()
+
+
+    def add_file(self, filepath):
+        self.add(filepath, file_hasher(filepath))
+
+
+    def _lookup(self, digest, size):
+        """Path of a placed file with content digest, checked against the
+        size and modification time it was stored with.
+
+        Returns: str or None
+        """
+
+        entry = self._placed.get(digest)
+        if entry is None and self._db:
+            entry = self._db.execute('SELECT path, size, mtime_ns FROM digests WHERE digest = ?',
+                                     (digest,)).fetchone()
+        if not entry:
+            return None
+
+        path, stored_size, stored_mtime = entry
+        try:
+            stat = os.stat(path)
+        except OSError:
+            stat = None
+
+        if stat is None or not os.path.isfile(path) or stat.st_size != size:
+            self._drop(digest)
+            return None
+        if stat.st_size == stored_size and stat.st_mtime_ns == stored_mtime:
+            return path
+
+        if file_hasher(path).hexdigest() != digest:
+            self._drop(digest)
+            return None
+        self._store(digest, path)
+        return path
+
+
+    def _store(self, digest, path):
+        stat = os.stat(path)
+        entry = (path, stat.st_size, stat.st_mtime_ns)
+        self._placed[digest] = entry
+        if self._db:
+            self._db.execute('INSERT OR REPLACE INTO digests (digest, path, size, mtime_ns) VALUES (?, ?, ?, ?)',
+                             (digest,) + entry)
+            self._db.commit()
+
+
+    def _drop(self, digest):
+        self._placed.pop(digest, None)
+        if self._db:
+            self._db.execute('DELETE FROM digests WHERE digest = ?', (digest,))
+            self._db.commit()
+
+
+    def _link(self, src, dst):
+        tmp_dst = dst + '.geturls-link'
+        if self.link == 'reflink':
+            reflink(src, tmp_dst)
+        else:
+            os.link(src, tmp_dst)
+        os.replace(tmp_dst, dst)
+
+
+    def place(self, temp_path, filepath):
+        """Moves temp_path to filepath, or links filepath to an identical
+        placed file and removes temp_path.
+
+        Returns: str - path of the file linked to, '' if temp_path was moved
+        """
+
+        with self._lock:
+            digest = self._temp_digests.pop(temp_path, None)
+            if digest is None:
+                # e.g. recovered from an interrupted job
+                digest = file_hasher(temp_path).hexdigest()
+            existing = self._lookup(digest, os.path.getsize(temp_path))
+            real_path = os.path.abspath(filepath)
+
+            if existing and existing != real_path:
+                try:
+                    self._link(existing, filepath)
+                except OSError:
+                    pass
+                else:
+                    self.linked += 1
+                    self.saved_bytes += os.path.getsize(temp_path)
+                    os.remove(temp_path)
+                    return existing
+
+            os.rename(temp_path, filepath)
+            self._store(digest, real_path)
+            return ''
+
+
+    def close(self):
+        with self._lock:
+            if self._db:
+                self._db.commit()
+                self._db.close()
+
+
+# ------------------------------------------------------------------------------
@@ -1,8 +1,17 @@
+import hashlib
 import os
 import tempfile
 import time
 from urllib.parse import unquote as url_unquote
 # ------------------------------------------------------------------------------
+PARTIAL_DIRNAME = '.geturls_partial'
+STAGING_PREFIX = '.geturls_tmp_'
+SEGMENT_SUFFIX = '.segments'
+IF_RANGE_SUFFIX = '.if-range'
+# files kept next to a partial download, removed along with it
+PARTIAL_MARKERS = (SEGMENT_SUFFIX, IF_RANGE_SUFFIX)
+
+
 def confirm_directory(subdir):
     if os.path.exists(subdir):
         if not os.path.isdir(subdir):
@@ -21,34 +30,46 @@ def validate_directory(user_dir):
         return os.curdir
 
 
-def validate_netdir_trees(all_netdirs):
-    cache = {}
-    valid_paths = []
+def validate_netdir_tree(netdir, cache):
+    """Makes the host directory tree of netdir within cwd.
 
-    for netdir in all_netdirs:
-        host_path = netdir.split('://', 1)[1]
+    Args:
+        - netdir: str - url directory path
+        - cache: dict - trees already made, shared between calls
 
-        if host_path in cache:
-            valid_paths.append(cache[host_path])
-            continue
+    Returns: str - tree path, or os.curdir if a file is in the way
+    """
+
+    host_path = netdir.split('://', 1)[1]
+    if host_path in cache:
+        return cache[host_path]
 
-        split_dirs = host_path.split('/')
-        path_tree = os.path.join(*[d for d in split_dirs if d])
+    split_dirs = host_path.split('/')
+    path_tree = os.path.join(*[d for d in split_dirs if d])
 
-        try:
-            os.makedirs(path_tree, exist_ok=True)
-            valid = path_tree
-        except FileExistsError:
-            valid = os.curdir
-        finally:
-            valid_paths.append(valid)
+    try:
+        os.makedirs(path_tree, exist_ok=True)
+        valid = path_tree
+    except FileExistsError:
+        valid = os.curdir
 
-        cache[host_path] = valid
+    cache[host_path] = valid
+    return valid
 
-    return valid_paths
+
+def validate_netdir_trees(all_netdirs):
+    cache = {}
+    return [validate_netdir_tree(netdir, cache) for netdir in all_netdirs]
 
 
 # ------------------------------------------------------------------------------
+def split_url_dir(url):
+    """Returns: tuple (str, str) - unquoted url directory path, filename"""
+
+    net_subdir, filename = url_unquote(url).rsplit('/', 1)
+    return net_subdir, filename
+
+
 def group_by_dir(urlist):
     """Sorts urls into groups based on shared url directory paths.
 
@@ -58,7 +79,7 @@ def group_by_dir(urlist):
 
     dir_groups = {}
     for url in urlist:
-        net_subdir, filename = url_unquote(url).rsplit('/',1)
+        net_subdir, filename = split_url_dir(url)
         if net_subdir in dir_groups:
             dir_groups[net_subdir].append((url, filename))
         else:
@@ -66,14 +87,65 @@ def group_by_dir(urlist):
     return dir_groups
 
 
+def stable_subdir_name(net_subdir):
+    """Subdirectory name for url directory that is identical across runs.
+
+    Returns: str
+    """
+
+    return hashlib.sha1(net_subdir.encode('utf-8', 'replace')).hexdigest()[:16]
+
+
 # ------------------------------------------------------------------------------
-def load_temp_dir():
-    """Makes temporary directory with unique prefix.
+def load_temp_dir(root=os.curdir):
+    """Makes temporary staging directory with unique prefix within root, the
+    download destination, so finished files are placed by a rename on the
+    same filesystem.
 
     Returns:
         - tmp_dir: tempfile.TemporaryDirectory instance
     """
 
-    temp_subname = 'GETURLS_TMP_{}'.format(int(time.time()))
-    tmp_dir = tempfile.TemporaryDirectory(prefix=temp_subname)
+    temp_subname = '{}{}_'.format(STAGING_PREFIX, int(time.time()))
+    tmp_dir = tempfile.TemporaryDirectory(prefix=temp_subname, dir=os.path.abspath(root))
     return tmp_dir
+
+
+class PartialDir(object):
+    """Persistent download directory kept between runs so partial files can
+    be resumed. Provides the name / cleanup interface of
+    tempfile.TemporaryDirectory used by download.to_tmp.
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def cleanup(self):
+        """Removes markers of partial files that were finished and empty
+        subdirectories, keeping unfinished partial files.
+        """
+
+        for root, _, files in os.walk(self.name, topdown=False):
+            for filename in files:
+                base, ext = os.path.splitext(filename)
+                if ext in PARTIAL_MARKERS and base not in files:
+                    try:
+                        os.remove(os.path.join(root, filename))
+                    except OSError:
+                        pass
+            try:
+                os.rmdir(root)
+            except OSError:
+                pass
+
+
+def load_partial_dir(root=os.curdir):
+    """Makes or reuses the partial download directory within root.
+
+    Returns:
+        - partial_dir: PartialDir instance
+    """
+
+    partial_dir = os.path.abspath(os.path.join(root, PARTIAL_DIRNAME))
+    os.makedirs(partial_dir, exist_ok=True)
+    return PartialDir(partial_dir)
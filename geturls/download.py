@@ -1,79 +1,607 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait as wait_futures
+from functools import partial
+from http.client import HTTPException
 import os
+import queue
+import threading
 import time
 from urllib import request
-from urllib.error import URLError
-
-from geturls.dir_tools import load_temp_dir, group_by_dir, confirm_directory
-from geturls.progressbar import Progressbar
+from urllib.error import HTTPError
+from urllib.parse import urlparse
+
+from geturls.dir_tools import (IF_RANGE_SUFFIX, SEGMENT_SUFFIX, load_partial_dir, load_temp_dir,
+                               confirm_directory, split_url_dir, stable_subdir_name)
+from geturls.progressbar import Dashboard, Progressbar
+from geturls.ratelimit import HostLimiter
+from geturls.transfer_log import TransferStats, current_transfer, set_current_transfer, transfer_result
+from geturls.validators import NOT_MODIFIED
 # ------------------------------------------------------------------------------
-def get_response(url):
+CHUNK_SIZE = 64 * 1024
+SEGMENT_THRESHOLD = 8 * 10**6
+LOOKAHEAD = 64
+_READ, _READ_FAILED, _FINISHED = 'read', 'read failed', 'finished'
+
+
+class SizeLimitExceeded(object):
+    """Failed download status for a body aborted for exceeding max_size."""
+
+    def __bool__(self):
+        return False
+
+    def __repr__(self):
+        return 'EXCEEDS_MAX_SIZE'
+
+
+EXCEEDS_MAX_SIZE = SizeLimitExceeded()
+
+
+def open_url(url, pool=None, headers=None):
+    stats = current_transfer()
+    try:
+        if pool:
+            response = pool.urlopen(url, headers)
+        elif headers:
+            response = request.urlopen(request.Request(url, headers=headers))
+        else:
+            response = request.urlopen(url)
+    except HTTPError as e:
+        if stats:
+            stats.response(e.code)
+        raise
+    except (OSError, HTTPException, ValueError) as e:
+        if stats:
+            stats.failed(e)
+        raise
+
+    if stats:
+        stats.response(getattr(response, 'status', None))
+    return response
+
+
+def get_response(url, pool=None, headers=None):
     response = False
     try:
-        response = request.urlopen(url)
-    except URLError:
+        response = open_url(url, pool, headers)
+    except (OSError, HTTPException):
         response = False
     finally:
         return response
 
 
-def silent_download(url, filepath, *ignore):
-    response = get_response(url)
-    if response:
-        with open(filepath, 'wb') as f:
-            f.write(response.read())
-        return True
+def partial_size(filepath):
+    """Returns: int - size of previously downloaded part of filepath"""
+
+    if os.path.exists(filepath + SEGMENT_SUFFIX):
+        # unfinished segmented download, file may contain gaps
+        return 0
+
+    try:
+        return os.path.getsize(filepath)
+    except OSError:
+        return 0
+
+
+def drop_segment_marker(filepath):
+    """Removes the marker of an unfinished segmented download of filepath,
+    as a write from the start replaces its segment layout.
+    """
+
+    marker = filepath + SEGMENT_SUFFIX
+    if os.path.exists(marker):
+        os.remove(marker)
+
+
+def content_range(header):
+    """Parses Content-Range header value, e.g. bytes 100-199/1000 or bytes */1000
+
+    Returns: tuple (start, total) - either value may be None, or None if invalid
+    """
+
+    if not header or not header.startswith('bytes '):
+        return None
+
+    byte_range, _, total = header[6:].partition('/')
+    start = byte_range.split('-', 1)[0]
+    start = int(start) if start.isdigit() else None
+    total = int(total) if total.isdigit() else None
+    return start, total
+
+
+def range_validator(headers):
+    """Returns: str or None - strong ETag, else Last-Modified of a response,
+    usable as If-Range value
+    """
+
+    etag = headers.get('ETag')
+    if etag and not etag.startswith('W/'):
+        return etag
+    return headers.get('Last-Modified')
+
+
+def save_range_validator(filepath, headers):
+    """Keeps the validator of the response being written to filepath next
+    to it, so a later run only resumes the file if it did not change.
+    """
+
+    marker = filepath + IF_RANGE_SUFFIX
+    value = range_validator(headers)
+    if value:
+        with open(marker, 'w', encoding='utf-8') as f:
+            f.write(value)
+    elif os.path.exists(marker):
+        os.remove(marker)
+
+
+def load_range_validator(filepath):
+    """Returns: str or None - If-Range value saved for partial filepath"""
+
+    try:
+        with open(filepath + IF_RANGE_SUFFIX, encoding='utf-8') as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def get_resumable_response(url, filepath, pool=None):
+    """Requests the remainder of a partially downloaded file with Range and
+    If-Range headers. Falls back to requesting the whole file if the server
+    ignores the range, the file changed, or no validator was saved with the
+    partial file.
+
+    Returns:
+        - response: http.client.HTTPResponse, False for a failed request or
+            True if filepath already holds the complete file
+        - offset: int - bytes of filepath to keep, response body continues at offset
+    """
+
+    offset = partial_size(filepath)
+    validator = load_range_validator(filepath)
+    if not offset or not validator:
+        return get_response(url, pool), 0
+
+    try:
+        response = open_url(url, pool, {'Range': 'bytes={}-'.format(offset), 'If-Range': validator})
+    except HTTPError as e:
+        byte_range = content_range(e.headers.get('Content-Range')) if e.headers else None
+        if e.code == 416 and byte_range and byte_range[1] == offset:
+            return True, offset
+        return get_response(url, pool), 0
+    except (OSError, HTTPException):
+        return False, 0
+
+    if getattr(response, 'status', None) != 206:
+        return response, 0
+
+    byte_range = content_range(response_header(response, 'Content-Range'))
+    if byte_range and byte_range[0] == offset:
+        return response, offset
+
+    release_response(response, pool)
+    return get_response(url, pool), 0
+
+
+def get_conditional_response(url, pool, validators):
+    """Requests url with If-None-Match / If-Modified-Since from validator store.
+
+    Returns:
+        - response: http.client.HTTPResponse, False for a failed request or
+            NOT_MODIFIED if the server reports the saved file is current
+    """
+
+    headers = validators.request_headers(url)
+    if not headers:
+        return get_response(url, pool)
+
+    try:
+        return open_url(url, pool, headers)
+    except HTTPError as e:
+        if e.code == 304:
+            validators.not_modified(url)
+            return NOT_MODIFIED
+        return False
+    except (OSError, HTTPException):
+        return False
+
+
+def _open(url, filepath, pool, resume, validators):
+    if resume and partial_size(filepath):
+        response, offset = get_resumable_response(url, filepath, pool)
+    elif validators:
+        response, offset = get_conditional_response(url, pool, validators), 0
     else:
+        response, offset = get_response(url, pool), 0
+
+    if response and response is not True and response is not NOT_MODIFIED:
+        if validators:
+            validators.remember(url, response.headers)
+        if not offset:
+            drop_segment_marker(filepath)
+            if resume:
+                save_range_validator(filepath, response.headers)
+    stats = current_transfer()
+    if stats:
+        stats.start_bytes = offset
+    return response, offset
+
+
+def status_label(status):
+    """Returns: str - progress display label for download status"""
+
+    return 'UNCHANGED' if status is NOT_MODIFIED else ''
+
+
+def release_response(response, pool=None):
+    """Closes response or returns its connection to pool for reuse."""
+
+    if pool:
+        pool.release(response)
+    else:
+        response.close()
+
+
+def response_header(response, name):
+    """Reads a header without getheader, which ftp and file responses lack.
+
+    Returns: str or None
+    """
+
+    headers = getattr(response, 'headers', None)
+    return headers.get(name) if headers else None
+
+
+def content_length(response):
+    """Returns: int or None - value of Content-Length header if valid"""
+
+    length = response_header(response, 'Content-Length')
+    if length and all((n.isdigit() for n in length)):
+        return int(length)
+    return None
+
+
+def stream_to_file(response, filepath, chunk_size=CHUNK_SIZE, max_size=0, callback=None, offset=0, digest=None):
+    """Copies response body to filepath in fixed size chunks.
+
+    Args:
+        - response: http.client.HTTPResponse
+        - filepath: str
+        - chunk_size: int - max bytes held in memory at once
+        - max_size: int - abort once file exceeds max_size bytes, 0 for no limit
+        - callback: func - called with number of bytes in each chunk written
+        - offset: int - append body to the first offset bytes of filepath
+        - digest: hashlib hash object updated with each chunk written
+
+    Returns:
+        - bool - False if the connection failed mid-body or EXCEEDS_MAX_SIZE
+            if transfer was aborted for exceeding max_size, the partial file
+            is kept for resume
+    """
+
+    read_bytes = offset
+    try:
+        with open(filepath, 'ab' if offset else 'wb') as f:
+            while True:
+                data = response.read(chunk_size)
+                if not data:
+                    break
+
+                read_bytes += len(data)
+                if max_size and read_bytes > max_size:
+                    return EXCEEDS_MAX_SIZE
+
+                f.write(data)
+                if digest:
+                    digest.update(data)
+                if callback:
+                    callback(len(data))
+    except (OSError, HTTPException):
         return False
 
+    # http.client returns short reads instead of raising when the server
+    # closes before sending Content-Length bytes
+    body_bytes = content_length(response)
+    if body_bytes is not None and read_bytes - offset < body_bytes:
+        return False
 
-def verbose_download(url, filepath, progressbar):
-    response = get_response(url)
-
-    if response:
-        accept_bytes = response.getheader('Accept-Ranges') == 'bytes'
-        content_length = response.getheader('Content-Length')
-
-        if accept_bytes and content_length and all((n.isdigit() for n in content_length)):
-            total_bytes = int(content_length)
-            progressbar.reset(url=url, total_bytes=total_bytes)
-            read_bytes = 0
-            nbytes = 1024
-            loop_count = 1
-            checkpoint = 32
-
-            with open(filepath, 'wb') as f:
-                while read_bytes < total_bytes:
-
-                    if loop_count % checkpoint == 0:
-                        chunk_factor = progressbar.download_rate / nbytes
-                        if chunk_factor < 0.33:
-                            nbytes //= 2
-                        elif chunk_factor > 2:
-                            nbytes *= 2
-                        elif chunk_factor == 0:
-                            progressbar.timeout()
-                            break
+    return True
 
-                    if total_bytes - read_bytes < nbytes:
-                        nbytes = total_bytes - read_bytes
 
-                    f.write(response.read(nbytes))
-                    progressbar.update(nbytes)
-                    read_bytes += nbytes
-                    loop_count += 1
+def record_digest(dedup, filepath, status, digest=None):
+    """Records content digest of a finished download for deduplication.
+    Files without a streamed digest, e.g. segmented or already complete
+    downloads, are hashed from disk.
 
-            if os.path.getsize(filepath) != total_bytes:
-                return False
+    Returns: status
+    """
 
+    if dedup and status:
+        if digest:
+            dedup.add(filepath, digest)
         else:
-            progressbar.no_byte_headers(url)
-            with open(filepath, 'wb') as f:
-                f.write(response.read())
+            dedup.add_file(filepath)
+    return status
 
-        return True
+
+def silent_download(url, filepath, progressbar=None, pool=None, chunk_size=CHUNK_SIZE, max_size=0,
+                    resume=False, segments=1, segment_threshold=SEGMENT_THRESHOLD, validators=None, dedup=None,
+                    limiter=None):
+    """Downloads url without printing, reporting bytes to progressbar if
+    given, a Dashboard of concurrent downloads.
+    """
+
+    response, offset = _open(url, filepath, pool, resume, validators)
+    if response is True:
+        return record_digest(dedup, filepath, True)
+    elif response is NOT_MODIFIED:
+        return response
+    elif response:
+        try:
+            body_bytes = content_length(response)
+            if max_size and body_bytes and offset + body_bytes > max_size:
+                return False
+            if progressbar:
+                total_bytes = None if body_bytes is None else offset + body_bytes
+                callback = progressbar.track(url, total_bytes, offset)
+            else:
+                callback = None
+            if use_segments(response, offset, segments, segment_threshold):
+                status = download_segments(response, url, filepath, body_bytes, segments, pool, chunk_size,
+                                           callback=callback, limiter=limiter)
+                return record_digest(dedup, filepath, status)
+            digest = dedup.hasher(filepath, offset) if dedup else None
+            status = stream_to_file(response, filepath, chunk_size, max_size, callback=callback, offset=offset,
+                                    digest=digest)
+            return record_digest(dedup, filepath, bool(status), digest)
+        finally:
+            release_response(response, pool)
+    else:
+        return False
+
+
+def verbose_download(url, filepath, progressbar, pool=None, chunk_size=CHUNK_SIZE, max_size=0,
+                     resume=False, segments=1, segment_threshold=SEGMENT_THRESHOLD, validators=None, dedup=None,
+                     limiter=None):
+    response, offset = _open(url, filepath, pool, resume, validators)
+
+    if response is True:
+        progressbar.completed_notice(url, True)
+        return record_digest(dedup, filepath, True)
+    elif response is NOT_MODIFIED:
+        progressbar.completed_notice(url, True, label=status_label(response))
+        return response
+    elif response:
+        try:
+            if use_segments(response, offset, segments, segment_threshold):
+                total_bytes = content_length(response)
+                if max_size and total_bytes > max_size:
+                    progressbar.size_limit_notice(url, max_size)
+                    return False
+                progressbar.reset(url=url, total_bytes=total_bytes)
+                status = download_segments(response, url, filepath, total_bytes, segments, pool, chunk_size,
+                                           callback=progressbar.update, limiter=limiter)
+                return record_digest(dedup, filepath, status)
+            digest = dedup.hasher(filepath, offset) if dedup else None
+            status = _verbose_read(response, url, filepath, progressbar, chunk_size, max_size, offset, digest)
+            return record_digest(dedup, filepath, status, digest)
+        finally:
+            release_response(response, pool)
+    else:
+        return False
+
+
+def _verbose_read(response, url, filepath, progressbar, chunk_size, max_size, offset=0, digest=None):
+    accept_bytes = response_header(response, 'Accept-Ranges') == 'bytes' or getattr(response, 'status', None) == 206
+    body_bytes = content_length(response)
+    total_bytes = None if body_bytes is None else offset + body_bytes
+
+    if max_size and total_bytes and total_bytes > max_size:
+        progressbar.size_limit_notice(url, max_size)
+        return False
+
+    if accept_bytes and total_bytes is not None:
+        progressbar.reset(url=url, total_bytes=total_bytes, start_bytes=offset)
+        read_bytes = offset
+        nbytes = min(1024, chunk_size)
+        loop_count = 1
+        checkpoint = 32
+
+        with open(filepath, 'ab' if offset else 'wb') as f:
+            while read_bytes < total_bytes:
+
+                if loop_count % checkpoint == 0:
+                    chunk_factor = progressbar.download_rate / nbytes
+                    if chunk_factor < 0.33:
+                        nbytes = max(nbytes // 2, 1)
+                    elif chunk_factor > 2:
+                        nbytes = min(nbytes * 2, chunk_size)
+                    elif chunk_factor == 0:
+                        progressbar.timeout()
+                        break
+
+                if total_bytes - read_bytes < nbytes:
+                    nbytes = total_bytes - read_bytes
+
+                try:
+                    data = response.read(nbytes)
+                except (OSError, HTTPException):
+                    # connection lost mid-body, the size check below fails it
+                    break
+                if not data:
+                    break
+
+                f.write(data)
+                if digest:
+                    digest.update(data)
+                progressbar.update(len(data))
+                read_bytes += len(data)
+                loop_count += 1
+
+        if os.path.getsize(filepath) != total_bytes:
+            return False
 
     else:
+        progressbar.no_byte_headers(url)
+        status = stream_to_file(response, filepath, chunk_size, max_size, offset=offset, digest=digest)
+        if status is EXCEEDS_MAX_SIZE:
+            progressbar.size_limit_notice(url, max_size)
+        if not status:
+            return False
+
+    return True
+
+
+# ------------------------------------------------------------------------------
+def use_segments(response, offset, segments, segment_threshold):
+    """Checks if a fresh full response can be split into parallel range requests.
+
+    Returns: bool
+    """
+
+    if segments < 2 or offset or getattr(response, 'status', None) != 200:
+        return False
+    total_bytes = content_length(response)
+    accept_bytes = response_header(response, 'Accept-Ranges') == 'bytes'
+    return accept_bytes and total_bytes is not None and total_bytes >= segment_threshold
+
+
+def split_ranges(total_bytes, segments):
+    """Splits total_bytes into contiguous inclusive byte ranges.
+
+    Returns: list of (start, end)
+    """
+
+    size = -(-total_bytes // segments)
+    return [(start, min(start + size, total_bytes) - 1) for start in range(0, total_bytes, size)]
+
+
+class _ByteCounter(object):
+    """Thread safe running total of bytes written by segment workers."""
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def add(self, n):
+        with self._lock:
+            self.value += n
+
+
+def _copy_range(response, filepath, start, end, chunk_size, counter):
+    """Writes response body to filepath at offsets start through end.
+
+    Returns: bool - all bytes of range were received
+    """
+
+    remaining = end - start + 1
+    try:
+        with open(filepath, 'r+b') as f:
+            f.seek(start)
+            while remaining > 0:
+                data = response.read(min(chunk_size, remaining))
+                if not data:
+                    return False
+                f.write(data)
+                remaining -= len(data)
+                counter.add(len(data))
+    except (OSError, HTTPException):
         return False
+    return True
+
+
+def _fetch_range(url, filepath, start, end, pool, chunk_size, counter):
+    response = get_response(url, pool, {'Range': 'bytes={}-{}'.format(start, end)})
+    if not response:
+        return False
+
+    try:
+        byte_range = content_range(response_header(response, 'Content-Range'))
+        if response.status != 206 or not byte_range or byte_range[0] != start:
+            return False
+        return _copy_range(response, filepath, start, end, chunk_size, counter)
+    finally:
+        release_response(response, pool)
+
+
+def hold_segments(url, count, limiter):
+    """Takes up to count extra connection slots and rate tokens of url's
+    host without waiting, stopping at the first one unavailable.
+
+    Returns: int - slots taken, each to be released with limiter.release
+    """
+
+    if limiter is None:
+        return count
+
+    held = 0
+    while held < count and limiter.try_hold(url):
+        if limiter.try_acquire(url):
+            limiter.release(url)
+            break
+        held += 1
+    return held
+
+
+def download_segments(response, url, filepath, total_bytes, segments, pool=None, chunk_size=CHUNK_SIZE,
+                      callback=None, limiter=None):
+    """Downloads url as parallel byte ranges written in place into filepath.
+
+    The first range is read from the already open response, the rest are
+    requested on separate connections. Each extra connection counts against
+    the host's concurrency and rate limits, so fewer ranges are used when the
+    host has no free slot. A marker file is kept next to filepath until every
+    range is complete so a partial file with gaps is never resumed.
+
+    Args:
+        - response: http.client.HTTPResponse - open full response for url
+        - url: str
+        - filepath: str
+        - total_bytes: int - size of file
+        - segments: int - number of ranges downloaded at the same time
+        - pool: ConnectionPool instance or None
+        - chunk_size: int - max bytes held in memory per segment
+        - callback: func - called from the calling thread with aggregate bytes
+            received across segments since the last call
+        - limiter: ratelimit.HostLimiter instance or None, the download of
+            response is expected to hold one slot already
+
+    Returns:
+        - bool - all segments were downloaded
+    """
+
+    extra = hold_segments(url, segments - 1, limiter)
+    ranges = split_ranges(total_bytes, extra + 1)
+    marker = filepath + SEGMENT_SUFFIX
+    open(marker, 'w').close()
+    with open(filepath, 'wb') as f:
+        f.truncate(total_bytes)
+
+    counter = _ByteCounter()
+    reported = 0
+
+    try:
+        with ThreadPoolExecutor(max_workers=len(ranges)) as executor:
+            start, end = ranges[0]
+            futures = [executor.submit(_copy_range, response, filepath, start, end, chunk_size, counter)]
+            for start, end in ranges[1:]:
+                futures.append(executor.submit(_fetch_range, url, filepath, start, end, pool, chunk_size,
+                                               counter))
+
+            not_done = futures
+            while not_done:
+                _, not_done = wait_futures(not_done, timeout=0.1)
+                received = counter.value
+                if callback and received > reported:
+                    callback(received - reported)
+                    reported = received
+    finally:
+        if limiter is not None:
+            for _ in range(extra):
+                limiter.release(url)
+
+    if all(future.result() for future in futures):
+        os.remove(marker)
+        return True
+    return False
 
 
 # ------------------------------------------------------------------------------
@@ -83,17 +611,317 @@ def timestamp():
     Returns: tuple (str, str)
     """
 
-    return (time.strftime('%x'), time.strftime('%X'))
+    now = time.localtime()
+    return (time.strftime('%x', now), time.strftime('%X', now))
+
+
+def host_key(url):
+    """Host used to group concurrent requests, including any port.
+
+    Returns: str
+    """
+
+    return urlparse(url).netloc.lower()
+
+
+def temp_tasks(urlist, tmp_dir):
+    """Assigns a temporary filepath to each url as it is read from urlist.
+
+    Yields:
+        - task: tuple (temp_path, url, net_subdir, filename)
+    """
+
+    temp_subdirs = set()
+    for url in urlist:
+        net_subdir, filename = split_url_dir(url)
+        temp_subdir = os.path.join(tmp_dir.name, stable_subdir_name(net_subdir))
+        if temp_subdir not in temp_subdirs:
+            confirm_directory(temp_subdir)
+            temp_subdirs.add(temp_subdir)
+
+        yield os.path.join(temp_subdir, filename), url, net_subdir, filename
 
 
-def to_tmp(urlist, wait, quiet, silent):
+def collect_results(tasks, results):
+    """Splits tasks into completed and failed requests, preserving task order.
+
+    Args:
+        - tasks: list of (temp_path, url, net_subdir, filename)
+        - results: list of (status, timestamp) matching tasks
+
+    Returns:
+        - completed: list of (temp_path, url, net_subdir, filename, timestamp)
+        - failed: list (str) - failed urls
+
+    Urls with status NOT_MODIFIED are in neither list.
+    """
+
+    completed = []
+    failed = []
+    for (temp_path, url, net_subdir, filename), (status, dl_timestamp) in zip(tasks, results):
+        if status is NOT_MODIFIED:
+            continue
+        elif status:
+            completed.append((temp_path, url, net_subdir, filename, dl_timestamp))
+        else:
+            failed.append(url)
+    return completed, failed
+
+
+def place_completed(placer, task, result):
+    """Hands a finished download to placer unless it failed or was unchanged.
+
+    Args:
+        - placer: write_files.FilePlacer instance or None
+        - task: tuple - (temp_path, url, net_subdir, filename)
+        - result: tuple - (status, timestamp)
+    """
+
+    status, dl_timestamp = result
+    if placer and status and status is not NOT_MODIFIED:
+        placer.place(task + (dl_timestamp,))
+
+
+def journaled(download, journal):
+    """Wraps a download func to record the state of each url in a job journal.
+
+    Returns: func - same signature as download
+    """
+
+    def download_url(url, temp_path, progressbar, pool):
+        journal.started(url)
+        status = download(url, temp_path, progressbar, pool)
+        journal.finished(url, status, timestamp())
+        return status
+
+    return download_url
+
+
+def with_transfer(stats, func, *args, **kwargs):
+    """Calls func with stats as the transfer running in this thread, so
+    open_url records its responses.
+    """
+
+    set_current_transfer(stats)
+    try:
+        return func(*args, **kwargs)
+    finally:
+        set_current_transfer(None)
+
+
+def logged(download, transfer_log):
+    """Wraps a download func to measure each transfer for a transfer log.
+
+    Returns: func - same signature as download
+    """
+
+    def download_url(url, temp_path, progressbar, pool):
+        stats = TransferStats(url)
+        status = with_transfer(stats, download, url, temp_path, progressbar, pool)
+        stats.finish(temp_path)
+        transfer_log.finished(stats, transfer_result(status))
+        return status
+
+    return download_url
+
+
+def _fetch(download, url, temp_path, progressbar, wait, pool):
+    """Worker task for concurrent downloads.
+
+    Returns: tuple (bool, tuple) - download status, timestamp
+    """
+
+    status = download(url, temp_path, progressbar, pool)
+    dl_timestamp = timestamp()
+    time.sleep(wait)
+    return status, dl_timestamp
+
+
+def _run_sequential(tasks, download, progressbar, wait, limiter, pool, placer=None):
+    """Downloads tasks one at a time as they are read, placing each file
+    before the next request.
+
+    Returns:
+        - tasks: list of (temp_path, url, net_subdir, filename) read
+        - results: list of (status, timestamp) in task order
+    """
+
+    read_tasks = []
+    results = []
+    for task in tasks:
+        temp_path, url = task[:2]
+        read_tasks.append(task)
+        time.sleep(limiter.delay(url))
+        limiter.hold(url)
+        try:
+            status = download(url, temp_path, progressbar, pool)
+        finally:
+            limiter.release(url)
+        results.append((status, timestamp()))
+        place_completed(placer, task, results[-1])
+        time.sleep(wait)
+    if progressbar:
+        progressbar.set_total(len(read_tasks))
+    return read_tasks, results
+
+
+def _read_tasks(tasks, events, window, stop):
+    """Reader thread putting each task on events as it is parsed, then None.
+
+    A window slot is taken before each read, so at most jobs + LOOKAHEAD
+    tasks are read but unfinished. Errors raised by tasks are put on events
+    for the dispatcher to raise.
+    """
+
+    task_iter = iter(tasks)
+    try:
+        while True:
+            window.acquire()
+            if stop.is_set():
+                return
+            task = next(task_iter, None)
+            events.put((_READ, task))
+            if task is None:
+                return
+    except Exception as e:
+        events.put((_READ_FAILED, e))
+
+
+def _run_concurrent(tasks, download, progressbar, wait, jobs, limiter, pool, placer=None):
+    """Downloads tasks with a pool of worker threads.
+
+    Tasks are only handed to the pool when their host is below its concurrency
+    limit and has a rate token available, so an idle worker never blocks
+    waiting on a busy or rate limited host. Tasks are read from the iterable
+    by a reader thread, keeping at most jobs + LOOKAHEAD of them read but
+    unfinished, so downloads start before the url source is exhausted and
+    slow input never holds up finished downloads. Finished files are placed
+    by the calling thread as their downloads complete.
+
+    Args:
+        - tasks: iterable of (temp_path, url, net_subdir, filename)
+        - progressbar: Dashboard instance or None, workers report bytes to it
+        - wait: float - time in seconds each worker delays after a request
+        - jobs: int - number of worker threads
+        - limiter: ratelimit.HostLimiter instance
+        - pool: ConnectionPool instance or None
+        - placer: write_files.FilePlacer instance or None
+
+    Returns:
+        - tasks: list of (temp_path, url, net_subdir, filename) read
+        - results: list of (status, timestamp) in task order
+    """
+
+    # read tasks and finished downloads arrive on one queue, so the
+    # dispatcher waits on both together
+    events = queue.Queue()
+    window = threading.Semaphore(jobs + LOOKAHEAD)
+    stop = threading.Event()
+    reader = threading.Thread(target=_read_tasks, args=(tasks, events, window, stop), daemon=True)
+    reading = True
+    read_tasks = []
+    results = []
+    pending = {}
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        reader.start()
+        try:
+            while reading or pending or running:
+                next_token = None
+                submitted = True
+                while submitted and len(running) < jobs:
+                    submitted = False
+                    # round robin between hosts with open slots
+                    for host in list(pending):
+                        if len(running) >= jobs:
+                            break
+
+                        temp_path, url = read_tasks[pending[host][0]][:2]
+                        if not limiter.try_hold(url):
+                            continue
+
+                        delay = limiter.try_acquire(url)
+                        if delay:
+                            limiter.release(url)
+                            next_token = delay if next_token is None else min(next_token, delay)
+                            continue
+
+                        ix = pending[host].popleft()
+                        if not pending[host]:
+                            del pending[host]
+
+                        future = executor.submit(_fetch, download, url, temp_path, progressbar, wait, pool)
+                        running[future] = ix
+                        future.add_done_callback(lambda f: events.put((_FINISHED, f)))
+                        submitted = True
+
+                try:
+                    kind, value = events.get(timeout=next_token)
+                except queue.Empty:
+                    continue
+
+                if kind is _READ:
+                    if value is None:
+                        reading = False
+                        if progressbar:
+                            progressbar.set_total(len(read_tasks))
+                    else:
+                        host = host_key(value[1])
+                        pending.setdefault(host, deque()).append(len(read_tasks))
+                        read_tasks.append(value)
+                        results.append(None)
+                elif kind is _READ_FAILED:
+                    raise value
+                else:
+                    ix = running.pop(value)
+                    limiter.release(read_tasks[ix][1])
+                    results[ix] = value.result()
+                    if progressbar:
+                        status = results[ix][0]
+                        progressbar.completed_notice(read_tasks[ix][1], status, label=status_label(status))
+                    place_completed(placer, read_tasks[ix], results[ix])
+                    window.release()
+        finally:
+            # wakes a reader waiting on the window so it can exit
+            stop.set()
+            window.release()
+
+    return read_tasks, results
+
+
+def to_tmp(urlist, wait, quiet, silent, jobs=1, host_jobs=0, pool=None, chunk_size=CHUNK_SIZE, max_size=0,
+           resume=False, segments=1, segment_threshold=SEGMENT_THRESHOLD, limiter=None, validators=None,
+           dedup=None, journal=None, placer=None, transfer_log=None):
     """Downloads all valid URLs to tmp subdirectory and collects details on completed requests.
 
     Args:
-        - urlist: list of (url, filename)
+        - urlist: list or iterable of urls, an iterator is read as downloads
+            progress so requests start before it is exhausted
         - wait: float - time in seconds to delay requests
         - quiet: bool - enables optional progressbar display
         - silent: bool - disables progressbar / any printing to stdout
+        - jobs: int - number of concurrent downloads, 1 downloads sequentially
+        - host_jobs: int - max concurrent downloads per host, 0 for no limit
+        - pool: ConnectionPool instance to reuse keep-alive connections, or
+            None to open a new connection per url
+        - chunk_size: int - max bytes of a response body held in memory
+        - max_size: int - abort downloads larger than max_size bytes, 0 for no limit
+        - resume: bool - download into a persistent partial directory within
+            cwd and continue partial files left by earlier runs
+        - segments: int - parallel range requests per file, 1 disables segmenting
+        - segment_threshold: int - min file size in bytes to segment
+        - limiter: ratelimit.HostLimiter instance with per-host rate and
+            concurrency limits, replaces host_jobs
+        - validators: ValidatorStore instance to send conditional requests
+            and skip unchanged urls, which are neither completed nor failed
+        - dedup: dedup.DedupIndex instance to hash each download as it is written
+        - journal: journal.JobJournal instance recording the state of each url,
+            downloads into the persistent partial directory like resume
+        - placer: write_files.FilePlacer instance, each completed download is
+            placed right after it finishes
+        - transfer_log: transfer_log.TransferLog instance recording the
+            metrics of each transfer
 
     Returns:
         - completed: list of tuples containing:
@@ -103,38 +931,55 @@ def to_tmp(urlist, wait, quiet, silent):
             - filename: str
             - timestamp: tuple - (date, time)
         - failed: list (str) - failed urls
-        - tmp_dir: tempfile.TemporaryDirectory instance
+        - tmp_dir: tempfile.TemporaryDirectory or dir_tools.PartialDir instance
     """
 
-    tmp_dir = load_temp_dir()
-
-    completed = []
-    failed = []
-    dir_groups = group_by_dir(urlist)
+    if resume or journal:
+        tmp_dir = load_partial_dir()
+    else:
+        tmp_dir = load_temp_dir()
 
+    nfiles = len(urlist) if hasattr(urlist, '__len__') else None
     if silent:
-        download = silent_download
         progressbar = None
+    elif jobs > 1:
+        progressbar = Dashboard(quiet=quiet, nfiles=nfiles)
+    else:
+        progressbar = Progressbar(quiet=quiet, nfiles=nfiles)
+
+    if silent or jobs > 1:
+        download = silent_download
     else:
         download = verbose_download
-        progressbar = Progressbar(quiet=quiet, nfiles=len(urlist))
 
-    for net_subdir, url_name_list in dir_groups.items():
-        temp_subdir = os.path.join(tmp_dir.name, str(hash(net_subdir)))
-        confirm_directory(temp_subdir)
+    if limiter is None:
+        limiter = HostLimiter(concurrency=host_jobs)
 
-        for (url, filename) in url_name_list:
-            temp_path = os.path.join(temp_subdir, filename)
-            status = download(url, temp_path, progressbar)
+    download = partial(download, chunk_size=chunk_size, max_size=max_size, resume=resume,
+                       segments=segments, segment_threshold=segment_threshold, validators=validators,
+                       dedup=dedup, limiter=limiter)
 
-            if status:
-                completed.append((temp_path, url, net_subdir, filename, timestamp()))
-            else:
-                failed.append(url)
-            time.sleep(wait)
+    tasks = temp_tasks(urlist, tmp_dir)
+
+    if transfer_log:
+        download = logged(download, transfer_log)
+
+    if journal:
+        tasks = list(tasks)
+        journal.add_tasks(tasks)
+        download = journaled(download, journal)
+
+    if jobs > 1:
+        tasks, results = _run_concurrent(tasks, download, progressbar, wait, jobs, limiter, pool, placer)
+    else:
+        tasks, results = _run_sequential(tasks, download, progressbar, wait, limiter, pool, placer)
+
+    completed, failed = collect_results(tasks, results)
 
-    if quiet and progressbar:
-        progressbar.cleanup()
+    if progressbar:
+        if quiet:
+            progressbar.cleanup()
+        progressbar.close()
 
     return completed, failed, tmp_dir
 
@@ -3,12 +3,170 @@
 import argparse
 from itertools import compress
 import os
+import re
+import sys
 
 from geturls.dir_tools import validate_directory
+import geturls.aio_download as aio_download
+from geturls.connection_pool import ConnectionPool
+from geturls.dedup import DEDUP_DBNAME, DedupIndex
+from geturls.journal import JobJournal
+from geturls.metrics import FORMATS, RunMetrics
+from geturls.progressbar import byte_unit
+from geturls.transfer_log import TransferLog, transfer_sink
+from geturls.ratelimit import HostLimiter, load_host_limits
+from geturls.url_filter import URLFilter
+from geturls.unique import BLOOM_CAPACITY, BLOOM_ERROR_RATE, seen_set, sorted_unique
+from geturls.validators import ValidatorStore
 import geturls.download as download
-from geturls.parser import extract_urls, extract_urls_from_files
+from geturls.parser import STDIN, iter_urls, iter_urls_from_files, normalize_cache_stats, unique_urls
 import geturls.write_files as write_files
 # ------------------------------------------------------------------------------
+BYTE_UNITS = {'': 1, 'K': 10**3, 'M': 10**6, 'G': 10**9, 'T': 10**12}
+
+
+def byte_size(text):
+    """Argparse type for sizes in bytes with optional K/M/G/T suffix.
+
+    Returns: int
+    """
+
+    value = text.strip().upper().rstrip('B')
+    unit = value[-1:] if value[-1:] in BYTE_UNITS else ''
+    number = value[:len(value) - len(unit)]
+    try:
+        size = int(float(number) * BYTE_UNITS[unit])
+    except ValueError:
+        raise argparse.ArgumentTypeError('invalid size: {}'.format(text))
+    if size < 0:
+        raise argparse.ArgumentTypeError('invalid size: {}'.format(text))
+    return size
+
+
+def positive_byte_size(text):
+    """Argparse type for a size in bytes of at least 1, e.g. a read size.
+
+    Returns: int
+    """
+
+    size = byte_size(text)
+    if size < 1:
+        raise argparse.ArgumentTypeError('size must be at least 1 byte: {}'.format(text))
+    return size
+
+
+def url_count(text):
+    """Argparse type for a positive number of URLs with optional K/M/G suffix.
+
+    Returns: int
+    """
+
+    count = byte_size(text)
+    if count < 1:
+        raise argparse.ArgumentTypeError('invalid count: {}'.format(text))
+    return count
+
+
+def positive_int(text):
+    """Argparse type for an integer of at least 1.
+
+    Returns: int
+    """
+
+    try:
+        value = int(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError('invalid int value: {}'.format(text))
+    if value < 1:
+        raise argparse.ArgumentTypeError('must be at least 1: {}'.format(text))
+    return value
+
+
+def non_negative_int(text):
+    """Argparse type for an integer of at least 0.
+
+    Returns: int
+    """
+
+    try:
+        value = int(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError('invalid int value: {}'.format(text))
+    if value < 0:
+        raise argparse.ArgumentTypeError('must not be negative: {}'.format(text))
+    return value
+
+
+def non_negative_float(text):
+    """Argparse type for a finite number of at least 0.
+
+    Returns: float
+    """
+
+    try:
+        value = float(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError('invalid float value: {}'.format(text))
+    if not 0 <= value < float('inf'):
+        raise argparse.ArgumentTypeError('must be a finite number of at least 0: {}'.format(text))
+    return value
+
+
+def positive_float(text):
+    """Argparse type for a finite number greater than 0.
+
+    Returns: float
+    """
+
+    try:
+        value = float(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError('invalid float value: {}'.format(text))
+    if not 0 < value < float('inf'):
+        raise argparse.ArgumentTypeError('must be a finite number greater than 0: {}'.format(text))
+    return value
+
+
+def error_rate(text):
+    """Argparse type for a probability between 0 and 1, exclusive.
+
+    Returns: float
+    """
+
+    try:
+        rate = float(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError('invalid rate: {}'.format(text))
+    if not 0 < rate < 1:
+        raise argparse.ArgumentTypeError('rate must be between 0 and 1: {}'.format(text))
+    return rate
+
+
+def regex(text):
+    """Argparse type for a regular expression, checked to compile.
+
+    Returns: str
+    """
+
+    try:
+        re.compile(text)
+    except re.error as e:
+        raise argparse.ArgumentTypeError('invalid regex {}: {}'.format(text, e))
+    return text
+
+
+def host_limits(filepath):
+    """Argparse type for JSON file of per-host limits.
+
+    Returns: dict
+    """
+
+    try:
+        return load_host_limits(filepath)
+    except (OSError, ValueError) as e:
+        raise argparse.ArgumentTypeError('unable to read host limits: {}'.format(e))
+
+
 def parse_arguments():
     parser = argparse.ArgumentParser(prog='geturls',
                                      description='Parses, downloads, and sorts urls from file(s)')
@@ -17,11 +175,17 @@ def parse_arguments():
     subdir_group = parser.add_mutually_exclusive_group()
 
     input_group.add_argument('--input', '-i', nargs='+', type=argparse.FileType('r'),
-                              help="Input file(s) to parse for URLs")
+                              help="Input file(s) to parse for URLs, - for stdin")
+
+    input_group.add_argument('--stdin', action='store_true',
+                              help="Parse URLs from stdin as lines arrive, e.g. piped from a crawler")
 
     input_group.add_argument('--urls', '-u', nargs='+', type=str,
                               help="Input text URL(s) to download")
 
+    parser.add_argument('--parse-workers', type=non_negative_int, default=1,
+                         help='Processes parsing input files and large file chunks in parallel, 0 for one per CPU. Defaults to 1')
+
     parser.add_argument('--dirprefix', '-d', type=validate_directory, default=os.getcwd(),
                          help='Root / parent directory to store all files and subdirectories. Defaults to cwd')
 
@@ -35,15 +199,105 @@ def parse_arguments():
     parser.add_argument('--extract', '-x', action='store_true',
                          help='Skip download and print URLs to stdout')
 
+    parser.add_argument('--sort', action='store_true',
+                         help='Print --extract URLs sorted once input ends, spilling sorted runs to disk for large inputs')
+
+    parser.add_argument('--url-dedup', choices=('exact', 'bloom', 'disk'), default='exact',
+                         help='Repeated URL detection: in memory set, bounded memory Bloom filter or SQLite index on disk. Defaults to exact')
+
+    parser.add_argument('--bloom-capacity', type=url_count, default=BLOOM_CAPACITY,
+                         help='URLs held in fixed memory by --url-dedup bloom, e.g. 50M. Defaults to 10M')
+
+    parser.add_argument('--bloom-error-rate', type=error_rate, default=BLOOM_ERROR_RATE,
+                         help='False positive rate of --url-dedup bloom, the share of new URLs skipped. Defaults to 1e-6')
+
     parser.add_argument('--overwrite', action='store_true',
                          help='Overwrite existing files of same name')
 
     parser.add_argument('--reject', '-r', type=str, nargs='+',
                          help='Skip filetypes entered')
 
+    parser.add_argument('--accept', '-a', type=str, nargs='+',
+                         help='Only keep filetypes entered')
+
+    parser.add_argument('--accept-host', type=str, nargs='+',
+                         help='Only keep URLs of these hosts and their subdomains')
+
+    parser.add_argument('--reject-host', type=str, nargs='+',
+                         help='Skip URLs of these hosts and their subdomains')
+
+    parser.add_argument('--accept-glob', type=str, nargs='+',
+                         help="Only keep URLs whose path matches a glob, e.g. '/docs/*.pdf'")
+
+    parser.add_argument('--reject-glob', type=str, nargs='+',
+                         help="Skip URLs whose path matches a glob, e.g. '*/thumbs/*'")
+
+    parser.add_argument('--accept-regex', type=regex, nargs='+',
+                         help='Only keep URLs matching a regular expression')
+
+    parser.add_argument('--reject-regex', type=regex, nargs='+',
+                         help='Skip URLs matching a regular expression')
+
     parser.add_argument('--wait', '-w', type=float, default=0.01,
                          help='Seconds to wait in between url requests. Defaults to 0.01')
 
+    parser.add_argument('--engine', choices=('thread', 'async'), default='thread',
+                         help='Download engine: urllib worker threads or a single asyncio event loop. Defaults to thread')
+
+    parser.add_argument('--jobs', '-j', type=positive_int,
+                         help='Number of concurrent downloads. Defaults to 1 (thread) or {} (async)'.format(aio_download.DEFAULT_JOBS))
+
+    parser.add_argument('--host-jobs', type=non_negative_int, default=0,
+                         help='Max concurrent downloads per host. Defaults to no limit')
+
+    parser.add_argument('--rate', type=non_negative_float, default=0,
+                         help='Max requests per second to each host. Defaults to no limit')
+
+    parser.add_argument('--burst', type=positive_int, default=1,
+                         help='Requests allowed back to back per host before --rate applies. Defaults to 1')
+
+    parser.add_argument('--host-limits', type=host_limits,
+                         help='JSON file of per-host rate, burst and concurrency limits')
+
+    parser.add_argument('--cache', action='store_true',
+                         help='Skip unchanged files using ETag / Last-Modified validators saved in dirprefix')
+
+    parser.add_argument('--dedup', action='store_true',
+                         help='Link files with identical content to the first copy instead of keeping duplicates')
+
+    parser.add_argument('--dedup-persist', action='store_true',
+                         help='Keep the --dedup content index in dirprefix to link duplicates across runs')
+
+    parser.add_argument('--dedup-link', choices=('hard', 'reflink'), default='hard',
+                         help='Link type used by --dedup. Defaults to hard')
+
+    parser.add_argument('--keep-alive', action='store_true',
+                         help='Reuse connections to the same host (thread engine)')
+
+    parser.add_argument('--max-idle', type=positive_int, default=4,
+                         help='Max idle keep-alive connections per host. Defaults to 4')
+
+    parser.add_argument('--max-conn-age', type=positive_float, default=60.0,
+                         help='Seconds before a keep-alive connection is retired. Defaults to 60')
+
+    parser.add_argument('--buffer-size', type=positive_byte_size, default=download.CHUNK_SIZE,
+                         help='Max bytes of each response held in memory, e.g. 256K. Defaults to 65536')
+
+    parser.add_argument('--max-size', type=byte_size, default=0,
+                         help='Abort downloads larger than size, e.g. 500M. Defaults to no limit')
+
+    parser.add_argument('--resume', action='store_true',
+                         help='Keep partial downloads between runs and resume them with range requests')
+
+    parser.add_argument('--resume-job', action='store_true',
+                         help='Journal the state of each URL in dirprefix and restart an interrupted run with only its unfinished URLs')
+
+    parser.add_argument('--segments', type=positive_int, default=1,
+                         help='Download large files over n parallel range requests (thread engine). Defaults to 1')
+
+    parser.add_argument('--segment-threshold', type=byte_size, default=download.SEGMENT_THRESHOLD,
+                         help='Min file size to segment, e.g. 50M. Defaults to 8M')
+
     parser.add_argument('--quiet', '-q', action='store_true',
                          help='Minimal status display to stdout')
 
@@ -53,54 +307,82 @@ def parse_arguments():
     parser.add_argument('--log', '-l', type=argparse.FileType('a'),
                          help='Write / append to download log file')
 
+    parser.add_argument('--json-log', type=str,
+                         help='Append a JSON line with the result and timings of each transfer to file')
+
+    parser.add_argument('--metrics', type=str,
+                         help='Write run metrics to file at exit, Prometheus text format or JSON for a .json file')
+
+    parser.add_argument('--metrics-format', choices=FORMATS,
+                         help='Format of --metrics file, overrides the file extension')
+
+    parser.add_argument('--metrics-interval', type=positive_float, default=0,
+                         help='Also rewrite --metrics file every n seconds during the run')
+
     return parser.parse_args()
 
 
 # ------------------------------------------------------------------------------
-def save_to_subdirs(completed, dirsort_type, overwrite):
-    """Calls user selected subdir sort func to move files to their final directory.
-
-    Args:
-        - completed: list - tuples containing url/temp_path from download.to_tmp
-        - dirsort_type: str - ''/'host'/'type'
-        - overwrite: bool - passed on to write_files func
+def input_paths(args):
+    """Paths of input files to parse, parser.STDIN for standard input.
 
-    Returns:
-        - log_details: list - tuples of timestamp, url, path for log file
+    Returns: list (str)
     """
 
-    if dirsort_type == 'host':
-        log_details = write_files.to_host_subdirs(completed, overwrite)
-    elif dirsort_type == 'name':
-        log_details = write_files.to_name_subdirs(completed, overwrite)
-    elif dirsort_type == 'type':
-        log_details = write_files.to_filetype_subdirs(completed, overwrite)
-    else:
-        log_details = write_files.to_cwd(completed, overwrite)
+    if args.stdin:
+        return [STDIN]
+    return [STDIN if infile is sys.stdin else os.path.abspath(infile.name) for infile in args.input]
 
-    return log_details
+
+def reads_stdin(args):
+    """Returns: bool - urls are read from a stdin stream of unknown length"""
+
+    return args.stdin or any(infile is sys.stdin for infile in args.input or ())
 
 
 def main():
     args = parse_arguments()
 
-    if args.input:
-        urlist = extract_urls_from_files([infile.name for infile in args.input])
+    # urls are parsed lazily so downloads start while input is still being read
+    if args.input or args.stdin:
+        workers = args.parse_workers or os.cpu_count() or 1
+        urls = iter_urls_from_files(input_paths(args), workers)
     else:
-        urlist = extract_urls(args.urls)
+        urls = iter_urls(args.urls)
 
-    if args.reject:
-        reject_types = ['.' + ft if not ft.startswith('.') else ft for ft in args.reject]
-        urlist = [url for url in urlist if all((not url.endswith(ft) for ft in reject_types))]
+    # rejected urls are dropped before deduplication so they are never stored
+    url_filter = URLFilter(accept_types=args.accept or (), reject_types=args.reject or (),
+                           accept_hosts=args.accept_host or (), reject_hosts=args.reject_host or (),
+                           accept_globs=args.accept_glob or (), reject_globs=args.reject_glob or (),
+                           accept_regexes=args.accept_regex or (), reject_regexes=args.reject_regex or ())
+    urls = url_filter.filter(urls)
 
-    if args.extract:
-        for url in urlist:
+    if args.extract and args.sort:
+        for url in sorted_unique(urls):
             print(url)
         return 0
 
+    seen_urls = seen_set(args.url_dedup, args.bloom_capacity, args.bloom_error_rate)
+    urls = unique_urls(urls, seen_urls)
+
+    if args.extract:
+        for url in urls:
+            print(url, flush=True)
+        if args.url_dedup == 'disk':
+            seen_urls.close()
+        return 0
+
     if not args.silent:
         print()
 
+    # opened before changing directory so relative paths are kept
+    json_log = TransferLog(args.json_log) if args.json_log else None
+    metrics = RunMetrics(args.metrics, args.metrics_format, args.metrics_interval) if args.metrics else None
+    if metrics:
+        urls = metrics.timed(urls)
+        metrics.start()
+    transfer_log = transfer_sink([json_log, metrics])
+
     if args.dirprefix != os.getcwd():
         os.chdir(args.dirprefix)
 
@@ -111,21 +393,110 @@ def main():
     else:
         dirsort_type = ''
 
-    completed, failed, tmp_dir = download.to_tmp(urlist, args.wait, args.quiet, args.silent)
+    limiter = HostLimiter(rate=args.rate, burst=args.burst, concurrency=args.host_jobs, hosts=args.host_limits)
+
+    validators = ValidatorStore() if args.cache else None
 
-    if completed:
-        log_details = save_to_subdirs(completed, dirsort_type, args.overwrite)
+    if args.dedup or args.dedup_persist:
+        dedup = DedupIndex(DEDUP_DBNAME if args.dedup_persist else None, link=args.dedup_link)
+    else:
+        dedup = None
+
+    if args.resume_job:
+        # the journal needs the whole batch to find finished urls
+        urlist = list(urls)
+        journal = JobJournal()
+        download_urls = journal.unfinished(urlist)
+        recovered = journal.recover(download_urls)
     else:
-        log_details = False
+        journal = None
+        download_urls = urls
+        recovered = []
+
+    # files are moved to their final directory as each download completes
+    placer = write_files.FilePlacer(dirsort_type, args.overwrite, dedup, journal, transfer_log, metrics)
+    if recovered:
+        # downloads finished before the interruption are placed first
+        for item in recovered:
+            placer.place(item)
+        recovered_urls = set(url for _, url, _, _, _ in recovered)
+        download_urls = [url for url in download_urls if url not in recovered_urls]
+
+    if metrics:
+        metrics.start_phase('fetch')
+
+    pool = None
+    if args.engine == 'async':
+        completed, failed, tmp_dir = aio_download.to_tmp(download_urls, args.wait, args.quiet, args.silent,
+                                                         jobs=args.jobs or aio_download.DEFAULT_JOBS,
+                                                         limiter=limiter,
+                                                         chunk_size=args.buffer_size,
+                                                         max_size=args.max_size,
+                                                         resume=args.resume,
+                                                         validators=validators,
+                                                         dedup=dedup,
+                                                         journal=journal,
+                                                         placer=placer,
+                                                         transfer_log=transfer_log)
+    else:
+        if not args.silent and (args.jobs or 1) == 1 and not reads_stdin(args):
+            # finite input is read up front so sequential progress shows n/N
+            download_urls = list(download_urls)
+        if args.keep_alive:
+            pool = ConnectionPool(max_idle=args.max_idle, max_age=args.max_conn_age)
+        completed, failed, tmp_dir = download.to_tmp(download_urls, args.wait, args.quiet, args.silent,
+                                                     jobs=args.jobs or 1, limiter=limiter,
+                                                     pool=pool, chunk_size=args.buffer_size,
+                                                     max_size=args.max_size, resume=args.resume,
+                                                     segments=args.segments,
+                                                     segment_threshold=args.segment_threshold,
+                                                     validators=validators,
+                                                     dedup=dedup,
+                                                     journal=journal,
+                                                     placer=placer,
+                                                     transfer_log=transfer_log)
+        if pool:
+            pool.close()
+
+    if metrics:
+        metrics.end_phase('fetch')
+
+    log_details = placer.finish()
+
+    if transfer_log:
+        transfer_log.close()
+
+    if journal:
+        journal.complete(urlist)
+
+    if dedup:
+        dedup.close()
+
+    if validators:
+        if log_details:
+            validators.commit_paths(log_details)
+        validators.close()
 
     if args.log and log_details:
         write_files.to_logfile(args.log.name, log_details)
 
     if not args.silent:
-        if log_details:
-            stats = (len(s) for s in (urlist, log_details, failed))
+        if log_details or (validators and validators.unchanged) or (journal and journal.skipped):
+            stats = (len(s) for s in (seen_urls, log_details or [], failed))
             w = os.get_terminal_size()[0]
             print(' URLs: {} - Completed: {} - Failed: {} '.format(*stats).center(w, '-'))
+            if validators:
+                print(' Unchanged: {} '.format(len(validators.unchanged)).center(w, '-'))
+            if journal and journal.skipped:
+                print(' Finished by earlier run: {} '.format(journal.skipped).center(w, '-'))
+            if dedup:
+                print(' Deduplicated: {} - saved: {} '.format(dedup.linked, byte_unit(dedup.saved_bytes)).center(w, '-'))
+            if pool:
+                print(' Connections opened: {} - reused: {} '.format(pool.opened, pool.reused).center(w, '-'))
+            cache_stats = normalize_cache_stats()
+            if cache_stats['url']['hits'] + cache_stats['url']['misses']:
+                print(' Normalize cache hits - URLs: {:.1%} - hosts: {:.1%} '.format(
+                      cache_stats['url']['hit_rate'], cache_stats['host']['hit_rate']).center(w, '-'))
             print()
 
         if failed and not args.quiet:
@@ -134,6 +505,15 @@ def main():
                 print(url)
             print()
 
+        if url_filter.active and not args.quiet:
+            print('Filter rule hits:')
+            for rule, count in url_filter.hits():
+                print('    {:<50} {:>10}'.format(rule, count))
+            print()
+
+    if args.url_dedup == 'disk':
+        seen_urls.close()
+
     tmp_dir.cleanup()
     return 0
 
@@ -0,0 +1,182 @@
+"""Durable per-url job state so an interrupted batch can be restarted.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+
+from geturls.validators import NOT_MODIFIED
+# ------------------------------------------------------------------------------
+JOURNAL_DBNAME = '.geturls_job.sqlite'
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+PLACED = 'placed'
+UNCHANGED = 'unchanged'
+
+
+class JobJournal(object):
+    """SQLite (WAL mode) journal of the state of every url in a batch.
+
+    Each state change is committed as it happens, so after a crash the
+    journal shows which urls were placed, which finished downloading into the
+    partial directory but were not placed yet, and which still need to run.
+
+    States: pending -> running -> done / failed / unchanged, done -> placed
+
+    Attributes:
+        - filepath: str
+            - sqlite database path
+        - skipped: int
+            - urls skipped because an earlier run already finished them
+
+    Methods:
+        - unfinished
+            Filters urls finished by an earlier run
+        - recover
+            Downloads completed by an earlier run that still need placing
+        - add_tasks
+            Records temp paths of urls about to be downloaded
+        - started
+        - finished
+        - placed
+            Records final paths from write_files log details
+        - complete
+            Drops the batch from the journal after a normal finish
+        - close
+    """
+
+    def __init__(self, filepath=JOURNAL_DBNAME):
+        self.filepath = os.path.abspath(filepath)
+        self.skipped = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.filepath, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS jobs ('
+                         'url TEXT PRIMARY KEY, state TEXT, temp_path TEXT, net_subdir TEXT, '
+                         'filename TEXT, path TEXT, date TEXT, clock TEXT, updated REAL)')
+        self._db.commit()
+
+
+    def _states(self, urls):
+        with self._lock:
+            rows = self._db.execute('SELECT url, state, temp_path, net_subdir, filename, date, clock '
+                                    'FROM jobs').fetchall()
+        wanted = set(urls)
+        return {row[0]: row[1:] for row in rows if row[0] in wanted}
+
+
+    def _set_state(self, url, state):
+        with self._lock:
+            self._db.execute('UPDATE jobs SET state = ?, updated = ? WHERE url = ?', (state, time.time(), url))
+            self._db.commit()
+
+
+    def unfinished(self, urlist):
+        """Returns: list - urls of urlist not placed or skipped as unchanged by an earlier run"""
+
+        states = self._states(urlist)
+        remaining = [url for url in urlist if states.get(url, (PENDING,))[0] not in (PLACED, UNCHANGED)]
+        self.skipped = len(urlist) - len(remaining)
+        return remaining
+
+
+    def recover(self, urlist):
+        """Finds urls an earlier run downloaded but did not place. Urls whose
+        temporary file is gone are reset to pending.
+
+        Returns:
+            - completed: list of (temp_path, url, net_subdir, filename, timestamp)
+        """
+
+        completed = []
+        for url, (state, temp_path, net_subdir, filename, date, clock) in self._states(urlist).items():
+            if state != DONE:
+                continue
+            if temp_path and os.path.isfile(temp_path):
+                completed.append((temp_path, url, net_subdir, filename, (date, clock)))
+            else:
+                self._set_state(url, PENDING)
+        return completed
+
+
+    def add_tasks(self, tasks):
+        """Records urls as pending along with their temp paths.
+
+        Args:
+            - tasks: list of (temp_path, url, net_subdir, filename)
+        """
+
+        now = time.time()
+        rows = [(url, PENDING, temp_path, net_subdir, filename, now)
+                for temp_path, url, net_subdir, filename in tasks]
+        with self._lock:
+            self._db.executemany('INSERT OR REPLACE INTO jobs (url, state, temp_path, net_subdir, filename, updated) '
+                                 'VALUES (?, ?, ?, ?, ?, ?)', rows)
+            self._db.commit()
+
+
+    def started(self, url):
+        self._set_state(url, RUNNING)
+
+
+    def finished(self, url, status, dl_timestamp):
+        """Records download status of url.
+
+        Args:
+            - url: str
+            - status: bool or NOT_MODIFIED
+            - dl_timestamp: tuple - (date, time)
+        """
+
+        if status is NOT_MODIFIED:
+            state = UNCHANGED
+        else:
+            state = DONE if status else FAILED
+
+        date, clock = dl_timestamp
+        with self._lock:
+            self._db.execute('UPDATE jobs SET state = ?, date = ?, clock = ?, updated = ? WHERE url = ?',
+                             (state, date, clock, time.time(), url))
+            self._db.commit()
+
+
+    def placed(self, log_details):
+        """Records final paths of placed files.
+
+        Args:
+            - log_details: list - (date, time, url, path, ...) tuples from write_files
+        """
+
+        now = time.time()
+        rows = [(PLACED, row[3], now, row[2]) for row in log_details]
+        with self._lock:
+            self._db.executemany('UPDATE jobs SET state = ?, path = ?, updated = ? WHERE url = ?', rows)
+            self._db.commit()
+
+
+    def complete(self, urlist):
+        """Removes urls of a finished batch, deleting the journal once empty."""
+
+        with self._lock:
+            self._db.executemany('DELETE FROM jobs WHERE url = ?', ((url,) for url in urlist))
+            self._db.commit()
+            remaining = self._db.execute('SELECT COUNT(*) FROM jobs').fetchone()[0]
+
+        self.close()
+        if not remaining:
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(self.filepath + suffix):
+                    os.remove(self.filepath + suffix)
+
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+# ------------------------------------------------------------------------------
@@ -0,0 +1,339 @@
+"""Counters and histograms of a run, exported as a Prometheus textfile or a
+JSON summary.
+
+Phases are timed as the run spends them: parse counts time spent waiting on
+the URL stream, fetch the whole download stage and place the time spent
+moving files to their final path, which overlaps fetch as files are placed
+while downloads continue. Transfers are counted from the same results as
+the transfer log. Files are replaced atomically, so node_exporter's
+textfile collector never reads a partial export.
+"""
+
+from bisect import bisect_left
+import json
+import os
+import threading
+import time
+from urllib.parse import urlparse
+
+from geturls.transfer_log import FAILED
+# ------------------------------------------------------------------------------
+PREFIX = 'geturls'
+PROMETHEUS = 'prometheus'
+JSON = 'json'
+FORMATS = (PROMETHEUS, JSON)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DURATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+
+def metrics_format(filepath):
+    """Returns: str - JSON for a .json filepath, otherwise PROMETHEUS"""
+
+    return JSON if filepath.lower().endswith('.json') else PROMETHEUS
+
+
+def _label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    pairs = ('{}="{}"'.format(name, _label_value(value)) for name, value in zip(names, values))
+    return '{' + ','.join(pairs) + '}'
+
+
+def _rounded(value):
+    return round(value, 6) if isinstance(value, float) else value
+
+
+def _number(value):
+    return repr(_rounded(value)) if isinstance(value, float) else str(value)
+
+
+# ------------------------------------------------------------------------------
+class Counter(object):
+    """Value per combination of labels, only ever increased."""
+
+    kind = 'counter'
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.values = {}
+
+
+    def inc(self, amount=1, *labels):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+
+    def samples(self):
+        """Returns: list of (name, labels str, value)"""
+
+        if not self.labels:
+            return [(self.name, '', self.values.get((), 0))]
+        return [(self.name, _labels(self.labels, key), value) for key, value in sorted(self.values.items())]
+
+
+    def summary(self):
+        if not self.labels:
+            return _rounded(self.values.get((), 0))
+        return {'/'.join(key): _rounded(value) for key, value in sorted(self.values.items())}
+
+
+class Gauge(Counter):
+    """Value per combination of labels, set to its latest reading."""
+
+    kind = 'gauge'
+
+    def set(self, value, *labels):
+        self.values[labels] = value
+
+
+class Histogram(object):
+    """Observations counted into cumulative buckets of upper bounds."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, description, buckets):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+    def samples(self):
+        rows = []
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            rows.append((self.name + '_bucket', '{{le="{}"}}'.format(bound), total))
+        rows.append((self.name + '_bucket', '{le="+Inf"}', self.count))
+        rows.append((self.name + '_sum', '', self.sum))
+        rows.append((self.name + '_count', '', self.count))
+        return rows
+
+
+    def summary(self):
+        return {'count': self.count,
+                'sum': round(self.sum, 6),
+                'mean': round(self.sum / self.count, 6) if self.count else None,
+                'buckets': [[bound, count] for bound, count in zip(self.buckets, self.counts)]}
+
+
+# ------------------------------------------------------------------------------
+class RunMetrics(object):
+    """Phase durations and transfer metrics of one run.
+
+    Takes transfer results like a transfer_log.TransferLog, so both can be
+    fed by a transfer_log.TransferTee.
+
+    Methods:
+        - start_phase, end_phase
+            Time a phase of the run
+        - add_phase
+            Adds seconds measured elsewhere to a phase
+        - timed
+            Yields from an iterable, timing waits as a phase
+        - finished
+            Counts the result of a download
+        - placed
+            Counts a file moved to its final path
+        - export
+            Writes metrics to filepath
+        - start
+            Exports every interval seconds until close
+        - close
+            Writes the final export
+    """
+
+    def __init__(self, filepath, fmt=None, interval=0):
+        self.filepath = os.path.abspath(filepath)
+        self.fmt = fmt or metrics_format(filepath)
+        self.interval = interval
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._running = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+        def name(metric):
+            return '{}_{}'.format(PREFIX, metric)
+
+        self.phase_seconds = Gauge(name('phase_seconds'), 'Seconds spent in each phase of the run', ('phase',))
+        self.urls = Counter(name('urls_total'), 'URLs read from input after filtering and deduplication')
+        self.transfers = Counter(name('transfers_total'), 'Transfers finished by result', ('result',))
+        self.failures = Counter(name('failures_total'), 'Failed transfers by cause', ('cause',))
+        self.retries = Counter(name('retries_total'), 'Responses beyond the first for a url')
+        self.bytes = Counter(name('bytes_total'), 'Bytes received by host', ('host',))
+        self.host_seconds = Counter(name('transfer_seconds_total'), 'Seconds spent on transfers by host',
+                                    ('host',))
+        self.host_throughput = Gauge(name('host_throughput_bytes_per_second'),
+                                     'Bytes received per transfer second by host', ('host',))
+        self.placed_files = Counter(name('files_placed_total'), 'Files moved to their final path')
+        self.latency = Histogram(name('request_latency_seconds'), 'Seconds until the first response headers',
+                                 LATENCY_BUCKETS)
+        self.duration = Histogram(name('transfer_duration_seconds'), 'Seconds from request to finished transfer',
+                                  DURATION_BUCKETS)
+        self.run_start = Gauge(name('run_start_timestamp_seconds'), 'Unix time the run started')
+        self.last_export = Gauge(name('last_export_timestamp_seconds'), 'Unix time of this export')
+        self.run_start.set(round(self.started, 3))
+
+        self._metrics = (self.phase_seconds, self.urls, self.transfers, self.failures, self.retries,
+                         self.bytes, self.host_seconds, self.host_throughput, self.placed_files,
+                         self.latency, self.duration, self.run_start, self.last_export)
+
+
+    # --------------------------------------------------------------------------
+    def start_phase(self, name):
+        with self._lock:
+            self._running[name] = time.perf_counter()
+
+
+    def end_phase(self, name):
+        with self._lock:
+            # start moves forward as exports add the time passed so far
+            start = self._running.pop(name, None)
+            if start is not None:
+                self.phase_seconds.inc(time.perf_counter() - start, name)
+
+
+    def add_phase(self, name, seconds):
+        with self._lock:
+            self.phase_seconds.inc(seconds, name)
+
+
+    def timed(self, iterable, name='parse'):
+        """Yields each item of iterable, adding the time spent waiting on
+        it to phase name and counting items read.
+        """
+
+        iterator = iter(iterable)
+        perf_counter = time.perf_counter
+        while True:
+            start = perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add_phase(name, perf_counter() - start)
+                return
+            self.add_phase(name, perf_counter() - start)
+            with self._lock:
+                self.urls.inc()
+            yield item
+
+
+    # --------------------------------------------------------------------------
+    def finished(self, stats, result):
+        """
+        Args:
+            - stats: transfer_log.TransferStats instance
+            - result: str - transfer_log result
+        """
+
+        host = urlparse(stats.url).netloc.lower()
+        with self._lock:
+            self.transfers.inc(1, result)
+            if result == FAILED:
+                self.failures.inc(1, stats.cause)
+            if stats.retries:
+                self.retries.inc(stats.retries)
+            if stats.ttfb is not None:
+                self.latency.observe(stats.ttfb)
+            if stats.elapsed is not None:
+                self.duration.observe(stats.elapsed)
+                self.host_seconds.inc(stats.elapsed, host)
+            self.bytes.inc(stats.nbytes, host)
+
+
+    def placed(self, url, path):
+        with self._lock:
+            self.placed_files.inc()
+
+
+    # --------------------------------------------------------------------------
+    def _snapshot(self):
+        """Phase seconds including phases still running, host throughput
+        and export time, set under lock before rendering.
+        """
+
+        now = time.perf_counter()
+        for name, start in self._running.items():
+            self.phase_seconds.inc(now - start, name)
+            self._running[name] = now
+
+        for key, seconds in self.host_seconds.values.items():
+            nbytes = self.bytes.values.get(key, 0)
+            self.host_throughput.set(round(nbytes / seconds, 1) if seconds else 0.0, *key)
+        self.last_export.set(round(time.time(), 3))
+
+
+    def prometheus(self):
+        """Returns: str - metrics in Prometheus text exposition format"""
+
+        with self._lock:
+            self._snapshot()
+            lines = []
+            for metric in self._metrics:
+                lines.append('# HELP {} {}'.format(metric.name, metric.description))
+                lines.append('# TYPE {} {}'.format(metric.name, metric.kind))
+                for name, labels, value in metric.samples():
+                    lines.append('{}{} {}'.format(name, labels, _number(value)))
+        return '\n'.join(lines) + '\n'
+
+
+    def summary(self):
+        """Returns: dict - metrics keyed by name without prefix"""
+
+        with self._lock:
+            self._snapshot()
+            offset = len(PREFIX) + 1
+            return {metric.name[offset:]: metric.summary() for metric in self._metrics}
+
+
+    def export(self):
+        if self.fmt == JSON:
+            text = json.dumps(self.summary(), indent=2, sort_keys=True) + '\n'
+        else:
+            text = self.prometheus()
+
+        dirname, basename = os.path.split(self.filepath)
+        tmp_path = os.path.join(dirname, '.{}.{}.tmp'.format(basename, os.getpid()))
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(tmp_path, self.filepath)
+
+
+    def _export_loop(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.export()
+            except OSError:
+                pass
+
+
+    def start(self):
+        if self.interval > 0 and self._thread is None:
+            self._thread = threading.Thread(target=self._export_loop, daemon=True)
+            self._thread.start()
+
+
+    def close(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        self.export()
+
+
+# ------------------------------------------------------------------------------
@@ -1,13 +1,136 @@
+from collections import deque
+import codecs
+from functools import lru_cache
+import locale
+import mmap
+import multiprocessing
+import os
 import re
+import sys
 from string import punctuation
 from urllib.parse import urlparse
+
+from geturls.unique import sorted_unique
 # ------------------------------------------------------------------------------
 
 
-is_url = re.compile(r"((((http)s?|ftp)://)?(w{3}\.)?([\w\-\.]+)(:\d)?\.([a-z]+)/((\.?(.+[^\/])+(/|\.)?)+)[^\/])$", re.IGNORECASE)
+# Character classes of the URL grammar, each only ever matched as a single run
+# so scanning never backtracks. Matching runs ending at a position is done by
+# matching forward over the reversed word.
+HOST_RUN = re.compile(r'[\w\-\.]*')
+TLD_RUN = re.compile(r'[a-z]*', re.IGNORECASE)
+PORT_DIGIT = re.compile(r'\d')
+SCHEME = re.compile(r'(?:https?|ftp)://', re.IGNORECASE)
+SCHEME_LENGTHS = (8, 7, 6)
 
 
-def normalize_url(word, missing_scheme='http'):
+def _run_length(pattern, reversed_word, end):
+    """Length of run of pattern characters ending just before end in the
+    original word.
+    """
+
+    start = len(reversed_word) - end
+    return pattern.match(reversed_word, start).end() - start
+
+
+def _host_start(word, reversed_word, slash):
+    """Finds leftmost start of [scheme://]host[:digit].tld ending at slash.
+
+    Returns: int or None
+    """
+
+    tld_length = _run_length(TLD_RUN, reversed_word, slash)
+    dot = slash - tld_length - 1
+    if not tld_length or dot < 1 or word[dot] != '.':
+        return None
+
+    starts = []
+    host_length = _run_length(HOST_RUN, reversed_word, dot)
+    if host_length:
+        starts.append(dot - host_length)
+
+    if dot >= 3 and word[dot - 2] == ':' and PORT_DIGIT.match(word, dot - 1):
+        host_length = _run_length(HOST_RUN, reversed_word, dot - 2)
+        if host_length:
+            starts.append(dot - 2 - host_length)
+
+    if not starts:
+        return None
+
+    start = min(starts)
+    for length in SCHEME_LENGTHS:
+        if start >= length and SCHEME.fullmatch(word, start - length, start):
+            return start - length
+    return start
+
+
+def scan_url(word):
+    """Finds a URL ending at the end of word.
+
+    Accepts the same URLs as the former is_url regex:
+
+        ((https?|ftp)://)?(www.)?host(:digit)?.tld/path
+
+    where path runs to the end of word, is at least 3 characters long, does
+    not end in '/' and does not end in '//x'. Every '/' that can end the
+    host is checked by scanning back over the host only, so the cost grows
+    linearly with the length of word.
+
+    Args:
+        word: str - single line of text without spaces
+
+    Returns:
+        str - leftmost matching URL suffix of word, or None
+    """
+
+    n = len(word)
+    if n < 7 or word[-1] == '/':
+        return None
+
+    if word[-2] == '/':
+        if word[-3] == '/':
+            return None
+        last_slash = n - 5
+    else:
+        last_slash = n - 4
+
+    reversed_word = None
+    best = None
+    slash = word.find('/', 0, last_slash + 1)
+    while slash != -1:
+        if reversed_word is None:
+            reversed_word = word[::-1]
+        start = _host_start(word, reversed_word, slash)
+        if start is not None and (best is None or start < best):
+            best = start
+        slash = word.find('/', slash + 1, last_slash + 1)
+
+    return None if best is None else word[best:]
+
+
+# ------------------------------------------------------------------------------
+# Normalization results are memoized, inputs usually repeat the same URLs and
+# hosts many times.
+URL_CACHE_SIZE = 2**16
+HOST_CACHE_SIZE = 2**12
+
+
+@lru_cache(maxsize=HOST_CACHE_SIZE)
+def normalize_host(netloc):
+    """Lower cases netloc and drops a leading www-like subdomain.
+
+    Returns: str
+    """
+
+    host = netloc.lower().lstrip(punctuation)
+    if host.count('.') >= 2:
+        subdomain, domain = host.split('.', 1)
+        if set(subdomain) == set('w'):
+            host = domain
+    return host
+
+
+def _normalize_url(word, missing_scheme):
     url = urlparse(word)
     if url.scheme:
         if url.scheme in ('http', 'https', 'ftp'):
@@ -17,11 +140,7 @@ def normalize_url(word, missing_scheme='http'):
                 norm_scheme = 'ftp'
             else:
                 norm_scheme = missing_scheme
-        host = url.netloc.lower().lstrip(punctuation)
-        if host.count('.') >= 2:
-            subdomain, domain = host.split('.', 1)
-            if set(subdomain) == set('w'):
-                host = domain
+        host = normalize_host(url.netloc)
 
         norm_path = '/'.join((txt for txt in url.path.split('/') if txt))
         norm_url = '{}://{}/{}'.format(norm_scheme, host, norm_path)
@@ -31,54 +150,419 @@ def normalize_url(word, missing_scheme='http'):
         if word.find('/') < word.find('.'):
             word = word[word.find('/')+1:].lstrip(punctuation)
         repair = '{}://{}'.format(missing_scheme, word)
-        return normalize_url(repair)
+        return _normalize_url(repair, missing_scheme)
 
 
-def extract_urls(lines):
-    """Parses text for possible URLs.
+@lru_cache(maxsize=URL_CACHE_SIZE)
+def normalize_url(word, missing_scheme='http'):
+    return _normalize_url(word, missing_scheme)
+
+
+def normalize_urls(words, missing_scheme='http'):
+    """Normalizes a batch of URLs through the same caches as normalize_url.
 
     Args:
-        lines: iterable containing text
+        words: iterable of URLs
+        missing_scheme: str - scheme of URLs without one
 
     Returns:
-        list of validated URLs
+        list of normalized URLs in the same order
+    """
+
+    normalize = normalize_url
+    return [normalize(word, missing_scheme) for word in words]
+
+
+def _hit_rate(info):
+    lookups = info.hits + info.misses
+    return {'hits': info.hits, 'misses': info.misses, 'size': info.currsize,
+            'hit_rate': info.hits / lookups if lookups else 0.0}
+
+
+def normalize_cache_stats():
+    """Hit rates of the normalization caches in this process.
+
+    Returns: dict - 'url' and 'host' dicts of hits, misses, size, hit_rate
+    """
+
+    return {'url': _hit_rate(normalize_url.cache_info()),
+            'host': _hit_rate(normalize_host.cache_info())}
+
+
+def clear_normalize_caches():
+    normalize_url.cache_clear()
+    normalize_host.cache_clear()
+
+
+def iter_urls(lines):
+    """Parses text for possible URLs, yielding each as soon as it is found.
+
+    Args:
+        lines: iterable containing text
+
+    Yields:
+        validated URLs in the order found
     """
 
-    links = []
     for line in lines:
         split_words = (word for word in line.split(' ') if not word.isalnum())
         for word in split_words:
-            word = word.lstrip(punctuation)
-            valid_url = is_url.search(word)
-            if valid_url:
-                links.append(normalize_url(valid_url.group()))
+            link = word_url(word)
+            if link:
+                yield link
 
-    return [link for link in links if link]
 
+def word_url(word):
+    """Returns: str or None - normalized URL found at the end of word"""
 
-def extract_urls_from_files(files):
-    """Parses file containing text for possible URLs.
+    valid_url = scan_url(word.lstrip(punctuation))
+    if valid_url:
+        return normalize_url(valid_url)
+    return None
+
+
+def extract_urls(lines):
+    """Parses text for possible URLs.
 
     Args:
-        files: iterable containing filepaths
+        lines: iterable containing text
 
     Returns:
-        list of possible URLs
+        list of validated URLs
+    """
+
+    return list(iter_urls(lines))
+
+
+# ------------------------------------------------------------------------------
+# Input files, STDIN stands for standard input wherever a filepath is accepted.
+STDIN = '-'
+
+
+def is_regular_file(filepath):
+    return filepath != STDIN and os.path.isfile(filepath)
+
+
+def iter_stream_lines(stream):
+    """Reads an open text stream one line at a time, yielding each line as
+    soon as it arrives so a pipe can be parsed while it is being written.
+
+    Yields:
+        stripped, non blank lines
+    """
+
+    for line in stream:
+        line = line.strip()
+        if line:
+            yield line
+
+
+def iter_lines(files):
+    """Reads files one line at a time.
+
+    Args:
+        files: iterable containing filepaths, STDIN for standard input
+
+    Yields:
+        stripped, non blank lines
+    """
+
+    for fn in files:
+        if fn == STDIN:
+            for line in iter_stream_lines(sys.stdin):
+                yield line
+        else:
+            with open(fn, 'r') as f:
+                for line in iter_stream_lines(f):
+                    yield line
+
+
+# ------------------------------------------------------------------------------
+# Bytes level parsing of memory mapped files. Only words containing '/' can
+# hold a URL, so just those words are located in the raw bytes and decoded,
+# giving the same words iter_lines and iter_urls would produce.
+MMAP_ENCODING = 'utf-8'
+MMAP_RELEASE_BYTES = 64 * 2**20
+LINE_BREAKS = (b'\n', b'\r')
+# word containing '/', only tried where a word starts so it never rescans a word
+SLASH_WORD = re.compile(rb'(?<![^ \r\n])[^ \r\n/]*/[^ \r\n]*')
+# utf-8 encoded characters for which str.isspace() is True, other than line breaks
+SPACE_RUN = re.compile(rb'(?:[ \t\x0b\x0c\x1c-\x1f]|\xc2[\x85\xa0]|\xe1\x9a\x80|\xe2\x80[\x80-\x8a\xa8\xa9\xaf]'
+                       rb'|\xe2\x81\x9f|\xe3\x80\x80)*')
+
+
+def can_mmap(filepath):
+    """Checks if filepath is a regular file decoded as utf-8 by the text path.
+
+    Returns: bool
+    """
+
+    encoding = codecs.lookup(locale.getpreferredencoding(False)).name
+    return encoding == MMAP_ENCODING and is_regular_file(filepath)
+
+
+class _LineBounds(object):
+    """Finds the line around a word of a buffer read front to back. Each
+    byte is searched at most once for each kind of line break.
+    """
+
+    def __init__(self, buf, start=0, end=None):
+        self._buf = buf
+        self._end = len(buf) if end is None else end
+        self._searched = start
+        self._line_start = start
+        self._next_breaks = {}
+
+
+    def start(self, pos):
+        line_break = max(self._buf.rfind(sep, self._searched, pos) for sep in LINE_BREAKS)
+        if line_break != -1:
+            self._line_start = line_break + 1
+        self._searched = max(self._searched, pos)
+        return self._line_start
+
+
+    def end(self, pos):
+        ends = []
+        for sep in LINE_BREAKS:
+            next_break = self._next_breaks.get(sep, -1)
+            if next_break < pos:
+                next_break = self._buf.find(sep, pos, self._end)
+                if next_break == -1:
+                    next_break = self._end
+                self._next_breaks[sep] = next_break
+            ends.append(next_break)
+        return min(ends)
+
+
+def iter_mapped_urls(buf, start=0, end=None):
+    """Parses a bytes-like utf-8 buffer, e.g. an mmap, for possible URLs.
+
+    Args:
+        buf: bytes, bytearray or mmap.mmap
+        start: int - offset of first byte to parse, at the start of a line
+        end: int - offset just past the last byte to parse, at the end of a
+            line, defaults to the end of buf
+
+    Yields:
+        validated URLs in the order found, identical to iter_urls over the
+        decoded lines
+    """
+
+    if end is None:
+        end = len(buf)
+    lines = _LineBounds(buf, start, end)
+    release = hasattr(buf, 'madvise') and hasattr(mmap, 'MADV_DONTNEED')
+    released = start - start % mmap.PAGESIZE
+
+    for match in SLASH_WORD.finditer(buf, start, end):
+        word = match.group().decode(MMAP_ENCODING, 'replace')
+
+        # match the line.strip() of the text path for the first and last word
+        if word[0].isspace():
+            word_start = match.start()
+            if SPACE_RUN.match(buf, lines.start(word_start), word_start).end() == word_start:
+                word = word.lstrip()
+        if word and word[-1].isspace():
+            word_end = match.end()
+            if SPACE_RUN.match(buf, word_end, lines.end(word_end)).end() == lines.end(word_end):
+                word = word.rstrip()
+
+        link = word_url(word)
+        if link:
+            yield link
+
+        # drop pages already parsed so resident memory stays flat
+        if release and match.end() - released > MMAP_RELEASE_BYTES:
+            parsed = match.start() - match.start() % mmap.PAGESIZE
+            buf.madvise(mmap.MADV_DONTNEED, released, parsed - released)
+            released = parsed
+
+
+def iter_urls_from_mmap(filepath, start=0, end=None):
+    """Parses a file for possible URLs by memory mapping it. Memory use does
+    not grow with file size.
+
+    Args:
+        filepath: str
+        start: int - byte offset to start parsing at, at the start of a line
+        end: int - byte offset to stop parsing at, defaults to end of file
+
+    Yields:
+        possible URLs in the order found
+    """
+
+    with open(filepath, 'rb') as f:
+        if not os.fstat(f.fileno()).st_size:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            for link in iter_mapped_urls(buf, start, end):
+                yield link
+
+
+def iter_urls_from_files(files, workers=1):
+    """Parses files containing text for possible URLs without reading them
+    into memory first. Regular files are memory mapped, other files such as
+    pipes and STDIN are read line by line as they arrive.
+
+    Args:
+        files: iterable containing filepaths, STDIN for standard input
+        workers: int - processes parsing files and file chunks in parallel
+
+    Yields:
+        possible URLs in the order found
+    """
+
+    if workers > 1:
+        for link in iter_parallel_urls(files, workers):
+            yield link
+        return
+
+    for fn in files:
+        if can_mmap(fn):
+            urls = iter_urls_from_mmap(fn)
+        else:
+            urls = iter_urls(iter_lines([fn]))
+        for link in urls:
+            yield link
+
+
+# ------------------------------------------------------------------------------
+# Parallel parsing. Files are split into chunks ending at line breaks, each
+# parsed by a worker process. Results are yielded in file and chunk order so
+# the first occurrence of each URL is the same as when parsing serially.
+PARSE_CHUNK_SIZE = 16 * 2**20
+
+
+def file_chunks(filepath, chunk_size=PARSE_CHUNK_SIZE):
+    """Splits file into byte ranges of about chunk_size, each ending just
+    after a line feed so no line is split.
+
+    Returns: list of (start, end) byte offsets
+    """
+
+    size = os.path.getsize(filepath)
+    if size <= chunk_size:
+        return [(0, size)]
+
+    chunks = []
+    with open(filepath, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        start = 0
+        while start < size:
+            line_break = buf.find(b'\n', start + chunk_size)
+            end = size if line_break == -1 else line_break + 1
+            chunks.append((start, end))
+            start = end
+    return chunks
+
+
+def parse_tasks(files, chunk_size=PARSE_CHUNK_SIZE):
+    """Yields (filepath, start, end) parse tasks. Files that can not be split
+    at byte offsets have start and end of None.
     """
 
-    links = []
     for fn in files:
-        with open(fn, 'r') as f:
-            lines = [line.strip() for line in f if line.strip() != '']
+        if can_mmap(fn):
+            for start, end in file_chunks(fn, chunk_size):
+                yield fn, start, end
+        else:
+            yield fn, None, None
 
-        found_links = extract_urls(lines)
-        if found_links:
-            links.extend(found_links)
 
-    if len(links) > 1:
-        links = sorted(set(links))
+def parse_chunk(task):
+    """Parses one parse task, run in a worker process.
+
+    Returns: list of unique possible URLs in the order found
+    """
+
+    filepath, start, end = task
+    if start is None:
+        urls = iter_urls(iter_lines([filepath]))
+    else:
+        urls = iter_urls_from_mmap(filepath, start, end)
+    return list(unique_urls(urls))
+
+
+def iter_parallel_urls(files, workers, chunk_size=PARSE_CHUNK_SIZE):
+    """Parses files across a pool of worker processes, keeping at most two
+    tasks per worker in flight so memory stays bounded when the consumer is
+    slower than parsing.
+
+    Regular files are parsed by the workers. Other files such as pipes can
+    not be reopened by another process and are parsed here, in order.
+
+    Args:
+        files: iterable containing filepaths
+        workers: int - number of worker processes
+        chunk_size: int - approximate bytes of a file parsed by one task
+
+    Yields:
+        possible URLs in the order found
+    """
+
+    # spawned workers do not inherit locks held by download threads
+    context = multiprocessing.get_context('spawn')
+    pending = deque()
+    with context.Pool(workers) as pool:
+        for task in parse_tasks(files, chunk_size):
+            if is_regular_file(task[0]):
+                pending.append(pool.apply_async(parse_chunk, (task,)))
+                if len(pending) < 2 * workers:
+                    continue
+                urls = pending.popleft().get()
+            else:
+                while pending:
+                    for link in pending.popleft().get():
+                        yield link
+                urls = iter_urls(iter_lines([task[0]]))
+
+            for link in urls:
+                yield link
+
+        while pending:
+            for link in pending.popleft().get():
+                yield link
+
+
+def unique_urls(urls, seen=None):
+    """Drops repeated URLs, keeping the first occurrence of each.
+
+    Args:
+        urls: iterable of URLs
+        seen: set, or unique.BloomFilter / unique.DiskSet for bounded
+            memory - URLs already yielded, updated in place
+
+    Yields:
+        URLs not seen before
+    """
+
+    if seen is None:
+        seen = set()
+
+    for url in urls:
+        if url not in seen:
+            seen.add(url)
+            yield url
+
+
+def extract_urls_from_files(files, workers=1, sort=True, seen=None):
+    """Parses file containing text for possible URLs.
+
+    Args:
+        files: iterable containing filepaths
+        workers: int - processes parsing files and file chunks in parallel
+        sort: bool - sort URLs, spilling sorted runs to disk for large
+            inputs, instead of keeping the order found
+        seen: set of seen URLs for unsorted output, see unique_urls
+
+    Returns:
+        list of unique possible URLs
+    """
 
-    return links
+    urls = iter_urls_from_files(files, workers)
+    if sort:
+        return list(sorted_unique(urls))
+    return list(unique_urls(urls, seen))
 
 
 # ------------------------------------------------------------------------------
@@ -1,33 +1,19 @@
 """Functions relating to filepaths and filenames.
 """
 
+from collections import Counter, defaultdict
 from difflib import get_close_matches
 from itertools import takewhile
 import os
 import re
 import string
+
+from geturls.dir_tools import PARTIAL_DIRNAME, STAGING_PREFIX
+from geturls.tokens import find_longest_shared_token, split_to_tokens
 # ------------------------------------------------------------------------------
 CHAR_ESC = str.maketrans({p: '\{}'.format(p) for p in string.punctuation})
 has_digit_suffix = re.compile(r"^.+?(\-\d+)$")
 
-
-def load_alphamap(split_digits=False):
-    alphamap = {}
-    if split_digits:
-        dig_val = 'd'
-    else:
-        dig_val = 'a'
-    alpha = {a:'a' for a in string.ascii_letters}
-    digits = {d:dig_val for d in string.digits}
-    punc = {p:'p' for p in string.punctuation}
-    for transdict in (alpha, digits, punc):
-        alphamap.update(transdict)
-    return str.maketrans(alphamap)
-
-
-ALPHANUM_MAP = load_alphamap()
-ALPHA_MAP = load_alphamap(split_digits=True)
-
 # ------------------------------------------------------------------------------
 def split_name_type(filename, subdir=False):
     if '.' not in filename or (filename.startswith('.') and filename.count('.') == 1):
@@ -55,19 +41,26 @@ def get_type(filename, subdir=True):
     return filetype
 
 
-def check_name(filename, root=os.curdir):
+def check_name(filename, root=os.curdir, names=None):
     """Scans filenames in dir and appends a numerical suffix to prevent overwrite.
     To prevent name collisions, -n is appended to filename.
 
     Args:
         - filename: str - with or without filetype
         - root: str - valid directory
+        - names: NameIndex instance - index of names in root used instead
+            of listing root, updated with the returned name
 
     Returns:
         - filepath: str - path using validated filename
         - valid_filename: str
     """
 
+    if names is not None:
+        valid_filename = names.next_name(filename, root)
+        names.add(valid_filename, root)
+        return os.path.join(root, valid_filename), valid_filename
+
     fn, fn_type = split_name_type(filename)
     target_dir = os.listdir(root)
     check_files = [other_fn for other_fn in target_dir if fn in other_fn]
@@ -92,127 +85,201 @@ def check_name(filename, root=os.curdir):
             elif filename == other_fn:
                 end_digits.append('0')
 
-        if end_digits:
-            if fn_type:
-                fn_end = '.' + fn_type
-            else:
-                fn_end = ''
+        valid_filename = increment_name(filename, fn, fn_type, end_digits)
 
-            end_digits.sort(key=lambda n: int(n))
-            max_digit = end_digits[-1]
-            if max_digit.startswith('0') and len(max_digit) > 1:
-                zero_pad = len(max_digit)
-            else:
-                zero_pad = 0
+    filepath = os.path.join(root, valid_filename)
+    return filepath, valid_filename
 
-            n = int(max_digit) + 1
-            n_suffix = str(n).zfill(zero_pad)
-            valid_filename = ''.join([fn, '-', n_suffix, fn_end])
 
-        else:
-            valid_filename = filename
+def increment_name(filename, fn, fn_type, end_digits):
+    """Appends the next number after the highest of end_digits to fn.
 
-    filepath = os.path.join(root, valid_filename)
-    return filepath, valid_filename
+    Returns: str - filename when end_digits is empty
+    """
+
+    if not end_digits:
+        return filename
+
+    if fn_type:
+        fn_end = '.' + fn_type
+    else:
+        fn_end = ''
+
+    end_digits.sort(key=lambda n: int(n))
+    max_digit = end_digits[-1]
+    if max_digit.startswith('0') and len(max_digit) > 1:
+        zero_pad = len(max_digit)
+    else:
+        zero_pad = 0
 
+    n = int(max_digit) + 1
+    n_suffix = str(n).zfill(zero_pad)
+    return ''.join([fn, '-', n_suffix, fn_end])
 
-def get_path(filename, root=os.curdir, overwrite=False):
+
+def get_path(filename, root=os.curdir, overwrite=False, names=None):
     if overwrite:
         filepath = os.path.join(root, filename)
+        if names is not None:
+            names.add(filename, root)
     else:
-        filepath, filename = check_name(filename, root)
+        filepath, filename = check_name(filename, root, names)
 
     return filepath, filename
 
 
 # ------------------------------------------------------------------------------
-def char_ix(fn_enc, char='a'):
-    """Generator for locating index of specified character within input str.
+def numbered_keys(name):
+    """Ways a directory entry can be a numbered copy made by check_name:
+    name-n.type matches files of that name and type, name-n matches files
+    without a type.
 
-    Args:
-        - fn_enc: str - encoded into a/d/p format
-        - char: str - character to locate within fn_enc
+    Returns: list of ((name, type), digits)
+    """
 
-    Yields:
-        - int - index of char within fn_enc
+    keys = []
+    stem, dot, ext = name.rpartition('.')
+    candidates = ((stem, ext),) if ext else ()
+    for stem, ext in candidates + ((name, ''),):
+        base, dash, digits = stem.rpartition('-')
+        if dash and digits.isdecimal():
+            keys.append(((base, ext), digits))
+    return keys
+
+
+class _DirNames(object):
+    """Names of one directory with numbered copies grouped by name and type."""
+
+    def __init__(self, root):
+        self.names = set()
+        self.numbered = {}
+        self.highest = {}
+        for name in os.listdir(root):
+            self.add(name)
+
+
+    def add(self, name):
+        if name in self.names:
+            return
+        self.names.add(name)
+        for key, digits in numbered_keys(name):
+            self.numbered.setdefault(key, []).append((digits, name))
+            highest = self.highest.get(key)
+            # ties keep the later entry, as check_name's stable sort does
+            if highest is None or int(digits) >= int(highest):
+                self.highest[key] = digits
+
+
+class NameIndex(object):
+    """Names in each target directory, listed once and updated as files are
+    placed, so choosing a free name does not rescan the directory.
+
+    Gives the same names as check_name does from a fresh directory listing,
+    as long as only the placing code adds entries to the indexed
+    directories.
+
+    Methods:
+        - next_name
+            Free name for filename in root, numbered as check_name does
+        - add
+            Records a name placed in root
     """
 
-    next_ix = 0
-    last_ix = 0
-    while next_ix >= 0:
-        next_ix = fn_enc.find(char, last_ix)
-        if next_ix >= 0:
-            yield next_ix
-        last_ix = next_ix + 1
+    def __init__(self):
+        self._dirs = {}
+
+
+    def _dir(self, root):
+        key = os.path.abspath(root)
+        dir_names = self._dirs.get(key)
+        if dir_names is None:
+            dir_names = self._dirs[key] = _DirNames(root)
+        return dir_names
+
+
+    def next_name(self, filename, root=os.curdir):
+        dir_names = self._dir(root)
+        fn, fn_type = split_name_type(filename)
+        suffixed = has_digit_suffix.match(fn)
+        counted = False
+        if suffixed:
+            fn_base = fn.rsplit('-', 1)[0]
+            # numbered copies only count when they contain the full name
+            end_digits = []
+            for digits, name in dir_names.numbered.get((fn_base, fn_type), ()):
+                if fn in name:
+                    end_digits.append(digits)
+                    counted = counted or name == filename
+        else:
+            fn_base = fn
+            highest = dir_names.highest.get((fn, fn_type))
+            end_digits = [highest] if highest is not None else []
 
+        if filename in dir_names.names and not counted:
+            end_digits.append('0')
 
-def split_to_tokens(filename, minchars=3, split_digits=False):
-    """
-    Args:
-        - filename: str
-        - minchars: int - minimum length of token found in filename
-        - split_digits: bool - enables splitting alphanumeric str into tokens
+        return increment_name(filename, fn_base, fn_type, end_digits)
 
-    Returns:
-        - list: all str tokens sorted by length
-    """
 
-    if split_digits:
-        STR_MAP = ALPHA_MAP
-    else:
-        STR_MAP = ALPHANUM_MAP
+    def add(self, filename, root=os.curdir):
+        self._dir(root).add(filename)
+
 
-    fn_enc = filename.translate(STR_MAP)
-    alnum_chars = list(char_ix(fn_enc))
-    start = [ix for ix in alnum_chars if ix - 1 not in alnum_chars]
-    stop = [ix + 1 for ix in alnum_chars if ix + 1 not in alnum_chars]
+# ------------------------------------------------------------------------------
+EXACT_MATCH_LIMIT = 2000
+NGRAM_SIZE = 2
+NGRAM_POSTING_LIMIT = 256
+CANDIDATE_LIMIT = 32
 
-    str_len = len(fn_enc)
-    if split_digits:
-        if start[0] != 0:
-            start.insert(0, 0)
-        if stop[-1] != str_len:
-            stop.append(str_len + 1)
 
-    tokens = []
-    for start_ix in start:
-        for stop_ix in stop:
-            token_len = stop_ix - start_ix
-            if minchars <= token_len <= str_len:
-                tokens.append(filename[start_ix:stop_ix])
+def ngrams(word, size=NGRAM_SIZE):
+    """Set of overlapping substrings of word, padded so short words have some."""
 
-    if not split_digits:
-        alpha_only = [t for t in tokens if (t.isalnum() and not t.isalpha())]
-        for word in alpha_only:
-            tokens.extend(split_to_tokens(word, split_digits=True))
+    padded = '\0{}\0'.format(word)
+    return set(padded[ix:ix + size] for ix in range(max(1, len(padded) - size + 1)))
 
-    return sorted(tokens, key=lambda s: len(s), reverse=True)
 
+class CloseMatcher(object):
+    """difflib.get_close_matches against a fixed list of possibilities.
 
-def find_longest_shared_token(group):
-    """
-    Args:
-        - group: iterable of filenames
+    Up to exact_limit possibilities every one is compared, as difflib does.
+    Past that, possibilities are indexed by character n-grams and a word is
+    only compared with the CANDIDATE_LIMIT possibilities sharing the most
+    n-grams with it. N-grams found in more than NGRAM_POSTING_LIMIT
+    possibilities are skipped as too common to tell names apart.
 
-    Returns:
-        - str: longest token that matches all members in group
+    Methods:
+        - close_matches
+            Best matches of a word, as difflib.get_close_matches
     """
 
-    all_tokens = []
-    for word in group:
-        all_tokens.extend(split_to_tokens(word))
-    all_tokens = set(all_tokens)
-    tracker = []
-    for token in all_tokens:
-        if all((token in word for word in group)):
-            tracker.append(token)
-
-    if not tracker:
-        return ''
-    else:
-        tracker.sort(key=lambda s: len(s), reverse=True)
+    def __init__(self, possibilities, exact_limit=EXACT_MATCH_LIMIT):
+        self.possibilities = list(possibilities)
+        self._index = None
+        if len(self.possibilities) > exact_limit:
+            self._index = defaultdict(list)
+            for ix, word in enumerate(self.possibilities):
+                for gram in ngrams(word):
+                    self._index[gram].append(ix)
+
+
+    def candidates(self, word):
+        if self._index is None:
+            return self.possibilities
+
+        postings = sorted((self._index[gram] for gram in ngrams(word) if gram in self._index), key=len)
+        if not postings:
+            return []
+        selective = [ixs for ixs in postings if len(ixs) <= NGRAM_POSTING_LIMIT] or postings[:1]
+
+        shared = Counter()
+        for ixs in selective:
+            shared.update(ixs)
+        return [self.possibilities[ix] for ix, _ in shared.most_common(CANDIDATE_LIMIT)]
+
 
-    return tracker[0]
+    def close_matches(self, word):
+        return get_close_matches(word, self.candidates(word))
 
 
 # ------------------------------------------------------------------------------
@@ -232,22 +299,25 @@ def match_names_to_subdirs(filenames):
     # fn_names = set((split_name(fn)[0] for fn in filenames))
     fn_names = set((get_name(fn) for fn in filenames))
     cwd_files = set((f for f in os.listdir() if os.path.isfile(f)))
-    cwd_subdirs = [d for d in os.listdir() if os.path.isdir(d)]
+    cwd_subdirs = [d for d in os.listdir()
+                   if os.path.isdir(d) and d != PARTIAL_DIRNAME and not d.startswith(STAGING_PREFIX)]
+    subdir_matcher = CloseMatcher(cwd_subdirs)
 
     # check against folder names in cwd
     for fn in fn_names:
-        check_cwd = get_close_matches(fn, cwd_subdirs)
+        check_cwd = subdir_matcher.close_matches(fn)
         if check_cwd:
             name_to_subdir[fn] = check_cwd[0]
             matched.add(fn)
 
     # find matches within incoming filenames
     fn_names -= matched
+    name_matcher = CloseMatcher(fn_names)
     for fn in fn_names:
         if fn in matched:
             continue
 
-        name_matches = get_close_matches(fn, fn_names)
+        name_matches = name_matcher.close_matches(fn)
 
         if len(name_matches) > 1:
             name_sets[fn] = set(name_matches)
@@ -259,7 +329,7 @@ def match_names_to_subdirs(filenames):
             fn_tokens = split_to_tokens(fn)
             # TODO: check other tokens if token name is file in cwd
             for token in fn_tokens:
-                check_cwd = get_close_matches(token, cwd_subdirs)
+                check_cwd = subdir_matcher.close_matches(token)
                 if check_cwd and (len(token) > token_subdir[0]):
                     token_subdir = (len(token), check_cwd[0])
 
@@ -272,7 +342,7 @@ def match_names_to_subdirs(filenames):
                     name_to_subdir[fn] = fn
 
     # combine groups of matches
-    checked = []
+    checked = set()
     groups = []
     for name_groups in name_sets.values():
         new_set = name_groups.copy()
@@ -283,7 +353,7 @@ def match_names_to_subdirs(filenames):
                 if name in name_sets:
                     new_set |= name_sets[name]
                 groups.append(new_set)
-                checked.extend(new_set)
+                checked.update(new_set)
 
     # use longest token per match group for shared folder name
     for group in groups:
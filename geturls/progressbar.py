@@ -3,9 +3,16 @@
 import argparse
 from collections import deque
 import os
+import threading
 import time
-from time import time as timestamp
+from time import perf_counter, time as timestamp
 # ------------------------------------------------------------------------------
+FRAME_RATE = 10
+RATE_WINDOW = 256
+DASHBOARD_RATE_WINDOW = 3 * FRAME_RATE
+MAX_TRANSFER_LINES = 8
+
+
 def screen_width():
     return os.get_terminal_size()[0]
 
@@ -49,6 +56,92 @@ def byte_unit(n, pad=False):
         return '{:.2f}{}'.format(val, unit)
 
 
+def truncate_url(url, line_space):
+    """Edits URL to fit line space.
+
+    Returns: str - url to be displayed
+    """
+
+    if len(url) >= line_space:
+        return '...' + url[(len(url) - line_space) + 4:]
+    return url
+
+
+# ------------------------------------------------------------------------------
+class RateEstimator(object):
+    """Bytes per second over the last window samples.
+
+    Sums of the window are kept as running totals, so adding a sample and
+    reading the rate are O(1). Totals are recomputed once per window to keep
+    float error from building up.
+    """
+
+    def __init__(self, window=RATE_WINDOW):
+        self.window = window
+        self._bytes = deque([], window)
+        self._seconds = deque([], window)
+        self._byte_sum = 0
+        self._second_sum = 0.0
+        self._count = 0
+
+
+    def add(self, nbytes, seconds):
+        if len(self._bytes) == self.window:
+            self._byte_sum -= self._bytes[0]
+            self._second_sum -= self._seconds[0]
+        self._bytes.append(nbytes)
+        self._seconds.append(seconds)
+        self._byte_sum += nbytes
+        self._second_sum += seconds
+
+        self._count += 1
+        if self._count == self.window:
+            self._count = 0
+            self._second_sum = sum(self._seconds)
+
+
+    def clear(self):
+        self._bytes.clear()
+        self._seconds.clear()
+        self._byte_sum = 0
+        self._second_sum = 0.0
+        self._count = 0
+
+
+    @property
+    def rate(self):
+        if self._second_sum <= 0:
+            return 0.0
+        return self._byte_sum / self._second_sum
+
+
+class Renderer(object):
+    """Calls draw on a daemon thread at a fixed frame rate until stopped, so
+    display cost does not grow with the number of chunks received.
+    """
+
+    def __init__(self, draw, fps=FRAME_RATE):
+        self.draw = draw
+        self.interval = 1 / fps
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.draw()
+
+
+    def start(self):
+        self._thread.start()
+
+
+    def stop(self):
+        self._stop.set()
+        if self._thread.is_alive() and self._thread is not threading.current_thread():
+            self._thread.join()
+
+
 # ------------------------------------------------------------------------------
 class Progressbar(object):
     """A class for graphically displaying the progress of a url download.
@@ -76,12 +169,17 @@ class Progressbar(object):
     Attributes:
         - current_fileno: int
             - cumulative total of urls requested
-        - nfiles: int
-            - total number of urls
+        - nfiles: int or None
+            - total number of urls, None while still being parsed
         - url: str
             - currently requested url
         - start_time: float
             - timestamp in seconds at start of current url request
+        - download_rate: float
+            - bytes per second over the last RATE_WINDOW chunks
+
+    Chunks received by update are only counted. The display is redrawn at
+    FRAME_RATE by a Renderer thread, and once more when a download completes.
 
     Methods:
         - no_byte_headers
@@ -92,8 +190,16 @@ class Progressbar(object):
             Returns terminal cursor position back to start of screen line
         - timeout
             Returns cursor and prints status
+        - completed_notice
+            Single line status for urls downloaded concurrently
+        - size_limit_notice
+            Text display for urls aborted for exceeding max size
+        - set_total
+            Sets number of urls once parsing has finished
         - update
             Callback for receiving bytes
+        - close
+            Stops the renderer
     """
 
     def __init__(self, quiet=False, nfiles=1):
@@ -101,97 +207,161 @@ class Progressbar(object):
 
         Args:
             quiet: bool - enable quiet mode
-            nfiles: int - total number of sequential files / urls
+            nfiles: int - total number of sequential files / urls, None if not known yet
         """
 
         self._quiet = quiet
         self.current_fileno = 0
-        self.nfiles = nfiles
-        self._tot_fileno = str(nfiles)
-        self._set_update_func(quiet)
-        self._line_length = screen_width()
+        self.set_total(nfiles)
+        self._screen_width = screen_width()
         self._set_bar_length()
         self.url = ''
         self.start_time = 0
-        self._bytes_tracker = deque([], 256)
-        self._seconds_tracker = deque([], 256)
+        self._bytes_total = 0
+        self._rate = RateEstimator()
+        self._lock = threading.RLock()
+        self._frames = 0
+        self._fps = FRAME_RATE
         self._reset_relative_params()
-
-
-    def _set_update_func(self, quiet):
-        if quiet:
-            self.update = self._text_update
-        else:
-            self.update = self._bar_update
+        self._renderer = Renderer(self._draw_frame, self._fps)
+        self._renderer.start()
 
 
     def _reset_relative_params(self):
         self._complete_switch = False
+        self._dirty = False
         self._text_cache = ''
         self._last_ix = 0
         self._current_total = 0
-        self._previous_time = timestamp()
+        self._previous_time = perf_counter()
+
 
+    @property
+    def download_rate(self):
+        return self._rate.rate
 
-    def reset(self, total_bytes=0, url=''):
+
+    def reset(self, total_bytes=0, url='', start_bytes=0):
         """Prepares for downloading new url.
 
         Args:
             total_bytes: int - size of incoming file in bytes
             url: str - to be displayed in terminal
+            start_bytes: int - bytes already downloaded by a previous run
         """
 
-        if not self._quiet:
-            if not self._complete_switch and self.current_fileno:
-                self.incomplete_notice()
+        with self._lock:
+            if not self._quiet:
+                if not self._complete_switch and self.current_fileno:
+                    self.incomplete_notice()
 
-        self.url = url
-        self.current_fileno += 1
-        self._bytes_total = total_bytes
-        self._display_total = byte_unit(total_bytes)
-        self._set_bar_length()
-        self._reset_relative_params()
-        self._bytes_tracker.clear()
-        self._seconds_tracker.clear()
-        self.start_time = timestamp()
+            self.url = url
+            self.current_fileno += 1
+            self._bytes_total = total_bytes
+            self._display_total = byte_unit(total_bytes)
+            self._set_bar_length()
+            self._reset_relative_params()
+            self._current_total = start_bytes
+            self._rate.clear()
+            self.start_time = timestamp()
+
+
+    def set_total(self, nfiles):
+        self.nfiles = nfiles
+        self._tot_fileno = '?' if nfiles is None else str(nfiles)
 
 
     def cleanup(self):
-        if self._quiet:
-            print('\b' * self._line_length, end='')
-        else:
-            self.reset()
+        with self._lock:
+            if self._quiet:
+                print('\b' * self._line_length, end='')
+            else:
+                self.reset()
+
+
+    def close(self):
+        self._renderer.stop()
 
 
     def incomplete_notice(self):
-        print(' DOWNLOAD INCOMPLETE '.center(self._line_length, '-'))
-        print(self._text_cache[1:self._line_length])
-        print('-' * self._line_length)
-        print()
+        with self._lock:
+            print(' DOWNLOAD INCOMPLETE '.center(self._line_length, '-'))
+            print(self._text_cache[1:self._line_length])
+            print('-' * self._line_length)
+            print()
 
 
     def timeout(self):
-        print('\b' * self._line_length, end='')
-        print('CONNECTION TIMEOUT'.center(self._line_length, '-'))
+        with self._lock:
+            print('\b' * self._line_length, end='')
+            print('CONNECTION TIMEOUT'.center(self._line_length, '-'))
 
 
     def no_byte_headers(self, url):
         """Display text for URL without valid Accept-Ranges or Content-Length."""
 
-        self.reset(url=url)
-        self._complete_switch = True
+        with self._lock:
+            self.reset(url=url)
+            self._complete_switch = True
 
-        fileno_status = '{}/{} '.format(self.current_fileno, self._tot_fileno)
-        notice = '{}Missing byte headers - progress NA: '.format(fileno_status)
+            fileno_status = '{}/{} '.format(self.current_fileno, self._tot_fileno)
+            notice = '{}Missing byte headers - progress NA: '.format(fileno_status)
 
-        line_space = self._line_length - len(notice)
-        text_url = self._truncate_url(line_space)
+            line_space = self._line_length - len(notice)
+            text_url = self._truncate_url(line_space)
 
-        header_notice = '{}{}'.format(notice, text_url)
-        text = '\r{:<{w}}'.format(header_notice, w=self._line_length)
-        print(text, end='')
-        if not self._quiet:
-            print(' ' * self._line_length)
+            header_notice = '{}{}'.format(notice, text_url)
+            text = '\r{:<{w}}'.format(header_notice, w=self._line_length)
+            print(text, end='')
+            if not self._quiet:
+                print(' ' * self._line_length)
+
+
+    def size_limit_notice(self, url, max_size):
+        """Display text for URL aborted for exceeding max download size."""
+
+        with self._lock:
+            self.reset(url=url)
+            self._complete_switch = True
+
+            fileno_status = '{}/{} '.format(self.current_fileno, self._tot_fileno)
+            notice = '{}Exceeds max size {} - skipped: '.format(fileno_status, byte_unit(max_size))
+
+            line_space = self._line_length - len(notice)
+            text_url = self._truncate_url(line_space)
+
+            text = '\r{:<{w}}'.format(notice + text_url, w=self._line_length)
+            print(text, end='')
+            if not self._quiet:
+                print(' ' * self._line_length)
+
+
+    def completed_notice(self, url, status, label=''):
+        """Display text for URL finished by a concurrent download worker.
+
+        Args:
+            url: str - completed url
+            status: bool - download succeeded
+            label: str - status text replacing DONE / FAILED
+        """
+
+        with self._lock:
+            self.url = url
+            self.current_fileno += 1
+            self._complete_switch = True
+
+            fileno_status = '{}/{} '.format(self.current_fileno, self._tot_fileno)
+            result = ' {} '.format(label or ('DONE' if status else 'FAILED'))
+
+            line_space = self._line_length - len(fileno_status) - len(result)
+            text_url = self._truncate_url(line_space - 1)
+            text = '\r{}{:<{line_space}}{}'.format(fileno_status, text_url, result, line_space=line_space)
+            self._text_cache = text
+
+            if self._quiet:
+                print(text, end='')
+            else:
+                print(text)
 
 
     def _truncate_url(self, line_space):
@@ -204,11 +374,7 @@ class Progressbar(object):
             - text_url: str - url to be displayed
         """
 
-        if len(self.url) >= line_space:
-            text_url = '...' + self.url[(len(self.url) - line_space) + 4:]
-        else:
-            text_url = self.url
-        return text_url
+        return truncate_url(self.url, line_space)
 
 
     def _running_total(self, complete=False):
@@ -239,12 +405,21 @@ class Progressbar(object):
 
 
     def _set_bar_length(self):
-        """Calculates total len for progress bar based on max size of rate text."""
+        """Calculates total len for progress bar based on max size of rate text.
+        Uses the screen width last read by the renderer.
+        """
 
-        self._line_length = screen_width()
+        self._line_length = self._screen_width
         self.bar_length = self._line_length - 19
 
 
+    def _refresh_screen_width(self):
+        try:
+            self._screen_width = screen_width()
+        except OSError:
+            pass
+
+
     def _draw_bar(self, ix=0):
         """Creates str progress bar.
 
@@ -280,7 +455,7 @@ class Progressbar(object):
         print(text, end='')
 
         if not complete:
-            print('\b' * back, end='')
+            print('\b' * back, end='', flush=True)
         else:
             print('\b' * (self._line_length - 1), end='')
             print(' ' * self._line_length)
@@ -289,62 +464,318 @@ class Progressbar(object):
             # print('\b' * (self._line_length), end='')
 
 
-    def _calculate_download_rate(self, bytes_delta):
-        """Updates rate for each chunk added as bytes/second."""
-
-        secs_delta = self.current_time - self._previous_time
-        self._previous_time = self.current_time
-        self._bytes_tracker.append(bytes_delta)
-        self._seconds_tracker.append(secs_delta)
-        self.download_rate = sum(self._bytes_tracker) / sum(self._seconds_tracker)
-
-
     def _update_total(self, chunk_value):
-        self.current_time = timestamp()
+        self.current_time = perf_counter()
         self._current_total += chunk_value
-        self._calculate_download_rate(chunk_value)
+        self._rate.add(chunk_value, self.current_time - self._previous_time)
+        self._previous_time = self.current_time
 
 
-    def _text_update(self, chunk_value):
-        """Quiet display - url and cumulative total only.
-        Text is not persistent and is erased with each successive call.
+    def update(self, chunk_value):
+        """Counts incoming bytes, drawing the display only once the download
+        completes. Frames in between are drawn by the renderer.
 
         Args:
             chunk_value: int - incoming bytes
         """
 
         self._update_total(chunk_value)
-        url_bytes_total = self._running_total()
-        text = '\r{}'.format(url_bytes_total)
-        print(text, end='')
+        if self._complete_switch:
+            return
 
-        if self._current_total >= self._bytes_total:
-            self._complete_switch = True
+        if self._quiet:
+            complete = self._current_total >= self._bytes_total
+        else:
+            complete = bool(self._bytes_total) and self._current_total >= self._bytes_total
+
+        if complete:
+            with self._lock:
+                if self._quiet:
+                    self._text_update()
+                else:
+                    self._draw_display(self.bar_length, complete=True)
+                self._complete_switch = True
+        else:
+            self._dirty = True
 
 
-    def _bar_update(self, chunk_value):
-        """Standard 2 line display.
+    def _draw_frame(self):
+        """Renderer callback, redraws the display if bytes arrived since the
+        last frame and reads the screen width once a second.
+        """
 
-        Arg:
-            chunk_value: int - incoming bytes
+        with self._lock:
+            self._frames += 1
+            if self._frames % self._fps == 0:
+                self._refresh_screen_width()
+
+            if not self._dirty or self._complete_switch:
+                return
+            self._dirty = False
+            if self._quiet:
+                self._text_update()
+            else:
+                self._bar_update()
+
+
+    def _text_update(self):
+        """Quiet display - url and cumulative total only.
+        Text is not persistent and is erased with each successive frame.
         """
 
-        self._update_total(chunk_value)
+        url_bytes_total = self._running_total()
+        text = '\r{}'.format(url_bytes_total)
+        print(text, end='', flush=True)
+
+
+    def _bar_update(self):
+        """Standard 2 line display."""
+
         if self._bytes_total:
             progress = self._current_total / self._bytes_total
         else:
             progress = 0
 
-        ix = int(progress * self.bar_length)
+        ix = min(int(progress * self.bar_length), self.bar_length)
+        self._last_ix = ix
+        self._draw_display(ix)
 
-        if ix > self._last_ix and not self._complete_switch:
-            if ix >= self.bar_length:
-                ix = self.bar_length
-                self._draw_display(ix, complete=True)
-                self._complete_switch = True
-            else:
-                self._last_ix = ix
-                self._draw_display(ix)
+
+# ------------------------------------------------------------------------------
+class _Transfer(object):
+    """Bytes received by one active download, sampled once per frame. Bytes
+    may be added from several threads, e.g. segments of one file.
+    """
+
+    def __init__(self, url, total_bytes=None, start_bytes=0):
+        self.url = url
+        self.total_bytes = total_bytes
+        self.start_bytes = start_bytes
+        self.received = start_bytes
+        self.rate = RateEstimator(DASHBOARD_RATE_WINDOW)
+        self._sampled_bytes = start_bytes
+        self._sampled_time = perf_counter()
+        self._lock = threading.Lock()
+
+
+    def add(self, nbytes):
+        with self._lock:
+            self.received += nbytes
+
+
+    def sample(self, now):
+        received = self.received
+        self.rate.add(received - self._sampled_bytes, now - self._sampled_time)
+        self._sampled_bytes = received
+        self._sampled_time = now
+
+
+class Dashboard(object):
+    """Display of concurrent downloads, redrawn at a fixed frame rate.
+
+    ----------------------------------------------------------------------------
+    ----------------------------- DISPLAY EXAMPLES -----------------------------
+    ----------------------------------------------------------------------------
+
+    --> Standard display:
+
+    1/12 https://test-url-dot-com/folder_01/file_01.txt                   DONE
+    ...st-url-dot-com/folder_0002/file_02.txt   [  2.10MB/5.90MB]   1.40MBps
+    ...t-url-dot-com/folder_00003/file_03.txt   [  0.85MB/6.90MB]   1.10MBps
+    ------- 1/12 done - 2 active - 2.50MBps - ETA 24.91s --------------------
+
+    --> Quiet display, aggregate line only:
+
+    ------- 1/12 done - 2 active - 2.50MBps - ETA 24.91s --------------------
+
+    ----------------------------------------------------------------------------
+    ----------------------------------------------------------------------------
+
+    Download workers only add to the byte count of their transfer, rates and
+    the display are updated by a Renderer thread. Finished urls are printed
+    above the live lines, which are erased and redrawn with ANSI escapes.
+
+    Attributes:
+        - current_fileno: int
+            - number of urls finished
+        - nfiles: int or None
+            - total number of urls, None while still being parsed
+
+    Methods:
+        - track
+            Adds a line for a download in progress
+        - completed_notice
+            Prints a finished url and removes its line
+        - set_total
+            Sets number of urls once parsing has finished
+        - cleanup
+            Erases the live lines
+        - close
+            Stops the renderer and erases the live lines
+    """
+
+    def __init__(self, quiet=False, nfiles=None, max_lines=MAX_TRANSFER_LINES):
+        self._quiet = quiet
+        self.max_lines = max_lines
+        self.current_fileno = 0
+        self.set_total(nfiles)
+        self._screen_width = screen_width()
+        self._active = {}
+        self._finished_bytes = 0
+        self._done_bytes = 0
+        self._done_files = 0
+        self._rate = RateEstimator(DASHBOARD_RATE_WINDOW)
+        self._sampled_bytes = 0
+        self._sampled_time = perf_counter()
+        self._frame_lines = 0
+        self._frames = 0
+        self._fps = FRAME_RATE
+        self._lock = threading.Lock()
+        self._renderer = Renderer(self._draw_frame, self._fps)
+        self._renderer.start()
+
+
+    def set_total(self, nfiles):
+        self.nfiles = nfiles
+        self._tot_fileno = '?' if nfiles is None else str(nfiles)
+
+
+    def track(self, url, total_bytes=None, start_bytes=0):
+        """
+        Args:
+            - url: str - as passed to completed_notice when finished
+            - total_bytes: int or None - size of the complete file
+            - start_bytes: int - bytes already downloaded by a previous run
+
+        Returns: func - callback for bytes received
+        """
+
+        transfer = _Transfer(url, total_bytes, start_bytes)
+        with self._lock:
+            self._active[url] = transfer
+        return transfer.add
+
+
+    def completed_notice(self, url, status, label=''):
+        """Prints url with its status above the live lines.
+
+        Args:
+            url: str - completed url
+            status: bool - download succeeded
+            label: str - status text replacing DONE / FAILED
+        """
+
+        with self._lock:
+            self.current_fileno += 1
+            transfer = self._active.pop(url, None)
+            if transfer:
+                self._finished_bytes += transfer.received - transfer.start_bytes
+                if status:
+                    self._done_bytes += transfer.received
+                    self._done_files += 1
+
+            if self._quiet:
+                return
+            width = self._screen_width
+            fileno_status = '{}/{} '.format(self.current_fileno, self._tot_fileno)
+            result = ' {} '.format(label or ('DONE' if status else 'FAILED'))
+            line_space = width - len(fileno_status) - len(result)
+            text_url = truncate_url(url, line_space - 1)
+            self._erase()
+            print('{}{:<{line_space}}{}'.format(fileno_status, text_url, result, line_space=line_space))
+
+
+    def cleanup(self):
+        with self._lock:
+            self._erase()
+
+
+    def close(self):
+        self._renderer.stop()
+        self.cleanup()
+
+
+    # --------------------------------------------------------------------------
+    def _erase(self):
+        if self._frame_lines:
+            print('\r\x1b[{}A\x1b[J'.format(self._frame_lines), end='')
+            self._frame_lines = 0
+
+
+    def _eta(self):
+        """Returns: str - time left for bytes of active downloads and of urls
+        not started yet, estimated at the mean size of finished downloads
+        """
+
+        remaining = sum(t.total_bytes - t.received for t in self._active.values() if t.total_bytes)
+        if self.nfiles is not None and self._done_files:
+            queued = max(0, self.nfiles - self.current_fileno - len(self._active))
+            remaining += queued * self._done_bytes / self._done_files
+
+        rate = self._rate.rate
+        if not rate:
+            return '?'
+        return time_unit(max(0, remaining) / rate)
+
+
+    def _transfer_line(self, transfer, width):
+        if transfer.total_bytes:
+            total = byte_unit(transfer.total_bytes)
+        else:
+            total = '?'
+        tail = ' [{}/{}] {}ps'.format(byte_unit(transfer.received, pad=True), total,
+                                      byte_unit(transfer.rate.rate, pad=True))
+        line_space = width - len(tail)
+        return '{:<{line_space}}{}'.format(truncate_url(transfer.url, line_space - 1), tail,
+                                            line_space=line_space)
+
+
+    def _lines(self, width):
+        lines = []
+        if not self._quiet:
+            active = list(self._active.values())
+            for transfer in active[:self.max_lines]:
+                lines.append(self._transfer_line(transfer, width))
+            if len(active) > self.max_lines:
+                lines.append('... {} more'.format(len(active) - self.max_lines))
+
+        summary = ' {}/{} done - {} active - {}ps - ETA {} '.format(
+            self.current_fileno, self._tot_fileno, len(self._active),
+            byte_unit(self._rate.rate), self._eta())
+        lines.append('{:-^{w}}'.format(summary, w=width))
+        return lines
+
+
+    def _draw_frame(self):
+        """Renderer callback, samples transfer rates and redraws the live
+        lines. The screen width is read once a second.
+        """
+
+        with self._lock:
+            self._frames += 1
+            if self._frames % self._fps == 0:
+                try:
+                    self._screen_width = screen_width()
+                except OSError:
+                    pass
+
+            now = perf_counter()
+            received = self._finished_bytes
+            for transfer in self._active.values():
+                transfer.sample(now)
+                received += transfer.received - transfer.start_bytes
+            self._rate.add(max(0, received - self._sampled_bytes), now - self._sampled_time)
+            self._sampled_bytes = received
+            self._sampled_time = now
+
+            if not self._active and not self._frame_lines:
+                return
+
+            # one char short of the width so lines never wrap
+            lines = self._lines(self._screen_width - 1)
+            self._erase()
+            print('\n'.join(lines), flush=True)
+            self._frame_lines = len(lines)
 
 
 # ------------------------------------------------------------------------------
@@ -405,6 +836,7 @@ def simulate_download(nfiles=1, KBps=15000, quiet=False, missing=3, incomplete=4
             loop_count += 1
 
     progressbar.cleanup()
+    progressbar.close()
 
     n_comp = nfiles - failed
     w = screen_width()
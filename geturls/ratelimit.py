@@ -0,0 +1,200 @@
+"""Per-host request rate and concurrency limits.
+"""
+
+import json
+import threading
+import time
+from urllib.parse import urlsplit
+# ------------------------------------------------------------------------------
+class TokenBucket(object):
+    """Token bucket allowing rate requests per second with bursts of up to
+    burst requests. A rate of 0 disables the limit.
+    """
+
+    def __init__(self, rate=0, burst=1):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+
+    def try_acquire(self):
+        """Takes a token if one is available.
+
+        Returns: float - 0 if a token was taken, else seconds until one is available
+        """
+
+        if not self.rate:
+            return 0
+
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0
+            return (1 - self._tokens) / self.rate
+
+
+    def reserve(self):
+        """Takes the next token, even if it is not available yet.
+
+        Returns: float - seconds to wait before using the token
+        """
+
+        if not self.rate:
+            return 0
+
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens -= 1
+            return max(0, -self._tokens / self.rate)
+
+
+# ------------------------------------------------------------------------------
+class HostLimiter(object):
+    """Request rate and concurrency limits kept separately for each host, so
+    requests to one host never wait on another.
+
+    Example hosts mapping:
+
+        {'example.com': {'rate': 2, 'burst': 4, 'concurrency': 2},
+         'cdn.example.com:8080': {'rate': 0}}
+
+    Args:
+        - rate: float - default requests per second per host, 0 for no limit
+        - burst: int - default number of requests allowed back to back
+        - concurrency: int - default max simultaneous requests per host, 0 for no limit
+        - hosts: dict - per-host overrides keyed by host or host:port
+
+    Methods:
+        - delay
+            Reserves a request slot for url and returns seconds to wait
+        - try_acquire
+            Non-blocking delay, takes a slot only if available now
+        - max_jobs
+            Concurrency limit for url's host
+        - try_hold, hold, release
+            Count connections open to url's host against max_jobs
+    """
+
+    def __init__(self, rate=0, burst=1, concurrency=0, hosts=None):
+        self.rate = rate
+        self.burst = burst
+        self.concurrency = concurrency
+        self._hosts = {host.lower(): settings for host, settings in (hosts or {}).items()}
+        self._buckets = {}
+        self._active = {}
+        self._lock = threading.Lock()
+
+
+    def _settings(self, url):
+        parts = urlsplit(url)
+        netloc = parts.netloc.lower()
+        hostname = (parts.hostname or '').lower()
+        return self._hosts.get(netloc, self._hosts.get(hostname, {}))
+
+
+    def _bucket(self, url):
+        host = urlsplit(url).netloc.lower()
+        with self._lock:
+            if host not in self._buckets:
+                settings = self._settings(url)
+                self._buckets[host] = TokenBucket(settings.get('rate', self.rate),
+                                                  settings.get('burst', self.burst))
+            return self._buckets[host]
+
+
+    def delay(self, url):
+        return self._bucket(url).reserve()
+
+
+    def try_acquire(self, url):
+        return self._bucket(url).try_acquire()
+
+
+    def max_jobs(self, url):
+        return self._settings(url).get('concurrency', self.concurrency)
+
+
+    def try_hold(self, url):
+        """Takes a connection slot for url's host if it is below max_jobs.
+
+        Returns: bool - slot was taken, release it when the connection closes
+        """
+
+        max_jobs = self.max_jobs(url)
+        host = urlsplit(url).netloc.lower()
+        with self._lock:
+            active = self._active.get(host, 0)
+            if max_jobs and active >= max_jobs:
+                return False
+            self._active[host] = active + 1
+            return True
+
+
+    def hold(self, url):
+        """Takes a connection slot for url's host regardless of max_jobs."""
+
+        host = urlsplit(url).netloc.lower()
+        with self._lock:
+            self._active[host] = self._active.get(host, 0) + 1
+
+
+    def release(self, url):
+        host = urlsplit(url).netloc.lower()
+        with self._lock:
+            self._active[host] -= 1
+            if not self._active[host]:
+                del self._active[host]
+
+
+def check_host_settings(host, settings):
+    """Validates the rate, burst and concurrency settings of one host.
+
+    Raises:
+        - ValueError for unknown keys or out of range values
+    """
+
+    unknown = set(settings) - {'rate', 'burst', 'concurrency'}
+    if unknown:
+        raise ValueError('unknown settings for {}: {}'.format(host, ', '.join(sorted(unknown))))
+
+    rate = settings.get('rate', 0)
+    if isinstance(rate, bool) or not isinstance(rate, (int, float)) or not 0 <= rate < float('inf'):
+        raise ValueError('rate for {} must be a finite number of at least 0: {!r}'.format(host, rate))
+
+    burst = settings.get('burst', 1)
+    if isinstance(burst, bool) or not isinstance(burst, int) or burst < 1:
+        raise ValueError('burst for {} must be an int of at least 1: {!r}'.format(host, burst))
+
+    concurrency = settings.get('concurrency', 0)
+    if isinstance(concurrency, bool) or not isinstance(concurrency, int) or concurrency < 0:
+        raise ValueError('concurrency for {} must be an int of at least 0: {!r}'.format(host, concurrency))
+
+
+def load_host_limits(filepath):
+    """Reads per-host limits mapping from a JSON file.
+
+    Returns: dict
+
+    Raises:
+        - ValueError if the file is not a mapping of valid host settings
+    """
+
+    with open(filepath, 'r') as f:
+        hosts = json.load(f)
+
+    if not isinstance(hosts, dict) or not all(isinstance(v, dict) for v in hosts.values()):
+        raise ValueError('host limits must map host names to settings: {}'.format(filepath))
+    for host, settings in hosts.items():
+        check_host_settings(host, settings)
+    return hosts
+
+
+# ------------------------------------------------------------------------------
@@ -0,0 +1,260 @@
+"""Name tokens for grouping filenames into shared folders.
+
+A token is a span of a filename from the start of one run of ASCII letters
+and digits to the end of a later run, at least minchars long. Tokens mixing
+letters and digits are also split at runs of letters. Runs are found with
+one regex scan, and the longest token shared by a group of names is found
+with a suffix automaton instead of testing every token against every name.
+"""
+
+import re
+# ------------------------------------------------------------------------------
+ALNUM_RUN = re.compile(r'[A-Za-z0-9]+')
+ALPHA_RUN = re.compile(r'[A-Za-z]+')
+MIN_TOKEN_CHARS = 3
+
+
+def run_bounds(filename, pattern=ALNUM_RUN, start=0, stop=None):
+    """Start and stop indices of each run matched by pattern.
+
+    Returns: (list, list)
+    """
+
+    stop = len(filename) if stop is None else stop
+    runs = [(m.start(), m.end()) for m in pattern.finditer(filename, start, stop)]
+    return [a for a, _ in runs], [b for _, b in runs]
+
+
+def _digit_split_spans(filename, start, stop, minchars):
+    """Spans of the letter runs within filename[start:stop], extended to the
+    start and end of the whole span.
+    """
+
+    starts, stops = run_bounds(filename, ALPHA_RUN, start, stop)
+    if not starts:
+        return []
+    if starts[0] != start:
+        starts.insert(0, start)
+    if stops[-1] != stop:
+        # ends past the span, so it is only kept for starts after the first
+        stops.append(stop + 1)
+
+    span_len = stop - start
+    return [(a, min(b, stop)) for a in starts for b in stops if minchars <= b - a <= span_len]
+
+
+def token_spans(filename, minchars=MIN_TOKEN_CHARS, split_digits=False):
+    """(start, stop) of every token of filename, in the order split_to_tokens
+    finds them. Spans may repeat.
+
+    Args:
+        - filename: str
+        - minchars: int - minimum length of token found in filename
+        - split_digits: bool - only split filename at runs of letters
+
+    Returns: list of (int, int)
+    """
+
+    if split_digits:
+        return _digit_split_spans(filename, 0, len(filename), minchars)
+
+    starts, stops = run_bounds(filename)
+    spans = [(a, b) for a in starts for b in stops if b - a >= minchars]
+
+    # alphanumeric tokens with at least one digit are also split at letters
+    mixed = [(a, b) for a, b in spans if filename[a:b].isalnum() and not filename[a:b].isalpha()]
+    for a, b in mixed:
+        spans.extend(_digit_split_spans(filename, a, b, minchars))
+
+    return spans
+
+
+def split_to_tokens(filename, minchars=MIN_TOKEN_CHARS, split_digits=False):
+    """
+    Args:
+        - filename: str
+        - minchars: int - minimum length of token found in filename
+        - split_digits: bool - enables splitting alphanumeric str into tokens
+
+    Returns:
+        - list: all str tokens sorted by length
+    """
+
+    tokens = [filename[a:b] for a, b in token_spans(filename, minchars, split_digits)]
+    return sorted(tokens, key=len, reverse=True)
+
+
+# ------------------------------------------------------------------------------
+class SuffixAutomaton(object):
+    """Suffix automaton of a string, recognizing each of its substrings in
+    time linear in the length of the query.
+
+    Each state stands for a set of substrings sharing their end positions,
+    all suffixes of the longest one, with lengths from
+    length[link[state]] + 1 to length[state].
+
+    Attributes:
+        - text: str
+        - length: list (int) - longest substring of each state
+        - link: list (int) - suffix link of each state, -1 for the root
+        - next: list (dict) - transitions of each state by character
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self.length = [0]
+        self.link = [-1]
+        self.next = [{}]
+        last = 0
+        for char in text:
+            last = self._extend(last, char)
+
+
+    def _extend(self, last, char):
+        length, link, nxt = self.length, self.link, self.next
+        state = len(length)
+        length.append(length[last] + 1)
+        link.append(0)
+        nxt.append({})
+
+        p = last
+        while p != -1 and char not in nxt[p]:
+            nxt[p][char] = state
+            p = link[p]
+        if p != -1:
+            q = nxt[p][char]
+            if length[p] + 1 == length[q]:
+                link[state] = q
+            else:
+                clone = len(length)
+                length.append(length[p] + 1)
+                link.append(link[q])
+                nxt.append(dict(nxt[q]))
+                while p != -1 and nxt[p].get(char) == q:
+                    nxt[p][char] = clone
+                    p = link[p]
+                link[q] = clone
+                link[state] = clone
+        return state
+
+
+    def walk(self, word):
+        """Longest suffix of each prefix of word that is a substring of text.
+
+        Yields:
+            (state, length) after each character of word
+        """
+
+        length, link, nxt = self.length, self.link, self.next
+        state = 0
+        matched = 0
+        for char in word:
+            while state and char not in nxt[state]:
+                state = link[state]
+                matched = length[state]
+            if char in nxt[state]:
+                state = nxt[state][char]
+                matched += 1
+            yield state, matched
+
+
+    def by_length(self):
+        """States ordered by decreasing length of their longest substring."""
+
+        return sorted(range(len(self.length)), key=self.length.__getitem__, reverse=True)
+
+
+class SharedSubstrings(object):
+    """Substrings found in every word of a group, recognized with a suffix
+    automaton of the shortest word.
+
+    Methods:
+        - suffix_lengths
+            Longest shared substring ending at each position of a word
+    """
+
+    def __init__(self, words):
+        words = sorted(words, key=len)
+        self.automaton = automaton = SuffixAutomaton(words[0] if words else '')
+        length, link = automaton.length, automaton.link
+        order = automaton.by_length()
+
+        # longest substring of each state found in all words, each shorter
+        # substring of the state is found as well
+        common = list(length)
+        for word in words[1:]:
+            found = [0] * len(length)
+            for state, matched in automaton.walk(word):
+                if matched > found[state]:
+                    found[state] = matched
+            for state in order:
+                parent = link[state]
+                if found[state] and parent > 0 and found[parent] < length[parent]:
+                    found[parent] = length[parent]
+            for state, count in enumerate(found):
+                if count < common[state]:
+                    common[state] = count
+        self.common = common
+
+        # longest shared substring of a state or the states on its suffix path
+        inherited = [0] * len(length)
+        for state in reversed(order):
+            parent = link[state]
+            if parent == -1:
+                continue
+            if common[state] > length[parent]:
+                inherited[state] = common[state]
+            else:
+                inherited[state] = inherited[parent]
+        self.inherited = inherited
+
+
+    def suffix_lengths(self, word):
+        """Length of the longest shared suffix of each prefix of word.
+
+        Returns: list (int) - indexed by end position in word
+        """
+
+        length, link = self.automaton.length, self.automaton.link
+        common, inherited = self.common, self.inherited
+        shared = [0]
+        for state, matched in self.automaton.walk(word):
+            if not state:
+                shared.append(0)
+            elif common[state] > length[link[state]]:
+                shared.append(min(matched, common[state]))
+            else:
+                shared.append(inherited[link[state]])
+        return shared
+
+
+def find_longest_shared_token(group, minchars=MIN_TOKEN_CHARS):
+    """
+    Args:
+        - group: iterable of filenames
+
+    Returns:
+        - str: longest token that matches all members in group, the first in
+            sorted order among tokens of equal length
+    """
+
+    words = set(group)
+    if not words:
+        return ''
+
+    substrings = SharedSubstrings(words)
+    best = ''
+    for word in words:
+        shared = substrings.suffix_lengths(word)
+        if max(shared) < len(best):
+            continue
+        for a, b in token_spans(word, minchars):
+            if b - a < len(best) or b - a > shared[b]:
+                continue
+            token = word[a:b]
+            if len(token) > len(best) or token < best:
+                best = token
+    return best
+
+
+# ------------------------------------------------------------------------------
@@ -0,0 +1,266 @@
+"""JSON Lines log of every transfer, appended while downloads run.
+
+Each line is one JSON object per url with its result, HTTP status code,
+bytes received, elapsed time, time to first byte, throughput, retries and
+final path. Lines are buffered and flushed at least once per FLUSH_INTERVAL
+seconds while any are pending, so the log can be followed with tail -f
+during long runs.
+"""
+
+import json
+import os
+import threading
+import time
+from urllib.parse import urlparse
+
+from geturls.validators import NOT_MODIFIED
+# ------------------------------------------------------------------------------
+FLUSH_INTERVAL = 1.0
+BUFFER_SIZE = 64 * 1024
+
+DONE = 'done'
+FAILED = 'failed'
+UNCHANGED = 'unchanged'
+RECOVERED = 'recovered'
+
+_local = threading.local()
+
+
+def current_transfer():
+    """Returns: TransferStats instance of the download running in this thread, or None"""
+
+    return getattr(_local, 'transfer', None)
+
+
+def set_current_transfer(stats):
+    _local.transfer = stats
+
+
+class TransferStats(object):
+    """Request details and timings of one download, filled in as it runs.
+
+    Attributes:
+        - url: str
+        - start_bytes: int - size of a partial file continued by this transfer
+        - status_code: int or None - HTTP status of the last response
+        - requests: int - requests answered, not counting redirects
+        - ttfb: float or None - seconds until the first response
+        - elapsed: float or None - seconds until the download finished
+        - nbytes: int - bytes received
+        - error: str or None - exception that ended the last request
+    """
+
+    def __init__(self, url, start_bytes=0):
+        self.url = url
+        self.start_bytes = start_bytes
+        self.status_code = None
+        self.requests = 0
+        self.ttfb = None
+        self.elapsed = None
+        self.nbytes = 0
+        self.error = None
+        self._start = time.perf_counter()
+
+
+    def response(self, status_code):
+        """Records one response to a request made for url."""
+
+        if self.ttfb is None:
+            self.ttfb = time.perf_counter() - self._start
+        self.status_code = status_code
+        self.requests += 1
+
+
+    def failed(self, error):
+        """Records the exception raised by a request or transfer for url."""
+
+        # urllib wraps connection errors in URLError with the cause as reason
+        reason = getattr(error, 'reason', None)
+        self.error = type(reason if isinstance(reason, BaseException) else error).__name__
+
+
+    def finish(self, filepath=None):
+        """Stops the clock, counting bytes received by the size filepath grew."""
+
+        self.elapsed = time.perf_counter() - self._start
+        if filepath:
+            try:
+                self.nbytes = max(0, os.path.getsize(filepath) - self.start_bytes)
+            except OSError:
+                self.nbytes = 0
+
+
+    @property
+    def retries(self):
+        return max(0, self.requests - 1)
+
+
+    @property
+    def cause(self):
+        """Returns: str - why a failed transfer failed, http_<code> for error
+        responses, the exception name for requests that raised, otherwise
+        transfer for bodies that were cut short or exceeded max size
+        """
+
+        if self.status_code and self.status_code >= 400:
+            return 'http_{}'.format(self.status_code)
+        return self.error or 'transfer'
+
+
+    @property
+    def throughput(self):
+        """Returns: float - bytes per second over the whole transfer"""
+
+        return self.nbytes / self.elapsed if self.elapsed else 0.0
+
+
+# ------------------------------------------------------------------------------
+class TransferTee(object):
+    """Passes transfer results on to several sinks, e.g. a TransferLog and
+    metrics.RunMetrics, each with finished, placed and close methods.
+    """
+
+    def __init__(self, sinks):
+        self.sinks = list(sinks)
+
+
+    def finished(self, stats, result):
+        for sink in self.sinks:
+            sink.finished(stats, result)
+
+
+    def placed(self, url, path):
+        for sink in self.sinks:
+            sink.placed(url, path)
+
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
+
+
+def transfer_sink(sinks):
+    """Returns: the one sink in sinks, a TransferTee of several or None"""
+
+    sinks = [sink for sink in sinks if sink]
+    if not sinks:
+        return None
+    return sinks[0] if len(sinks) == 1 else TransferTee(sinks)
+
+
+# ------------------------------------------------------------------------------
+def transfer_result(status):
+    """Returns: str - log result of a download status"""
+
+    if status is NOT_MODIFIED:
+        return UNCHANGED
+    return DONE if status else FAILED
+
+
+def transfer_record(stats, result, path=None):
+    """Returns: dict - one log line"""
+
+    def seconds(value):
+        return None if value is None else round(value, 4)
+
+    return {'time': round(time.time(), 3),
+            'url': stats.url,
+            'host': urlparse(stats.url).netloc.lower(),
+            'result': result,
+            'status': stats.status_code,
+            'bytes': stats.nbytes,
+            'elapsed': seconds(stats.elapsed),
+            'ttfb': seconds(stats.ttfb),
+            'throughput': round(stats.throughput, 1),
+            'retries': stats.retries,
+            'path': path}
+
+
+class TransferLog(object):
+    """Appends a JSON line per url as transfers finish.
+
+    Completed downloads are logged once they are placed and their final path
+    is known. Failed and unchanged urls are logged right away.
+
+    Methods:
+        - finished
+            Records the result of a download
+        - placed
+            Logs a completed download with its final path
+        - close
+            Logs downloads that were never placed and closes the file
+    """
+
+    def __init__(self, filepath, flush_interval=FLUSH_INTERVAL):
+        self.filepath = os.path.abspath(filepath)
+        self.flush_interval = flush_interval
+        self._file = open(self.filepath, 'a', encoding='utf-8', buffering=BUFFER_SIZE)
+        self._lock = threading.Lock()
+        self._unplaced = {}
+        self._last_flush = time.monotonic()
+        self._timer = None
+
+
+    def _timed_flush(self):
+        with self._lock:
+            self._timer = None
+            if not self._file.closed:
+                self._file.flush()
+                self._last_flush = time.monotonic()
+
+
+    def _write(self, record):
+        line = json.dumps(record, ensure_ascii=False, separators=(',', ':'))
+        with self._lock:
+            self._file.write(line)
+            self._file.write('\n')
+            now = time.monotonic()
+            if now - self._last_flush >= self.flush_interval:
+                self._file.flush()
+                self._last_flush = now
+            elif self._timer is None:
+                # lines written between flushes reach the file within flush_interval
+                self._timer = threading.Timer(self.flush_interval, self._timed_flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+
+    def finished(self, stats, result):
+        """
+        Args:
+            - stats: TransferStats instance
+            - result: str - DONE, FAILED or UNCHANGED
+        """
+
+        if result == DONE:
+            with self._lock:
+                self._unplaced[stats.url] = stats
+        else:
+            self._write(transfer_record(stats, result))
+
+
+    def placed(self, url, path):
+        with self._lock:
+            stats = self._unplaced.pop(url, None)
+        if stats is None:
+            # finished by an earlier run and recovered from the job journal
+            stats = TransferStats(url)
+            self._write(transfer_record(stats, RECOVERED, path))
+        else:
+            self._write(transfer_record(stats, DONE, path))
+
+
+    def close(self):
+        with self._lock:
+            unplaced = list(self._unplaced.values())
+            self._unplaced = {}
+        for stats in unplaced:
+            self._write(transfer_record(stats, DONE))
+        with self._lock:
+            if self._timer:
+                self._timer.cancel()
+                self._timer = None
+            self._file.close()
+
+
+# ------------------------------------------------------------------------------
@@ -0,0 +1,251 @@
+"""Bounded memory sets of seen URLs and sorting of unique URLs.
+
+Keeping every URL of a very large input in a Python set costs well over a
+hundred bytes per URL. BloomFilter answers membership in a few bytes per URL
+at the cost of a configurable false positive rate, DiskSet keeps an exact
+index on disk and sorted_unique sorts with runs spilled to disk.
+"""
+
+import hashlib
+import heapq
+import math
+import os
+import sqlite3
+import tempfile
+# ------------------------------------------------------------------------------
+BLOOM_CAPACITY = 10**7
+BLOOM_ERROR_RATE = 1e-6
+DISK_CACHE_KIB = 16 * 1024
+SORT_RUN_SIZE = 10**6
+RUN_ENCODING = 'utf-8'
+
+
+def _url_hashes(url):
+    """Two independent 64 bit hashes of url for double hashing."""
+
+    digest = hashlib.blake2b(url.encode(RUN_ENCODING, 'surrogateescape'), digest_size=16).digest()
+    return int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+
+
+class _BloomSlice(object):
+    """Fixed size Bloom filter holding up to capacity items at error_rate."""
+
+    def __init__(self, capacity, error_rate):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.count = 0
+        self.nbits = max(8, int(math.ceil(-capacity * math.log(error_rate) / math.log(2)**2)))
+        self.nhashes = max(1, int(round(self.nbits / capacity * math.log(2))))
+        self.bits = bytearray((self.nbits + 7) // 8)
+
+
+    def positions(self, hashes):
+        h1, h2 = hashes
+        return [(h1 + i * h2) % self.nbits for i in range(self.nhashes)]
+
+
+    def contains(self, positions):
+        bits = self.bits
+        return all(bits[pos >> 3] & (1 << (pos & 7)) for pos in positions)
+
+
+    def add(self, positions):
+        bits = self.bits
+        for pos in positions:
+            bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+
+class BloomFilter(object):
+    """Approximate set of URLs in bounded memory.
+
+    Membership tests may report a URL that was never added (false positive)
+    with probability about error_rate, but never miss one that was. Memory is
+    fixed for up to capacity URLs, about 3.7 bytes per URL at the default
+    error rate. Past capacity a new slice twice the size is added at half the
+    error rate of the last, so the overall rate stays below error_rate.
+
+    Attributes:
+        - capacity: int
+            - URLs held by the first slice
+        - error_rate: float
+        - nbytes: int
+            - memory used by the bit arrays
+
+    Methods:
+        - add
+    """
+
+    def __init__(self, capacity=BLOOM_CAPACITY, error_rate=BLOOM_ERROR_RATE):
+        if capacity < 1:
+            raise ValueError('capacity must be at least 1')
+        if not 0 < error_rate < 1:
+            raise ValueError('error_rate must be between 0 and 1')
+
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self._slices = [_BloomSlice(capacity, error_rate / 2)]
+        self._last_url = None
+        self._last_positions = []
+
+
+    def _positions(self, url):
+        """Bit positions of url in each slice. Membership is usually tested
+        right before adding the same url, so the last result is reused.
+        """
+
+        if url != self._last_url:
+            self._last_url = url
+            self._last_positions = []
+        positions = self._last_positions
+        if len(positions) < len(self._slices):
+            hashes = _url_hashes(url)
+            positions.extend(bloom.positions(hashes) for bloom in self._slices[len(positions):])
+        return positions
+
+
+    def __contains__(self, url):
+        return any(bloom.contains(positions) for bloom, positions in zip(self._slices, self._positions(url)))
+
+
+    def __len__(self):
+        return sum(bloom.count for bloom in self._slices)
+
+
+    @property
+    def nbytes(self):
+        return sum(len(bloom.bits) for bloom in self._slices)
+
+
+    def add(self, url):
+        bloom = self._slices[-1]
+        if bloom.count >= bloom.capacity:
+            bloom = _BloomSlice(bloom.capacity * 2, bloom.error_rate / 2)
+            self._slices.append(bloom)
+        bloom.add(self._positions(url)[-1])
+
+
+# ------------------------------------------------------------------------------
+class DiskSet(object):
+    """Exact set of URLs kept in a temporary SQLite index. Memory use is
+    bounded by the page cache, about 16MB.
+
+    Methods:
+        - add
+        - close
+            Deletes the index
+    """
+
+    def __init__(self, dirpath=None, cache_kib=DISK_CACHE_KIB):
+        fd, self.filepath = tempfile.mkstemp(prefix='geturls_seen_', suffix='.sqlite', dir=dirpath)
+        os.close(fd)
+        self._count = 0
+        self._db = sqlite3.connect(self.filepath, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=OFF')
+        self._db.execute('PRAGMA synchronous=OFF')
+        self._db.execute('PRAGMA cache_size=-{}'.format(cache_kib))
+        self._db.execute('CREATE TABLE urls (url TEXT PRIMARY KEY) WITHOUT ROWID')
+
+
+    def __contains__(self, url):
+        return self._db.execute('SELECT 1 FROM urls WHERE url = ?', (url,)).fetchone() is not None
+
+
+    def __len__(self):
+        return self._count
+
+
+    def add(self, url):
+        cursor = self._db.execute('INSERT OR IGNORE INTO urls VALUES (?)', (url,))
+        self._count += cursor.rowcount
+
+
+    def close(self):
+        self._db.close()
+        if os.path.exists(self.filepath):
+            os.remove(self.filepath)
+
+
+def seen_set(mode='exact', capacity=BLOOM_CAPACITY, error_rate=BLOOM_ERROR_RATE):
+    """Set of seen URLs for parser.unique_urls.
+
+    Args:
+        - mode: str - 'exact' (in memory), 'bloom' or 'disk'
+        - capacity: int - URLs held in fixed memory by the bloom filter
+        - error_rate: float - bloom filter false positive rate
+
+    Returns: set, BloomFilter or DiskSet
+    """
+
+    if mode == 'bloom':
+        return BloomFilter(capacity, error_rate)
+    elif mode == 'disk':
+        return DiskSet()
+    return set()
+
+
+# ------------------------------------------------------------------------------
+def _write_run(urls, dirpath, index):
+    filepath = os.path.join(dirpath, 'run{:05}.txt'.format(index))
+    with open(filepath, 'w', encoding=RUN_ENCODING, errors='surrogateescape') as f:
+        for url in urls:
+            f.write(url)
+            f.write('\n')
+    return filepath
+
+
+def _read_run(f):
+    for line in f:
+        yield line[:-1]
+
+
+def sorted_unique(urls, run_size=SORT_RUN_SIZE):
+    """Sorts and deduplicates urls holding at most run_size URLs in memory.
+
+    Input beyond run_size is sorted in runs written to a temporary directory,
+    which are then merged.
+
+    Args:
+        - urls: iterable of URLs, which never contain line breaks
+        - run_size: int - URLs sorted in memory at a time
+
+    Yields:
+        unique URLs in sorted order
+    """
+
+    run = set()
+    url_iter = iter(urls)
+    for url in url_iter:
+        run.add(url)
+        if len(run) >= run_size:
+            break
+    else:
+        for url in sorted(run):
+            yield url
+        return
+
+    with tempfile.TemporaryDirectory(prefix='geturls_sort_') as dirpath:
+        runs = [_write_run(sorted(run), dirpath, 0)]
+        run = set()
+        for url in url_iter:
+            run.add(url)
+            if len(run) >= run_size:
+                runs.append(_write_run(sorted(run), dirpath, len(runs)))
+                run = set()
+        if run:
+            runs.append(_write_run(sorted(run), dirpath, len(runs)))
+        run = None
+
+        files = [open(filepath, 'r', encoding=RUN_ENCODING, errors='surrogateescape') for filepath in runs]
+        try:
+            previous = None
+            for url in heapq.merge(*(_read_run(f) for f in files)):
+                if url != previous:
+                    yield url
+                    previous = url
+        finally:
+            for f in files:
+                f.close()
+
+
+# ------------------------------------------------------------------------------
@@ -0,0 +1,216 @@
+"""Accept / reject rules for parsed URLs, compiled once and applied to the
+URL stream before deduplication so rejected URLs are never stored.
+"""
+
+import fnmatch
+import re
+# ------------------------------------------------------------------------------
+ACCEPT = 'accept'
+REJECT = 'reject'
+# inline flags like (?i) apply to the whole expression and must lead it
+GLOBAL_FLAGS = re.compile(r'\(\?[aiLmsux]+\)')
+
+
+def url_host(url):
+    """Host of a normalized scheme://host/path URL, without port.
+
+    Returns: str
+    """
+
+    netloc = url.split('/', 3)[2] if url.count('/') >= 2 else ''
+    return netloc.rsplit('@', 1)[-1].split(':', 1)[0].lower()
+
+
+def url_path(url):
+    """Path of a normalized scheme://host/path URL, starting with '/'.
+
+    Returns: str
+    """
+
+    parts = url.split('/', 3)
+    return '/' + parts[3] if len(parts) > 3 else '/'
+
+
+def glob_regex(glob):
+    """Regex source matching the whole of a string against a shell glob."""
+
+    pattern = fnmatch.translate(glob)
+    if pattern.endswith(r'\Z(?ms)'):
+        # Python 3.6 places the flags at the end, which can not be combined
+        pattern = '(?s:{})\\Z'.format(pattern[:-len(r'\Z(?ms)')])
+    return pattern
+
+
+# ------------------------------------------------------------------------------
+class _TypeMatcher(object):
+    """URLs ending with any of a set of file extensions."""
+
+    def __init__(self, types):
+        self.patterns = tuple('.' + ft if not ft.startswith('.') else ft for ft in types)
+
+
+    def match(self, url):
+        if not url.endswith(self.patterns):
+            return -1
+        for ix, ft in enumerate(self.patterns):
+            if url.endswith(ft):
+                return ix
+
+
+class _HostMatcher(object):
+    """URLs whose host is, or is a subdomain of, any of a set of hosts."""
+
+    def __init__(self, hosts):
+        self.patterns = tuple(host.lower().lstrip('.') for host in hosts)
+        self._index = {}
+        for ix, host in enumerate(self.patterns):
+            self._index.setdefault(host, ix)
+
+
+    def match(self, url):
+        host = url_host(url)
+        while host:
+            ix = self._index.get(host)
+            if ix is not None:
+                return ix
+            host = host.partition('.')[2]
+        return -1
+
+
+class _PatternMatcher(object):
+    """URLs matching any of a list of regexes, searched as one alternation
+    when none of them use groups or inline global flags of their own.
+    """
+
+    def __init__(self, patterns, sources, part=None, search=True):
+        self.patterns = tuple(patterns)
+        self._part = part
+        compiled = [re.compile(source) for source in sources]
+        if not any(regex.groups or GLOBAL_FLAGS.match(regex.pattern) for regex in compiled):
+            combined = '|'.join('(?P<p{}>{})'.format(ix, source) for ix, source in enumerate(sources))
+            regex = re.compile(combined)
+            self._combined = regex.search if search else regex.match
+            self._each = None
+        else:
+            self._combined = None
+            self._each = [regex.search if search else regex.match for regex in compiled]
+
+
+    def match(self, url):
+        text = self._part(url) if self._part else url
+        if self._combined:
+            found = self._combined(text)
+            return int(found.lastgroup[1:]) if found else -1
+        for ix, match in enumerate(self._each):
+            if match(text):
+                return ix
+        return -1
+
+
+# ------------------------------------------------------------------------------
+class URLFilter(object):
+    """Accept and reject rules by file extension, host, path glob and regex.
+
+    A URL passes when, for each kind of rule with accept rules, it matches
+    at least one of them, and it matches no reject rule. Hosts match
+    themselves and their subdomains, globs match the whole URL path and
+    regexes are searched anywhere in the URL.
+
+    Attributes:
+        - active: bool
+            - any rules set
+        - passed: int
+        - dropped: int
+
+    Methods:
+        - accepts
+            Checks one URL, counting rule hits
+        - filter
+            Yields URLs passing all rules
+        - hits
+            Hit counts of each rule
+    """
+
+    def __init__(self, accept_types=(), reject_types=(), accept_hosts=(), reject_hosts=(),
+                 accept_globs=(), reject_globs=(), accept_regexes=(), reject_regexes=()):
+        self.passed = 0
+        self.dropped = 0
+        self._rules = []
+
+        kinds = (('type', accept_types, reject_types, _TypeMatcher),
+                 ('host', accept_hosts, reject_hosts, _HostMatcher),
+                 ('glob', accept_globs, reject_globs,
+                  lambda globs: _PatternMatcher(globs, [glob_regex(glob) for glob in globs], url_path, search=False)),
+                 ('regex', accept_regexes, reject_regexes,
+                  lambda regexes: _PatternMatcher(regexes, regexes)))
+
+        for kind, accept, reject, matcher in kinds:
+            for action, patterns in ((ACCEPT, accept), (REJECT, reject)):
+                if patterns:
+                    compiled = matcher(list(patterns))
+                    self._rules.append((action, kind, compiled, [0] * len(compiled.patterns)))
+
+        self._accept_rules = [rule for rule in self._rules if rule[0] == ACCEPT]
+        self._reject_rules = [rule for rule in self._rules if rule[0] == REJECT]
+        # urls dropped for not matching any accept rule of a kind
+        self._unmatched = {rule[1]: 0 for rule in self._accept_rules}
+
+
+    @property
+    def active(self):
+        return bool(self._rules)
+
+
+    def accepts(self, url):
+        """Returns: bool - url passes all rules"""
+
+        for _, kind, matcher, counts in self._accept_rules:
+            ix = matcher.match(url)
+            if ix == -1:
+                self._unmatched[kind] += 1
+                self.dropped += 1
+                return False
+            counts[ix] += 1
+
+        for _, _, matcher, counts in self._reject_rules:
+            ix = matcher.match(url)
+            if ix != -1:
+                counts[ix] += 1
+                self.dropped += 1
+                return False
+
+        self.passed += 1
+        return True
+
+
+    def filter(self, urls):
+        """Yields urls passing all rules."""
+
+        if not self._rules:
+            for url in urls:
+                yield url
+            return
+
+        accepts = self.accepts
+        for url in urls:
+            if accepts(url):
+                yield url
+
+
+    def hits(self):
+        """URLs matched by each rule. Accept rules count matches checked in
+        turn, reject rules count URLs dropped.
+
+        Returns: list of (description, count)
+        """
+
+        rows = []
+        for action, kind, matcher, counts in self._rules:
+            for pattern, count in zip(matcher.patterns, counts):
+                rows.append(('{} {} {}'.format(action, kind, pattern), count))
+            if action == ACCEPT:
+                rows.append(('{} {} - no match'.format(action, kind), self._unmatched[kind]))
+        return rows
+
+
+# ------------------------------------------------------------------------------
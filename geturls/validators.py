@@ -0,0 +1,133 @@
+"""Persistent store of HTTP cache validators for conditional requests.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+# ------------------------------------------------------------------------------
+VALIDATOR_DBNAME = '.geturls_cache.sqlite'
+
+
+class NotModified(object):
+    """Download status for a url the server reported as unchanged."""
+
+    def __repr__(self):
+        return 'NOT_MODIFIED'
+
+
+NOT_MODIFIED = NotModified()
+
+
+# ------------------------------------------------------------------------------
+class ValidatorStore(object):
+    """ETag / Last-Modified validators of previously downloaded urls.
+
+    Validators seen during a run are held until the file reaches its final
+    path, then saved together with that path and size. A conditional request
+    is only sent while the saved file still exists with the same size, so
+    deleted or edited files are downloaded again.
+
+    Attributes:
+        - filepath: str
+            - sqlite database path
+        - unchanged: list
+            - urls skipped after a 304 Not Modified response
+
+    Methods:
+        - request_headers
+            Conditional request headers for url
+        - remember
+            Holds validators from a response until its file is placed
+        - not_modified
+            Records url as unchanged
+        - commit_paths
+            Saves held validators with final file paths
+        - close
+    """
+
+    def __init__(self, filepath=VALIDATOR_DBNAME):
+        self.filepath = os.path.abspath(filepath)
+        self.unchanged = []
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.filepath, check_same_thread=False)
+        self._db.execute('CREATE TABLE IF NOT EXISTS validators ('
+                         'url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, '
+                         'size INTEGER, path TEXT, updated REAL)')
+        self._db.commit()
+
+
+    def request_headers(self, url):
+        """Returns: dict - If-None-Match / If-Modified-Since headers, empty if
+        url has no usable validators
+        """
+
+        with self._lock:
+            row = self._db.execute('SELECT etag, last_modified, size, path FROM validators WHERE url = ?',
+                                   (url,)).fetchone()
+        if not row:
+            return {}
+
+        etag, last_modified, size, path = row
+        try:
+            if os.path.getsize(path) != size:
+                return {}
+        except (OSError, TypeError):
+            return {}
+
+        headers = {}
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+        return headers
+
+
+    def remember(self, url, headers):
+        """Holds validators of a response until its file is placed.
+
+        Args:
+            - url: str
+            - headers: http.client.HTTPMessage or mapping of response headers
+        """
+
+        etag = headers.get('ETag')
+        last_modified = headers.get('Last-Modified')
+        if etag or last_modified:
+            with self._lock:
+                self._pending[url] = (etag, last_modified)
+
+
+    def not_modified(self, url):
+        with self._lock:
+            self.unchanged.append(url)
+
+
+    def commit_paths(self, log_details):
+        """Saves held validators for placed files.
+
+        Args:
+            - log_details: list - (date, time, url, path, ...) tuples from write_files
+        """
+
+        rows = []
+        now = time.time()
+        with self._lock:
+            for row in log_details:
+                url, path = row[2], row[3]
+                validators = self._pending.pop(url, None)
+                if validators:
+                    etag, last_modified = validators
+                    rows.append((url, etag, last_modified, os.path.getsize(path), path, now))
+
+            self._db.executemany('INSERT OR REPLACE INTO validators VALUES (?, ?, ?, ?, ?, ?)', rows)
+            self._db.commit()
+
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+# ------------------------------------------------------------------------------
@@ -1,88 +1,156 @@
 import csv
 import os
+import time
 
-from geturls.dir_tools import confirm_directory, validate_netdir_trees
-from geturls.pathname import get_name, get_path, get_type, match_names_to_subdirs
+from geturls.dir_tools import confirm_directory, validate_netdir_tree
+from geturls.pathname import NameIndex, get_name, get_path, get_type, match_names_to_subdirs
 # ------------------------------------------------------------------------------
-def to_cwd(completed, overwrite):
-    log_details = []
+def place_file(temp_path, filepath, dedup=None):
+    """Moves downloaded file to filepath, or links it to an identical file
+    already placed when dedup is enabled.
 
-    namecache = set()
-    for filepath, url, net_path, filename, dl_timestamp in completed:
-        discrete_name = filename not in namecache
-        real_path, real_name = get_path(filename, overwrite=(overwrite and discrete_name))
-        os.rename(filepath, real_path)
-        namecache.add(filename)
+    Returns: str - path of file linked to, '' if temp_path was moved
+    """
 
-        date, clock = dl_timestamp
-        log_details.append((date, clock, url, os.path.abspath(real_path)))
+    if dedup:
+        return dedup.place(temp_path, filepath)
+    os.rename(temp_path, filepath)
+    return ''
 
-    return log_details
 
+def log_row(dl_timestamp, url, filepath, linked, dedup=None):
+    """Returns: tuple - (date, time, url, path), with linked path appended when dedup is enabled"""
 
-# ------------------------------------------------------------------------------
-def to_filetype_subdirs(completed, overwrite):
-    all_paths, urls, all_netdirs, all_names, all_timestamps = list(zip(*completed))
-    fn_types = [get_type(fn, subdir=True) for fn in all_names]
-    type_subdirs = sorted(set(fn_types))
-    for subdir in type_subdirs:
-        confirm_directory(subdir)
-
-    log_details = []
-    namecache = set()
-    for temp_path, url, filename, filetype, dl_timestamp in zip(all_paths, urls, all_names, fn_types, all_timestamps):
-        discrete_name = filename not in namecache
-        filepath, filename = get_path(filename, root=filetype, overwrite=(overwrite and discrete_name))
-        os.rename(temp_path, filepath)
-        namecache.add(filename)
-
-        date, clock = dl_timestamp
-        log_details.append((date, clock, url, os.path.abspath(filepath)))
-
-    return log_details
+    date, clock = dl_timestamp
+    row = (date, clock, url, os.path.abspath(filepath))
+    if dedup:
+        row += (linked,)
+    return row
 
 
 # ------------------------------------------------------------------------------
-def to_host_subdirs(completed, overwrite):
-    all_paths, urls, all_netdirs, all_names, all_timestamps = list(zip(*completed))
-    all_netdirs = validate_netdir_trees(all_netdirs)
+class FilePlacer(object):
+    """Moves each download to its final directory as soon as it completes,
+    so files show up while the rest of the batch is still downloading.
+
+    Name sorting groups files by the names of the whole batch, so with
+    dirsort_type 'name' files wait in the staging directory until finish.
+
+    Attributes:
+        - log_details: list - (date, time, url, path) rows of placed files
+
+    Methods:
+        - place
+            Places one completed download, or holds it for name sorting
+        - finish
+            Places held files
+    """
+
+    def __init__(self, dirsort_type='', overwrite=False, dedup=None, journal=None, transfer_log=None,
+                 metrics=None):
+        self.dirsort_type = dirsort_type
+        self.overwrite = overwrite
+        self.dedup = dedup
+        self.journal = journal
+        self.transfer_log = transfer_log
+        self.metrics = metrics
+        self.log_details = []
+        self._held = []
+        self._namecache = set()
+        self._names = NameIndex()
+        self._type_subdirs = set()
+        self._netdir_cache = {}
+
+
+    def _subdir(self, net_subdir, filename):
+        if self.dirsort_type == 'host':
+            return validate_netdir_tree(net_subdir, self._netdir_cache)
+        elif self.dirsort_type == 'type':
+            subdir = get_type(filename, subdir=True)
+            if subdir not in self._type_subdirs:
+                confirm_directory(subdir)
+                self._type_subdirs.add(subdir)
+            return subdir
+        return os.curdir
+
+
+    def _place(self, temp_path, url, filename, root, dl_timestamp):
+        start = time.perf_counter()
+        discrete_name = filename not in self._namecache
+        filepath, filename = get_path(filename, root=root, overwrite=(self.overwrite and discrete_name),
+                                      names=self._names)
+        linked = place_file(temp_path, filepath, self.dedup)
+        self._namecache.add(filename)
+
+        row = log_row(dl_timestamp, url, filepath, linked, self.dedup)
+        self.log_details.append(row)
+        if self.journal:
+            self.journal.placed([row])
+        if self.transfer_log:
+            self.transfer_log.placed(url, row[3])
+        if self.metrics:
+            self.metrics.add_phase('place', time.perf_counter() - start)
+
+
+    def place(self, completed):
+        """
+        Args:
+            - completed: tuple - (temp_path, url, net_subdir, filename, timestamp)
+        """
+
+        if self.dirsort_type == 'name':
+            self._held.append(completed)
+            return
+
+        temp_path, url, net_subdir, filename, dl_timestamp = completed
+        self._place(temp_path, url, filename, self._subdir(net_subdir, filename), dl_timestamp)
+
+
+    def finish(self):
+        """Places files held for name sorting.
+
+        Returns:
+            - log_details: list - rows of all files placed
+        """
+
+        if self._held:
+            start = time.perf_counter()
+            name_to_subdir = match_names_to_subdirs([filename for _, _, _, filename, _ in self._held])
+            for subdir in set(name_to_subdir.values()):
+                if subdir != os.curdir:
+                    confirm_directory(subdir)
+            if self.metrics:
+                self.metrics.add_phase('place', time.perf_counter() - start)
+
+            for temp_path, url, _, filename, dl_timestamp in self._held:
+                subdir = name_to_subdir.get(get_name(filename), os.curdir)
+                self._place(temp_path, url, filename, subdir, dl_timestamp)
+            self._held = []
+
+        return self.log_details
+
+
+def place_all(completed, dirsort_type, overwrite, dedup=None):
+    placer = FilePlacer(dirsort_type, overwrite, dedup)
+    for item in completed:
+        placer.place(item)
+    return placer.finish()
+
+
+def to_cwd(completed, overwrite, dedup=None):
+    return place_all(completed, '', overwrite, dedup)
+
+
+def to_filetype_subdirs(completed, overwrite, dedup=None):
+    return place_all(completed, 'type', overwrite, dedup)
+
+
+def to_host_subdirs(completed, overwrite, dedup=None):
+    return place_all(completed, 'host', overwrite, dedup)
 
-    log_details = []
-    namecache = set()
-    for temp_path, url, net_path, filename, dl_timestamp in zip(all_paths, urls, all_netdirs, all_names, all_timestamps):
-        discrete_name = filename not in namecache
-        filepath, filename = get_path(filename, root=net_path, overwrite=(overwrite and discrete_name))
-        os.rename(temp_path, filepath)
-        namecache.add(filename)
 
-        date, clock = dl_timestamp
-        log_details.append((date, clock, url, os.path.abspath(filepath)))
-
-    return log_details
-
-
-# ------------------------------------------------------------------------------
-def to_name_subdirs(completed, overwrite):
-    all_paths, urls, all_netdirs, all_names, all_timestamps = list(zip(*completed))
-    name_to_subdir = match_names_to_subdirs(all_names)
-
-    for subdir in set(name_to_subdir.values()):
-        if subdir != os.curdir:
-            confirm_directory(subdir)
-
-    log_details = []
-    namecache = set()
-    for temp_path, url, filename, dl_timestamp in zip(all_paths, urls, all_names, all_timestamps):
-        discrete_name = filename not in namecache
-        subdir = name_to_subdir.get(get_name(filename), os.curdir)
-        filepath, filename = get_path(filename, root=subdir, overwrite=(overwrite and discrete_name))
-        os.rename(temp_path, filepath)
-        namecache.add(filename)
-
-        date, clock = dl_timestamp
-        log_details.append((date, clock, url, os.path.abspath(filepath)))
-
-    return log_details
+def to_name_subdirs(completed, overwrite, dedup=None):
+    return place_all(completed, 'name', overwrite, dedup)
 
 
 # ------------------------------------------------------------------------------
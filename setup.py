@@ -22,8 +22,8 @@ import sys
 if sys.argv[-1] == 'setup.py':
     print("To install geturls, run 'python setup.py install'\n")
 
-if sys.version_info[:3] < (3, 4, 3):
-    print('geturls requires Python 3.4.3 or later ({}.{}.{} detected)'.format(*sys.version_info[:3]))
+if sys.version_info[:2] < (3, 6):
+    print('geturls requires Python 3.6 or later ({}.{}.{} detected)'.format(*sys.version_info[:3]))
     sys.exit(-1)
 
 
@@ -44,8 +44,6 @@ setup(
         'Intended Audience :: Developers',
         'Intended Audience :: End Users/Desktop',
         'License :: OSI Approved :: BSD License',
-        'Programming Language :: Python :: 3.4',
-        'Programming Language :: Python :: 3.5',
         'Programming Language :: Python :: 3.6',
         'Topic :: Internet',
         'Topic :: Utilities'
@@ -64,7 +62,8 @@ setup(
     entry_points={
         'console_scripts': [
             'geturls=geturls.geturls:main',
-            'geturls_simulate=geturls.progressbar:main'
+            'geturls_simulate=geturls.progressbar:main',
+            'geturls_benchmark=geturls.benchmarks:main'
         ],
     },
 )
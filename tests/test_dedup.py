@@ -0,0 +1,45 @@
+import os
+import tempfile
+import unittest
+
+from geturls.dedup import DedupIndex
+
+
+class DedupIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.dir = self._tmp.name
+        self.db_path = os.path.join(self.dir, 'dedup.sqlite')
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def write_temp(self, name, data):
+        path = os.path.join(self.dir, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def test_placed_digest_visible_before_close(self):
+        first = DedupIndex(self.db_path)
+        temp_path = self.write_temp('a.tmp', b'same content')
+        first.add_file(temp_path)
+        placed = os.path.join(self.dir, 'a.txt')
+        first.place(temp_path, placed)
+
+        second = DedupIndex(self.db_path)
+        try:
+            temp_path = self.write_temp('b.tmp', b'same content')
+            second.add_file(temp_path)
+            linked = second.place(temp_path, os.path.join(self.dir, 'b.txt'))
+        finally:
+            second.close()
+            first.close()
+
+        self.assertEqual(linked, os.path.abspath(placed))
+        self.assertEqual(second.linked, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+import threading
+import unittest
+
+from geturls import download
+from geturls.ratelimit import HostLimiter
+
+
+class RecordingPlacer(object):
+
+    def __init__(self):
+        self.placed = []
+        self.first_placed = threading.Event()
+
+    def place(self, item):
+        self.placed.append(item)
+        self.first_placed.set()
+
+
+class RunConcurrentTest(unittest.TestCase):
+
+    def test_download_placed_while_input_stalls(self):
+        placer = RecordingPlacer()
+        placed_before_resume = []
+
+        def tasks():
+            yield ('/tmp/a', 'http://example.com/a', 'example.com', 'a')
+            placed_before_resume.append(placer.first_placed.wait(5))
+            yield ('/tmp/b', 'http://example.com/b', 'example.com', 'b')
+
+        def fake_download(url, temp_path, progressbar, pool):
+            return True
+
+        read_tasks, results = download._run_concurrent(tasks(), fake_download, None, 0, 2, HostLimiter(),
+                                                        None, placer)
+
+        self.assertEqual(placed_before_resume, [True])
+        self.assertEqual([task[1] for task in read_tasks], ['http://example.com/a', 'http://example.com/b'])
+        self.assertTrue(all(status for status, _ in results))
+        self.assertEqual(len(placer.placed), 2)
+
+    def test_input_error_is_raised(self):
+        def tasks():
+            yield ('/tmp/a', 'http://example.com/a', 'example.com', 'a')
+            raise ValueError('bad input')
+
+        with self.assertRaises(ValueError):
+            download._run_concurrent(tasks(), lambda *args: True, None, 0, 2, HostLimiter(), None)
+
+
+if __name__ == '__main__':
+    unittest.main()